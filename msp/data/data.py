@@ -17,19 +17,33 @@ class Instance(object):
 class WordNormer:
     DIGIT_PATTERN = re.compile(r"\d")
 
+    MAX_CACHE_SIZE = 1000000
+
     def __init__(self, lower_case, norm_digit):
         self.lower_case = lower_case
         self.norm_digit = norm_digit
+        self.cache_ = {}  # surface form -> normed form, each distinct one is normed only once
 
-    def norm_one(self, w):
+    def _norm(self, w):
         if self.lower_case:
             w = str.lower(w)
         if self.norm_digit:
             w = WordNormer.DIGIT_PATTERN.sub("0", w)
         return w
 
+    def norm_one(self, w):
+        ret = self.cache_.get(w)
+        if ret is None:
+            ret = self._norm(w)
+            if len(self.cache_) < WordNormer.MAX_CACHE_SIZE:
+                self.cache_[w] = ret
+        return ret
+
     def norm_stream(self, s):
-        return [self.norm_one(w) for w in s]
+        if not self.lower_case and not self.norm_digit:
+            return list(s)
+        cache, norm_one = self.cache_, self.norm_one
+        return [cache[w] if w in cache else norm_one(w) for w in s]
 
 #
 class LineReader(Streamer):
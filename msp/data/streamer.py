@@ -1,6 +1,11 @@
 #
 
-from msp.utils import zopen, zcheck, zfatal
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from msp.utils import zopen, zcheck, zfatal, zlog
 from msp.utils import Constants, Random
 from typing import Iterable, Sequence
 
@@ -19,6 +24,7 @@ class Streamer(object):
         self.max_count_ = 0
         self.restart_times_ = 0
         self.active_ = False
+        self.last_len_ = -1  # length of the last full pass
 
     def __iter__(self):
         self.restart()      # for convenience
@@ -53,11 +59,19 @@ class Streamer(object):
         x = self._next()
         # todo(warn): assume instances can never be None!
         if self.is_eos(x):
+            if self.active_:
+                self.last_len_ = self.count_
             self.active_ = False
         else:
             self.count_ += 1
         return x
 
+    # cheap estimation of the number of items per pass, None if unknown
+    def estimate_len(self):
+        if self.last_len_ >= 0:
+            return self.last_len_
+        return self._estimate_len()
+
     # ===============
     # to be implemented
     def _next(self):
@@ -66,6 +80,9 @@ class Streamer(object):
     def _restart(self):
         raise NotImplementedError()
 
+    def _estimate_len(self):
+        return None
+
 # Item adapter/modifier, stacked streamers, driven by the ended Streamer
 class AdapterStreamer(Streamer):
     def __init__(self, base_streamer):
@@ -151,6 +168,9 @@ class FAdapterStreamer(AdapterStreamer):
         else:
             return z
 
+    def _estimate_len(self):
+        return self.base_streamer_.estimate_len()
+
 # f: Inst -> List[Inst] (augment or filter)
 class FListAdapterStream(AdapterStreamer):
     def __init__(self, base_streamer, f):
@@ -171,6 +191,150 @@ class FListAdapterStream(AdapterStreamer):
         self.cache_idx += 1
         return r
 
+# =====
+# Parallel Streamers
+
+# produce the items of the base streamer ahead of time by a background thread into a bounded queue
+# todo(note): the base streamers run in the producer thread with their own Random generators, which are seeded
+#  from Random("data") at each restart (in the consumer thread), thus the results are still deterministic
+class PrefetchStreamer(AdapterStreamer):
+    _END = object()  # sentinel for the end of one pass
+
+    def __init__(self, base_streamer, queue_size=16):
+        super().__init__(base_streamer)
+        self.queue_size = max(1, queue_size)
+        self.queue_ = None
+        self.thread_ = None
+        self.stop_flag_ = None
+        self.ended_ = True
+
+    def __del__(self):
+        self._stop()
+
+    # the producer for one pass
+    def _produce(self, q, stop_flag, seed):
+        Random.use_thread_generators(seed)
+        try:
+            while not stop_flag.is_set():
+                one = self.base_streamer_.next()
+                if self.base_streamer_.is_eos(one):
+                    break
+                PrefetchStreamer._put(q, one, stop_flag)
+        except BaseException as e:
+            PrefetchStreamer._put(q, e, stop_flag)
+        PrefetchStreamer._put(q, PrefetchStreamer._END, stop_flag)
+
+    @staticmethod
+    def _put(q, one, stop_flag):
+        while not stop_flag.is_set():
+            try:
+                q.put(one, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _stop(self):
+        if self.thread_ is not None:
+            self.stop_flag_.set()
+            self.thread_.join()
+            self.thread_ = None
+
+    def _restart(self):
+        self._stop()  # stop the previous pass before touching the base streamer
+        self.base_streamer_.restart()
+        self.queue_ = queue.Queue(self.queue_size)
+        self.stop_flag_ = threading.Event()
+        self.ended_ = False
+        seed = Random.randint(0, 1<<30, task="data")
+        self.thread_ = threading.Thread(target=self._produce, args=(self.queue_, self.stop_flag_, seed), daemon=True)
+        self.thread_.start()
+
+    def _next(self):
+        if self.ended_:
+            return None
+        one = self.queue_.get()
+        if one is PrefetchStreamer._END:
+            self.ended_ = True
+            self._stop()
+            return None
+        if isinstance(one, BaseException):
+            self.ended_ = True
+            self._stop()
+            raise one
+        return one
+
+    def _estimate_len(self):
+        return self.base_streamer_.estimate_len()
+
+# call f in the worker
+def _call_f(f, one):
+    return f(one)
+
+# for the process mode: f is sent once to each worker at its start rather than with each item
+_worker_f = None
+def _init_worker_f(f):
+    global _worker_f
+    _worker_f = f
+
+def _call_worker_f(one):
+    return _worker_f(one)
+
+# like FAdapterStreamer, but run f in a thread/process pool, keeping the original order
+# -> max_pending items are submitted ahead of time
+# todo(note): in process mode, f should be picklable, and the returned value is always used (no inplaced modification)
+class ParallelMapStreamer(AdapterStreamer):
+    def __init__(self, base_streamer, f, inplaced, num_workers=4, mode="thread", max_pending=0):
+        super().__init__(base_streamer)
+        zcheck(mode in ["thread", "process"], f"Unknown parallel mode: {mode}")
+        self.f = f
+        self.inplaced = inplaced and (mode == "thread")
+        self.num_workers = max(1, num_workers)
+        self.mode = mode
+        self.max_pending = max_pending if max_pending>0 else 4*self.num_workers
+        self.executor_ = None  # lazily built
+        self.pending_ = deque()
+        self.base_ended_ = False
+
+    def shutdown(self):
+        if self.executor_ is not None:
+            self.executor_.shutdown()
+            self.executor_ = None
+
+    def _restart(self):
+        # todo(note): simply discard the previous pending ones
+        for _, one_future in self.pending_:
+            one_future.cancel()
+        self.pending_.clear()
+        self.base_ended_ = False
+        self.base_streamer_.restart()
+
+    def _next(self):
+        if self.executor_ is None:
+            self.executor_ = ThreadPoolExecutor(self.num_workers) if self.mode=="thread" \
+                else ProcessPoolExecutor(self.num_workers, initializer=_init_worker_f, initargs=(self.f, ))
+        # fill the window
+        while not self.base_ended_ and len(self.pending_) < self.max_pending:
+            one = self.base_streamer_.next()
+            if self.base_streamer_.is_eos(one):
+                self.base_ended_ = True
+                break
+            if self.mode == "thread":
+                one_future = self.executor_.submit(_call_f, self.f, one)
+            else:
+                one_future = self.executor_.submit(_call_worker_f, one)
+            self.pending_.append((one, one_future))
+        if len(self.pending_) == 0:
+            return None
+        one, one_future = self.pending_.popleft()
+        z = one_future.result()
+        if self.inplaced:
+            return one
+        else:
+            return z
+
+    def _estimate_len(self):
+        return self.base_streamer_.estimate_len()
+
 # =====
 # Random Streams
 
@@ -235,14 +399,17 @@ class MultiStreamer(Streamer):
 #
 # simple concat multi-streamer
 # -- DropStreamer + MultiCat + ShuffleStreamer can be a good mixer
+# -- shuffle: shuffle the order of the base ones (for example, shards of files) at each restart
 class MultiCatStreamer(MultiStreamer):
-    def __init__(self, base_streamers: Sequence):
+    def __init__(self, base_streamers: Sequence, shuffle=False):
         super().__init__(base_streamers)
+        self.shuffle = shuffle
+        self.order_ = list(range(self.num_streamers_))
         self._mc_set_cur(0)
 
     def _mc_set_cur(self, i):
         self.cur_idx_ = i
-        self.cur_streamer_ = None if self.cur_idx_>=self.num_streamers_ else self.base_streamers_[self.cur_idx_]
+        self.cur_streamer_ = None if self.cur_idx_>=self.num_streamers_ else self.base_streamers_[self.order_[self.cur_idx_]]
 
     def _next(self):
         while True:
@@ -257,46 +424,142 @@ class MultiCatStreamer(MultiStreamer):
     def _restart(self):
         for one in self.base_streamers_:
             one.restart()
+        if self.shuffle:
+            Random.shuffle(self.order_, "data")
         self._mc_set_cur(0)
 
 #
-# like MultiCat, but join the streams (horizontally) rather than concat (vertically)
-# todo(note): currently mixing them 1 by 1; maybe not efficient enough if there are too many streamers
-class MultiJoinStreamer(MultiStreamer):
-    def __init__(self, base_streamers: Sequence):
+# weighted mixer of multiple streams (one item per selection)
+# -- weights: None means round-robin, otherwise sampling the source with prob ~ weight**(1/temperature)
+#    (each weight can be a number or a ScheduledValue-like one with __float__, which is re-read at each restart)
+#    (temperature>0 with weights=None means using the estimated sizes as weights, the usual multi-lingual sampling)
+# -- stop_sidx: -1 means ending when all are exhausted (each item exactly once per pass),
+#    otherwise ending when this one is exhausted and the others are wrapped around
+# todo(note): O(1) per item: alias-table for sampling, exhausted/empty ones are dropped (only rebuild at these points)
+class MultiMixStreamer(MultiStreamer):
+    def __init__(self, base_streamers: Sequence, weights: Sequence = None, temperature=0., stop_sidx=-1, report_stat=False):
         super().__init__(base_streamers)
-        self.cur_pointer = 0
-        self.ended = [False] * len(self.base_streamers_)
+        zcheck(weights is None or len(weights)==self.num_streamers_, "Unmatched number of weights!")
+        self.weights = None if weights is None else list(weights)
+        self.temperature = temperature
+        self.stop_sidx = stop_sidx
+        self.report_stat = report_stat
+        self.sampling = (self.weights is not None) or temperature>0.
+        self.random_sampler_ = Random.stream(lambda size: Random.random_sample(size, task="data"))
+        # status
+        self.active_idxes_ = []  # idxes of the active base streamers
+        self.cur_weights_ = None  # weights of the current pass
+        self.ptr_ = 0  # round-robin pointer (into active_idxes_)
+        self.alias_probs_, self.alias_idxes_ = [], []  # alias table (aligned with active_idxes_)
+        self.stats_ = [0] * self.num_streamers_  # number of items from each one in the current pass
+        self.epochs_ = [0] * self.num_streamers_  # number of full passes of each one
+
+    # weights of all the base streamers, None if round-robin
+    def _get_weights(self):
+        if not self.sampling:
+            return None
+        if self.weights is not None:
+            ws = [float(z) for z in self.weights]
+        else:
+            # todo(note): unknown sizes (for example, before the first full pass) are taken as the average of known ones
+            ws = [s.estimate_len() for s in self.base_streamers_]
+            known_ws = [z for z in ws if z is not None]
+            avg_w = sum(known_ws)/len(known_ws) if len(known_ws)>0 else 1.
+            ws = [float(avg_w if z is None else z) for z in ws]
+        if self.temperature > 0.:
+            ws = [max(z, 0.) ** (1./self.temperature) for z in ws]
+        return ws
+
+    # Vose's alias method for the current active ones
+    def _build_alias(self):
+        if not self.sampling:
+            return
+        ws = [self.cur_weights_[i] for i in self.active_idxes_]
+        num = len(ws)
+        w_sum = sum(ws)
+        probs = [z*num/w_sum for z in ws] if w_sum>0 else [1.]*num
+        aliases = list(range(num))
+        smalls = [i for i,p in enumerate(probs) if p<1.]
+        larges = [i for i,p in enumerate(probs) if p>=1.]
+        while len(smalls)>0 and len(larges)>0:
+            one_s, one_l = smalls.pop(), larges[-1]
+            aliases[one_s] = one_l
+            probs[one_l] -= (1.-probs[one_s])
+            if probs[one_l] < 1.:
+                smalls.append(larges.pop())
+        for i in smalls+larges:  # remaining ones (numerical errors)
+            probs[i] = 1.
+        self.alias_probs_, self.alias_idxes_ = probs, aliases
+
+    # select an active one, return the position in active_idxes_
+    def _select(self):
+        num = len(self.active_idxes_)
+        if self.sampling:
+            r = next(self.random_sampler_) * num
+            k = int(r)
+            if k >= num:
+                k = num-1
+            return k if (r-k)<self.alias_probs_[k] else self.alias_idxes_[k]
+        else:
+            k = self.ptr_
+            self.ptr_ = (k+1) % num
+            return k
+
+    def _drop(self, k):
+        self.active_idxes_.pop(k)
+        if len(self.active_idxes_) > 0:
+            self.ptr_ = k % len(self.active_idxes_)  # continue with the next one
+            self._build_alias()
 
     def _next(self):
-        # find the next active streamer
-        starting_point = self.cur_pointer
-        num_streamers = self.num_streamers_
-        cur_point = starting_point
-        flag_success = False
-        one = None
-        for i in range(num_streamers):  # at most travel one round
-            if not self.ended[cur_point]:
-                new_streamer = self.base_streamers_[cur_point]
-                one = new_streamer.next()
-                if new_streamer.is_eos(one):
-                    self.ended[cur_point] = True
-                else:
-                    flag_success = True
-            cur_point = (cur_point + 1) % num_streamers
-            if flag_success:
-                break
-        self.cur_pointer = cur_point
-        if flag_success:
+        while len(self.active_idxes_) > 0:
+            k = self._select()
+            sidx = self.active_idxes_[k]
+            cur_streamer = self.base_streamers_[sidx]
+            one = cur_streamer.next()
+            if cur_streamer.is_eos(one):
+                self.epochs_[sidx] += 1
+                if sidx == self.stop_sidx:
+                    return None  # end of this pass (need restart)
+                if self.stop_sidx >= 0:
+                    cur_streamer.restart()  # wrap around right now
+                    one = cur_streamer.next()
+                if cur_streamer.is_eos(one):  # exhausted (or empty)
+                    self._drop(k)
+                    continue
+            self.stats_[sidx] += 1
             return one
+        return None
+
+    def _restart(self):
+        if self.report_stat and self.restart_times_>0:
+            zlog(f"From the multi-mixer, last pass stats: {self.stats_}, full passes: {self.epochs_}")
+        if self.restart_times_==0 or self.stop_sidx<0:
+            for one in self.base_streamers_:
+                one.restart()
         else:
+            # only restart the stop_sidx one, the others continue
+            self.base_streamers_[self.stop_sidx].restart()
+        self.stats_ = [0] * self.num_streamers_
+        self.cur_weights_ = self._get_weights()
+        if self.sampling:
+            self.active_idxes_ = [i for i,w in enumerate(self.cur_weights_) if w>0.]
+            zcheck(self.stop_sidx<0 or self.stop_sidx in self.active_idxes_, "Never-stop mixer: zero weight for stop_sidx!")
+        else:
+            self.active_idxes_ = list(range(self.num_streamers_))
+        self.ptr_ = 0
+        self._build_alias()
+
+    def _estimate_len(self):
+        if self.stop_sidx >= 0:
             return None
+        lens = [s.estimate_len() for s in self.base_streamers_]
+        return None if any(z is None for z in lens) else sum(lens)
 
-    def _restart(self):
-        for one in self.base_streamers_:
-            one.restart()
-        self.cur_pointer = 0
-        self.ended = [False] * len(self.base_streamers_)
+# like MultiCat, but join the streams (horizontally) rather than concat (vertically): mixing them 1 by 1
+class MultiJoinStreamer(MultiMixStreamer):
+    def __init__(self, base_streamers: Sequence):
+        super().__init__(base_streamers)
 
 #
 # zip-like multi-streamer, with various modes, return a list of instances
@@ -405,23 +668,54 @@ class InstCacher(Streamer):
                 self.cache.put(one)
         self.cache.reset()
 
-# todo(+1): partial shuffle to avoid read all?
+    # all the cached insts (read all if not yet), None if not supported by the cache
+    def get_cached_insts(self):
+        if self.restart_times_ == 0:
+            self.restart()
+        return getattr(self.cache, "c", None)
+
+    def _estimate_len(self):
+        if self.restart_times_ == 0:
+            self.restart()
+        return len(self.cache)
+
+# buffer_size: -1 means read all and shuffle, otherwise shuffle with a bounded buffer (random pick from the window)
 class ShuffleStreamer(AdapterStreamer):
-    # -1 means read all and shuffle
-    def __init__(self, src_stream, cache_builder=InplacedCache):
+    def __init__(self, src_stream, cache_builder=InplacedCache, buffer_size=-1):
         super().__init__(src_stream)
         self.src = src_stream
         self.cache = cache_builder(shuffle=True)
+        self.buffer_size = buffer_size
+        self.buffer_ = []
+        self.rs_ = Random.stream(lambda size: Random.random_sample(size, "data"))
 
     def _next(self):
-        return self.cache.get()
+        if self.buffer_size <= 0:
+            return self.cache.get()
+        # fill the buffer
+        buffer = self.buffer_
+        while len(buffer) < self.buffer_size:
+            one = self.src.next()
+            if self.src.is_eos(one):
+                break
+            buffer.append(one)
+        if len(buffer) == 0:
+            return None
+        # swap the picked one to the end and pop
+        idx = min(int(next(self.rs_) * len(buffer)), len(buffer)-1)
+        buffer[idx], buffer[-1] = buffer[-1], buffer[idx]
+        return buffer.pop()
 
     def _restart(self):
-        # todo(note): rebuild cache each time (do not need to call super, since for-loop will trigger the src.restart)
-        self.cache.clear()
-        for one in self.src:
-            self.cache.put(one)
-        self.cache.reset()
+        if self.buffer_size <= 0:
+            # todo(note): rebuild cache each time (do not need to call super, since for-loop will trigger the src.restart)
+            self.cache.clear()
+            for one in self.src:
+                self.cache.put(one)
+            self.cache.reset()
+        else:
+            self.buffer_.clear()
+            self.src.restart()
 
 # =====
 # BatchHelper
@@ -430,11 +724,18 @@ class ShuffleStreamer(AdapterStreamer):
 # streamer: base, batch_size: sum(batch_size_f(z) for z), maxibatch_size: read-in bs*mbs every time,
 # dump_detectors, single_detectors, sorting_keyer: sort bs*mbs, shuffling: shuffle on buckets in bs*mbs
 # todo(warn): change IO-shape
+# padding_cost: None means the budget is the sum of batch_size_f, otherwise the budget is the padded cost
+# -- padding_cost(max_len, size) where max_len=max(len_f(one)), size=sum(batch_size_f(one)) over the batch
 class BatchArranger(AdapterStreamer):
-    def __init__(self, streamer, batch_size, maxibatch_size, batch_size_f, dump_detectors, single_detectors, sorting_keyer, shuffling):
+    def __init__(self, streamer, batch_size, maxibatch_size, batch_size_f, dump_detectors, single_detectors, sorting_keyer, shuffling,
+                 padding_cost=None, len_f=len):
         super(BatchArranger, self).__init__(streamer)
         self.batch_size = batch_size
         self.batch_size_f = (lambda one: 1) if batch_size_f is None else batch_size_f
+        self.padding_cost = padding_cost
+        self.len_f = len_f
+        if padding_cost is not None and sorting_keyer is None:
+            sorting_keyer = len_f  # length bucketing to reduce padding
         # todo(notice): if <=0 then read all at one time and possibly sort all
         self.maxibatch_size = maxibatch_size if maxibatch_size>0 else Constants.INT_PRAC_MAX
         if dump_detectors is not None and not isinstance(dump_detectors, Iterable):
@@ -449,6 +750,25 @@ class BatchArranger(AdapterStreamer):
         self.buffered_bsize_ = 0
         self.buffer_ = []           # list of instances
         self.buckets_ = []          # list of already prepared batch of instances
+        # padding stat (only for padding_cost mode): real cost, padded cost, num of batches
+        self.pad_stat_ = [0, 0, 0]
+
+    # get cost of one instance
+    def _get_cost(self, one):
+        if self.padding_cost is None:
+            return self.batch_size_f(one)
+        else:
+            return self.padding_cost(self.len_f(one), self.batch_size_f(one))
+
+    # padding efficiency = real / padded
+    def padding_info(self):
+        real, padded, nb = self.pad_stat_
+        return f"Padding: batch={nb}, real={real}, padded={padded}, eff={real/max(padded,1):.4f}"
+
+    # token-budget modes: ""(no padding-cost), "tok"(max_len*n), "tok2"(max_len*max_len*n, for example, for biaffine/mst)
+    @staticmethod
+    def get_padding_cost(mode: str):
+        return {"": None, "tok": lambda m, n: m*n, "tok2": lambda m, n: m*m*n}[mode]
 
     @property
     def k(self):
@@ -469,6 +789,9 @@ class BatchArranger(AdapterStreamer):
         self.buffered_bsize_ = 0
         self.buffer_ = []
         self.buckets_ = []
+        if self.pad_stat_[-1] > 0:
+            zlog(self.padding_info())
+            self.pad_stat_ = [0, 0, 0]
 
     # get the next mini-batch
     def _next(self):
@@ -491,7 +814,7 @@ class BatchArranger(AdapterStreamer):
                     return [one]
                 # add this instance to buffer
                 self.buffer_.append(one)
-                self.buffered_bsize_ += self.batch_size_f(one)
+                self.buffered_bsize_ += self._get_cost(one)
             # prepare buffering
             if len(self.buffer_) > 0:
                 # sorting
@@ -499,18 +822,7 @@ class BatchArranger(AdapterStreamer):
                 if self.sorting_keyer is not None:
                     sorted_buffer.sort(key=self.sorting_keyer)      # small first
                 # prepare buckets
-                buckets = []
-                tmp_bsize = 0
-                tmp_bucket = []
-                for one in sorted_buffer:
-                    tmp_bsize += self.batch_size_f(one)
-                    tmp_bucket.append(one)
-                    if tmp_bsize >= self.batch_size:
-                        buckets.append(tmp_bucket)
-                        tmp_bsize = 0
-                        tmp_bucket = []
-                if len(tmp_bucket) > 0:
-                    buckets.append(tmp_bucket)
+                buckets = self._arrange(sorted_buffer)
                 # another shuffle?
                 if self.shuffling:
                     Random.shuffle(buckets, "data")
@@ -527,3 +839,67 @@ class BatchArranger(AdapterStreamer):
             return ret
         else:
             return None
+
+    # sorted buffer -> list of buckets
+    def _arrange(self, sorted_buffer, record_stat=True):
+        if self.padding_cost is not None:
+            return self._arrange_padded(sorted_buffer, record_stat)
+        buckets = []
+        tmp_bsize = 0
+        tmp_bucket = []
+        for one in sorted_buffer:
+            tmp_bsize += self.batch_size_f(one)
+            tmp_bucket.append(one)
+            if tmp_bsize >= self.batch_size:
+                buckets.append(tmp_bucket)
+                tmp_bsize = 0
+                tmp_bucket = []
+        if len(tmp_bucket) > 0:
+            buckets.append(tmp_bucket)
+        return buckets
+
+    # add to the current bucket until the padded cost exceeds the budget (at least one per bucket)
+    def _arrange_padded(self, insts, record_stat=True):
+        padding_cost, len_f, batch_size_f = self.padding_cost, self.len_f, self.batch_size_f
+        pad_stat = self.pad_stat_ if record_stat else [0, 0, 0]
+        buckets = []
+        tmp_bucket, tmp_max_len, tmp_size = [], 0, 0
+        for one in insts:
+            one_len, one_size = len_f(one), batch_size_f(one)
+            new_max_len, new_size = max(tmp_max_len, one_len), tmp_size + one_size
+            if len(tmp_bucket) > 0 and padding_cost(new_max_len, new_size) > self.batch_size:
+                buckets.append(tmp_bucket)
+                pad_stat[1] += padding_cost(tmp_max_len, tmp_size)
+                tmp_bucket, new_max_len, new_size = [], one_len, one_size
+            tmp_bucket.append(one)
+            tmp_max_len, tmp_size = new_max_len, new_size
+            pad_stat[0] += padding_cost(one_len, one_size)
+        if len(tmp_bucket) > 0:
+            buckets.append(tmp_bucket)
+            pad_stat[1] += padding_cost(tmp_max_len, tmp_size)
+        pad_stat[2] += len(buckets)
+        return buckets
+
+    # simulate the arranging on the cached insts (without reading again), the same as _next except for the shuffling
+    def _estimate_len(self):
+        base = self.base_streamer_
+        insts = base.get_cached_insts() if isinstance(base, InstCacher) else None
+        if insts is None:
+            return None
+        num_batches = 0
+        buffer, buffered_bsize = [], 0
+        for one in insts + [None]:
+            if one is not None:
+                if any(f_(one) for f_ in self.dump_detectors):
+                    continue
+                if any(f_(one) for f_ in self.single_detectors):
+                    num_batches += 1
+                    continue
+                buffer.append(one)
+                buffered_bsize += self._get_cost(one)
+            if (one is None or buffered_bsize >= self.k) and len(buffer) > 0:
+                if self.sorting_keyer is not None:
+                    buffer.sort(key=self.sorting_keyer)
+                num_batches += len(self._arrange(buffer, False))
+                buffer, buffered_bsize = [], 0
+        return num_batches
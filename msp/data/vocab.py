@@ -6,6 +6,9 @@ from msp.utils import zopen, zlog, zwarn, zcheck, StrHelper, FileHelper, Helper,
 from collections import Iterable, defaultdict, OrderedDict
 import numpy as np
 import re
+import os
+import json
+from itertools import repeat
 
 # # for binary w2v loading
 # from gensim.models import KeyedVectors
@@ -32,6 +35,8 @@ class Vocab(object):
     # read & write
     @staticmethod
     def read(fname):
+        if fname.endswith(Vocab.BIN_SUFFIX):
+            return Vocab.read_bin(fname)
         one = Vocab()
         JsonRW.from_file(one, fname)
         zlog("-- Read Dictionary from %s: Finish %s." % (fname, len(one)), func="io")
@@ -41,6 +46,39 @@ class Vocab(object):
         JsonRW.to_file(self, fname)
         zlog("-- Write Dictionary to %s: Finish %s." % (fname, len(self)), func="io")
 
+    # binary format (npz): words joined by "\0", int vals with masks for None, others in a json header
+    BIN_SUFFIX = ".bin"
+
+    def write_bin(self, fname):
+        words = self.final_words
+        zcheck(all("\0" not in w for w in words), "Cannot write words with \\0 in binary format.")
+        header = {k: v for k, v in self.__dict__.items() if k not in ["v", "final_words", "final_vals"]}
+        vals = self.final_vals
+        int_vals = all(z is None or isinstance(z, int) for z in vals)
+        if int_vals:
+            vals_mask = np.asarray([z is not None for z in vals], dtype=np.bool_)
+            vals_arr = np.asarray([0 if z is None else z for z in vals], dtype=np.int64)
+        else:  # todo(note): rare case, simply put into the header
+            header["final_vals"] = vals
+            vals_mask = vals_arr = np.zeros(0, dtype=np.int64)
+        with open(fname, 'wb') as fd:
+            np.savez(fd, header=np.asarray(JsonRW.to_str(header)), words=np.frombuffer("\0".join(words).encode(), dtype=np.uint8),
+                     vals=vals_arr, vals_mask=vals_mask)
+        zlog("-- Write Dictionary(bin) to %s: Finish %s." % (fname, len(self)), func="io")
+
+    @staticmethod
+    def read_bin(fname):
+        one = Vocab()
+        with np.load(fname) as arrs:
+            one.__dict__.update(json.loads(str(arrs["header"])))
+            words_bytes = arrs["words"].tobytes()
+            one.final_words = words_bytes.decode().split("\0") if len(words_bytes)>0 else []
+            if "final_vals" not in one.__dict__ or one.final_vals is None:
+                one.final_vals = [v if m else None for v, m in zip(arrs["vals"].tolist(), arrs["vals_mask"].tolist())]
+        one.v = dict(zip(one.final_words, range(len(one.final_words))))
+        zlog("-- Read Dictionary(bin) from %s: Finish %s." % (fname, len(one)), func="io")
+        return one
+
     # -------------
     # queries
     def __str__(self):
@@ -85,6 +123,21 @@ class Vocab(object):
     def get_else_unk(self, item):
         return self.get(item, self.unk)
 
+    # list of token lists -> (flat int32 arr, offsets[N+1]), unk for unknown ones
+    def lookup_batch(self, list_of_tokens):
+        lens = [len(z) for z in list_of_tokens]
+        offsets = np.zeros(len(lens)+1, dtype=np.int64)
+        np.cumsum(lens, out=offsets[1:])
+        num = int(offsets[-1])
+        flat_tokens = (t for z in list_of_tokens for t in z)
+        flat = np.fromiter(map(self.v.get, flat_tokens, repeat(self.unk)), dtype=np.int32, count=num)
+        return flat, offsets
+
+    # one token list -> list of idxes
+    def lookup(self, tokens):
+        v_get, unk = self.v.get, self.unk
+        return list(map(v_get, tokens, repeat(unk)))
+
     # key -> value
     def getval(self, item, df=None):
         if item in self.v:
@@ -169,23 +222,28 @@ class Vocab(object):
         else:
             get_nohit = lambda s: (Random.random_sample((s,)).astype(np.float32)-0.5) * (2*init_nohit)
         #
-        ret = []
         res = defaultdict(int)
-        for w in self.final_words:
+        hit_idxes, hit_rows, nohit_idxes = [], [], []
+        for i, w in enumerate(self.final_words):
             hit, norm_name, norm_w = wv.norm_until_hit(w)
             if hit:
-                value = np.asarray(wv.get_vec(norm_w, norm=False), dtype=np.float32)
+                hit_idxes.append(i)
+                hit_rows.append(wv.wmap[norm_w])
                 res[norm_name] += 1
             else:
-                value = get_nohit(wv.embed_size)
-                # value = np.zeros((wv.embed_size,), dtype=np.float32)
+                nohit_idxes.append(i)
                 res["no-hit"] += 1
-            ret.append(value)
+        # gather by rows (the random ones for no-hit are drawn at once, which is the same as one by one)
+        ret = np.zeros([len(self.final_words), wv.embed_size], dtype=np.float32)
+        if len(hit_idxes) > 0:
+            ret[hit_idxes] = wv.vecs.take(hit_rows)
+        if len(nohit_idxes) > 0 and init_nohit > 0.:
+            ret[nohit_idxes] = get_nohit(len(nohit_idxes)*wv.embed_size).reshape([len(nohit_idxes), wv.embed_size])
         #
         if assert_all_hit:
             zcheck(res["no-hit"]==0, f"Filter-embed error: assert all-hit but get no-hit of {res['no-hit']}")
         printing("Filter pre-trained embed: %s, no-hit is inited with %s." % (res, init_nohit))
-        return np.asarray(ret, dtype=np.float32) * scale
+        return ret * scale
 
 #
 class VocabHelper:
@@ -360,6 +418,64 @@ class VocabBuilder(object):
         return self.finish(rf_filter, sort_by_count, target_range)
 
 # ===========
+# rows of embeddings from (possibly several) arrays (for example, np.memmap), without copying
+# -> each segment is (arr, row-idxes or None for all rows)
+class EmbedRows:
+    def __init__(self, arr=None):
+        self.segs = []
+        self.offsets = [0]
+        if arr is not None:
+            self.append_rows(arr, None)
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def append_rows(self, arr, rows):
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+        self.segs.append((arr, rows))
+        self.offsets.append(self.offsets[-1] + (len(arr) if rows is None else len(rows)))
+
+    # select (global) idxes from another one
+    def append_from(self, other: 'EmbedRows', idxes):
+        idxes = np.asarray(idxes, dtype=np.int64)
+        for (arr, rows), a, b in zip(other.segs, other.offsets[:-1], other.offsets[1:]):
+            one_idxes = idxes[(idxes>=a) & (idxes<b)] - a
+            if len(one_idxes) > 0:
+                self.append_rows(arr, one_idxes if rows is None else rows[one_idxes])
+
+    def _locate(self, idx):
+        s = int(np.searchsorted(self.offsets, idx, side='right')) - 1
+        arr, rows = self.segs[s]
+        local = idx - self.offsets[s]
+        return arr, (local if rows is None else rows[local])
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        arr, r = self._locate(idx)
+        return arr[r]
+
+    def __iter__(self):
+        for arr, rows in self.segs:
+            for r in (range(len(arr)) if rows is None else rows):
+                yield arr[r]
+
+    # gather rows by idxes -> float32 [len(idxes), D]
+    def take(self, idxes):
+        idxes = np.asarray(idxes, dtype=np.int64)
+        ret = None
+        for (arr, rows), a, b in zip(self.segs, self.offsets[:-1], self.offsets[1:]):
+            sel = np.nonzero((idxes>=a) & (idxes<b))[0]
+            if len(sel) == 0:
+                continue
+            local = idxes[sel] - a
+            one_vals = arr[local if rows is None else rows[local]]
+            if ret is None:
+                ret = np.zeros([len(idxes), arr.shape[-1]], dtype=np.float32)
+            ret[sel] = one_vals
+        return ret
+
 # todo(+1): should store {k: idx}?
 class WordVectors(object):
     # ordering of special normers
@@ -374,7 +490,7 @@ class WordVectors(object):
         self.embed_size = None
         self.words = []         # idx -> str
         self.wmap = {}          # str -> idx
-        self.vecs = []          # idx -> vec
+        self.vecs = EmbedRows()  # idx -> vec
         self.sep = sep
         #
         self.hits = {}  # hit keys by any queries with __contains__: norm_until_hit, has_key, get_vec
@@ -450,21 +566,27 @@ class WordVectors(object):
             zcheck(embed_size == other.embed_size, "Cannot merge two diff-sized embeddings!")
             this_all_num = other.num_words
             this_added_num = 0
-            for one_w, one_vec in zip(other.words, other.vecs):
+            added_idxes = []
+            for one_idx, one_w in enumerate(other.words):
                 # keep the old one!
                 if one_w not in self.wmap:  # here, does not record as hits!
                     this_added_num += 1
                     self.wmap[one_w] = len(self.words)
                     self.words.append(one_w)
-                    self.vecs.append(one_vec)
+                    added_idxes.append(one_idx)
+            self.vecs.append_from(other.vecs, added_idxes)  # todo(note): no copying of the arrays
             zlog(f"Merge embed: add another with all={this_all_num}/add={this_added_num}")
         zlog(f"After merge, changed from {self.num_words} to {len(self.words)}")
         self.num_words = len(self.words)        # remember to change this one!
     # =====
 
+    # todo(note): use the converted memory-mapped one if there is (and not older than the original one)
     @staticmethod
     def load(fname, binary=False, txt_sep=" ", aug_code=""):
-        if binary:
+        mm_words_fname = fname + WordVectors.MM_SUFFIX + ".words"
+        if os.path.isfile(mm_words_fname) and (not os.path.isfile(fname) or os.path.getmtime(mm_words_fname)>=os.path.getmtime(fname)):
+            vv = WordVectors._load_mm(fname + WordVectors.MM_SUFFIX)
+        elif binary:
             vv = WordVectors._load_bin(fname)
         else:
             vv = WordVectors._load_txt(fname, txt_sep)
@@ -477,6 +599,7 @@ class WordVectors(object):
         printing("Going to load pre-trained (txt) w2v from %s ..." % fname)
         one = WordVectors(sep=sep)
         repeated_count = 0
+        vecs = []
         with zopen(fname) as fd:
             # first line
             line = fd.readline()
@@ -503,14 +626,15 @@ class WordVectors(object):
                     one.embed_size = len(vec)
                 else:
                     zcheck(len(vec) == one.embed_size, "Unmatched embed dimension.")
-                one.vecs.append(vec)
+                vecs.append(np.asarray(vec, dtype=np.float32))
                 one.wmap[word] = len(one.words)
                 one.words.append(word)
                 line = fd.readline()
         # final
         if one.num_words is not None:
-            zcheck(one.num_words == len(one.vecs)+repeated_count, "Unmatched num of words.")
-        one.num_words = len(one.vecs)
+            zcheck(one.num_words == len(vecs)+repeated_count, "Unmatched num of words.")
+        one.num_words = len(vecs)
+        one.vecs = EmbedRows(np.stack(vecs) if len(vecs)>0 else np.zeros([0, one.embed_size or 0], dtype=np.float32))
         printing(f"Read ok: w2v num_words={one.num_words:d}, embed_size={one.embed_size:d}, repeat={repeated_count:d}")
         return one
 
@@ -524,13 +648,62 @@ class WordVectors(object):
         kv = KeyedVectors.load_word2vec_format(fname, binary=True)
         # KeyedVectors.save_word2vec_format()
         one.num_words, one.embed_size = len(kv.vectors), len(kv.vectors[0])
+        rows = []
         for w, z in kv.vocab.items():
-            one.vecs.append(kv.vectors[z.index])
+            rows.append(z.index)
             one.wmap[w] = len(one.words)
             one.words.append(w)
+        one.vecs = EmbedRows()
+        one.vecs.append_rows(np.asarray(kv.vectors, dtype=np.float32), rows)
         printing("Read ok: w2v num_words=%d, embed_size=%d." % (one.num_words, one.embed_size))
         return one
 
+    # =====
+    # memory-mapped format: "{fname}.mm" (float32 [N, D]) and "{fname}.mm.words" (first line "N D", then one word per line)
+    MM_SUFFIX = ".mm"
+
+    @staticmethod
+    def _load_mm(prefix):
+        printing("Going to load pre-trained (mmap) w2v from %s ..." % prefix)
+        one = WordVectors()
+        with zopen(prefix + ".words") as fd:
+            lines = fd.read().split("\n")
+        num_words, embed_size = [int(z) for z in lines[0].split()]
+        one.words = lines[1:num_words+1]
+        one.wmap = dict(zip(one.words, range(num_words)))
+        one.num_words, one.embed_size = num_words, embed_size
+        if num_words > 0:
+            one.vecs = EmbedRows(np.memmap(prefix, dtype=np.float32, mode='r', shape=(num_words, embed_size)))
+        else:
+            one.vecs = EmbedRows(np.zeros([0, embed_size], dtype=np.float32))
+        printing("Read ok: w2v num_words=%d, embed_size=%d." % (one.num_words, one.embed_size))
+        return one
+
+    # one-time conversion (streaming), keep the first one for repeated words as _load_txt
+    @staticmethod
+    def convert_txt_to_mm(fname, sep=" "):
+        prefix = fname + WordVectors.MM_SUFFIX
+        words, wset = [], set()
+        embed_size = None
+        with zopen(fname) as fd, open(prefix, 'wb') as fd_vec:
+            for line_idx, line in enumerate(fd):
+                fields = line.rstrip().split(sep)
+                if line_idx == 0 and len(fields) == 2:
+                    continue  # head line
+                if len(fields) <= 1 or fields[0] in wset:
+                    continue
+                vec = np.asarray(fields[1:], dtype=np.float32)
+                if embed_size is None:
+                    embed_size = len(vec)
+                zcheck(len(vec) == embed_size, "Unmatched embed dimension.")
+                vec.tofile(fd_vec)
+                words.append(fields[0])
+                wset.add(fields[0])
+        with zopen(prefix + ".words", 'w') as fd:
+            fd.write(f"{len(words)} {embed_size or 0}\n")
+            fd.write("\n".join(words))
+        printing(f"Convert w2v {fname} to {prefix}: num_words={len(words)}, embed_size={embed_size}")
+
 #
 class VocabPackage(object):
     def __init__(self, vocabs: Dict, embeds: Dict):
@@ -552,10 +725,14 @@ class VocabPackage(object):
     def put_emb(self, name, e):
         self.embeds[name] = e
 
+    # todo(note): prefer the binary one if it is not older than the txt one
     def load(self, prefix="./"):
         for name in self.vocabs:
             fname = prefix+"vv_"+name+".txt"
-            if FileHelper.exists(fname):
+            bin_fname = prefix+"vv_"+name+Vocab.BIN_SUFFIX
+            if FileHelper.exists(bin_fname) and (not FileHelper.exists(fname) or os.path.getmtime(bin_fname)>=os.path.getmtime(fname)):
+                self.vocabs[name] = Vocab.read_bin(bin_fname)
+            elif FileHelper.exists(fname):
                 self.vocabs[name] = Vocab.read(fname)
             else:
                 zwarn("Cannot find Vocab " + name)
@@ -572,6 +749,7 @@ class VocabPackage(object):
             fname = prefix + "vv_" + name + ".txt"
             if vv is not None:
                 vv.write(fname)
+                vv.write_bin(prefix + "vv_" + name + Vocab.BIN_SUFFIX)
         for name, vv in self.embeds.items():
             fname = prefix+"ve_"+name+".pic"
             if vv is not None:
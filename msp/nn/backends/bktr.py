@@ -365,10 +365,12 @@ binary_cross_entropy = F.binary_cross_entropy
 binary_cross_entropy_with_logits = F.binary_cross_entropy_with_logits
 clamp = torch.clamp
 diagflat = torch.diagflat
+diag_embed = torch.diag_embed
 elu = F.elu
 exp = torch.exp
 expand = lambda x, *args: x.expand(*args)
 gelu = getattr(F, "gelu", None)  # todo(warn): on older versions, this does not exist
+isnan = torch.isnan
 log = torch.log
 logsigmoid = F.logsigmoid
 logsumexp = torch.logsumexp
@@ -508,6 +510,14 @@ def zero_row(param, row):
 def no_grad_env():
     return torch.autograd.no_grad()
 
+# enable grad inside no_grad_env (for example, for autograd-based outside algorithms)
+def grad_env():
+    return torch.autograd.enable_grad()
+
+# d(output)/d(inputs), without accumulating to the .grad fields
+def get_grad(output, inputs):
+    return torch.autograd.grad(output, inputs)
+
 #
 def has_nan(t):
     return int(torch.isnan(t).sum())
@@ -549,6 +559,50 @@ except:
     gru_oper = thnn_backend.GRUCell
     lstm_oper = thnn_backend.LSTMCell
 
+# fused (one-layer) rnn over length-sorted packed sequences
+# inputs: [bs, len, D], lengths: np.array[bs] of int (all >0), weights: list (one per direction) of (w_ih, w_hh, b_ih, b_hh)
+# reverse: only for one direction, run it right-to-left (by reversing the valid part of each seq)
+# packed: None means auto, packing on gpu (skip padded steps), no packing on cpu (packed rnn is much slower on cpu)
+# -> [bs, len, n_dir*H], zeros at the padded steps
+def rnn_packed(rnn_type, inputs, lengths, weights, reverse=False, packed=None):
+    bsize, slen = inputs.shape[0], inputs.shape[1]
+    full = bool(np.all(lengths == slen))
+    if packed is None:
+        packed = inputs.is_cuda and not full
+    if reverse:
+        assert len(weights) == 1
+        rev_idxes = _get_reverse_idxes(slen, lengths, inputs.device).unsqueeze(-1)
+        output = rnn_packed(rnn_type, torch.gather(inputs, 1, rev_idxes.expand_as(inputs)), lengths, weights, packed=packed)
+        return torch.gather(output, 1, rev_idxes.expand_as(output))
+    if len(weights) == 2 and not packed and not full:
+        # todo(note): without packing, the backward direction should start from the last valid step
+        return torch.cat([rnn_packed(rnn_type, inputs, lengths, weights[:1], packed=False),
+                          rnn_packed(rnn_type, inputs, lengths, weights[1:], reverse=True, packed=False)], -1)
+    _f = {"lstm": _VF.lstm, "gru": _VF.gru}[rnn_type]
+    bidirectional = (len(weights) == 2)
+    hx = inputs.new_zeros(len(weights), bsize, weights[0][1].shape[1])
+    if rnn_type == "lstm":
+        hx = (hx, hx)
+    flat_weights = [w for one_ws in weights for w in one_ws]
+    train = torch.is_grad_enabled()  # todo(note): dropout is never used here, but only train-mode keeps states for bp
+    if packed:
+        packed_inputs = nn.utils.rnn.pack_padded_sequence(inputs, lengths, batch_first=True, enforce_sorted=False)
+        output = _f(packed_inputs.data, packed_inputs.batch_sizes, hx, flat_weights, True, 1, 0., train, bidirectional)[0]
+        output_packed = nn.utils.rnn.PackedSequence(output, packed_inputs.batch_sizes, packed_inputs.sorted_indices, packed_inputs.unsorted_indices)
+        return nn.utils.rnn.pad_packed_sequence(output_packed, batch_first=True, total_length=slen)[0]
+    else:
+        output = _f(inputs, hx, flat_weights, True, 1, 0., train, bidirectional, True)[0]
+        if not full:
+            valid_t = torch.tensor(np.arange(slen)[np.newaxis, :] < np.asarray(lengths)[:, np.newaxis], dtype=output.dtype, device=output.device)
+            output = output * valid_t.unsqueeze(-1)
+        return output
+
+# [bs, len]: (len-1-t) for the valid steps, t for the padded ones
+def _get_reverse_idxes(slen, lengths, device):
+    steps = np.arange(slen)[np.newaxis, :]
+    lengths = np.asarray(lengths)[:, np.newaxis]
+    return torch.tensor(np.where(steps<lengths, lengths-1-steps, steps), dtype=torch.long, device=device)
+
 # specific one for batched inv
 if int(torch.__version__.split(".")[0])>=1:
     # only available torch>=1.0.0
@@ -557,6 +611,12 @@ else:
     # otherwise use gesv, which is deprecated in some later version
     get_inverse = lambda M, DiagM: DiagM.gesv(M)[0]
 
+# batched log(abs(det)) by LU decomposition (no explicit inverse)
+if hasattr(torch, "linalg"):
+    get_logabsdet = lambda M: torch.linalg.slogdet(M)[1]
+else:
+    get_logabsdet = lambda M: torch.slogdet(M)[1]
+
 # special routines
 # todo(note): for mask->idx: 1) topk+sort, 2) padding with extra 1s; currently using 2)
 # the inputs should be 1. or 0. (float); [*, L] -> [*, max-count]
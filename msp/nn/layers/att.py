@@ -22,10 +22,15 @@ class AttConf(Conf):
         # mainly for multi-head
         self.head_count = 8
         self.use_ranges = False
+        self.range_dilation = 1  # dilated ranges: only attend to the ones whose distances are multiples of this
+        # banded attention (with use_ranges): only compute the scores inside the ranges (by sliding-window chunks)
+        self.band_att = False
+        self.band_min_len = 64  # fall back to the dense one for short inputs
         #
         self.clip_dist = 0
         self.use_neg_dist = False
         self.use_fix_dist = False
+        self.rel_efficient = True  # rel-dist terms by [*, len_q, n_dist] matmul + gather/scatter (no [*, len_q, len_k, D])
         #
         self.out_act = 'linear'
         # for relational one
@@ -103,6 +108,7 @@ class AttRangeHelper(BasicNode):
             self.att_ranges = [fixed_range_val] * self.head_count
         else:
             self.att_ranges = [2**z - 1 for z in range(self.head_count)]
+        self.dilation = max(1, aconf.range_dilation)
         self._att_ranges_t = None
 
     def refresh(self, rop=None):
@@ -119,8 +125,30 @@ class AttRangeHelper(BasicNode):
         rr_y = BK.unsqueeze(BK.arange_idx(0, query_len), 1)
         rr_xy = BK.abs(rr_x - rr_y).float().unsqueeze(0).expand(last_dims)  # [head, query, key]
         scores = att_scores_t.masked_fill(rr_xy > self._att_ranges_t, Constants.REAL_PRAC_MIN)
+        if self.dilation > 1:
+            scores = scores.masked_fill((rr_xy % self.dilation) != 0, Constants.REAL_PRAC_MIN)
         return scores
 
+    # =====
+    # banded attention: chunks of size c (in the dilated sub-seqs), each attends to keys of [start-r, end+r)
+    # -> scores are [*, head, n_chunk, c, c+2r] rather than [*, head, len, len]
+
+    # size of the window (in the dilated sub-seqs)
+    def get_band_range(self):
+        return max(self.att_ranges) // self.dilation
+
+    # offsets (in the original seq) of the chunked scores: [c, c+2r]
+    def get_band_offsets(self, chunk_size):
+        r = self.get_band_range()
+        a = BK.unsqueeze(BK.arange_idx(0, chunk_size), 1)
+        b = BK.unsqueeze(BK.arange_idx(0, chunk_size+2*r), 0)
+        return (b - r - a) * self.dilation
+
+    # [*, head, D, n_chunk, c, c+2r] masked by ranges
+    def mask_band(self, band_offsets, att_scores_t):
+        rr_xy = BK.abs(band_offsets).float()
+        return att_scores_t.masked_fill(rr_xy > self._att_ranges_t.view([-1, 1, 1, 1, 1]), Constants.REAL_PRAC_MIN)
+
 class AttDistHelper(BasicNode):
     def __init__(self, pc, aconf: AttConf, dim: int):
         super().__init__(pc, None, None)
@@ -137,24 +165,44 @@ class AttDistHelper(BasicNode):
             self.edge_values = self.add_sub_node("ev", Embedding(pc, 2 * self.clip_dist + 1, dim, fix_row0=False,
                                                                  init_rop=NoDropRop()))
 
-    def obatin_from_distance(self, distance):
+        self.n_dist = (2 * self.clip_dist + 1) if self.use_neg_dist else (self.clip_dist + 1)
+
+    # distance -> idx of the embedding tables
+    def get_dist_idxes(self, distance):
         # use different ranges!
         if not self.use_neg_dist:
-            distance = BK.clamp(BK.abs(distance), max=self.clip_dist)
+            return BK.clamp(BK.abs(distance), max=self.clip_dist)
         else:
-            distance = BK.clamp(distance, min=-self.clip_dist, max=self.clip_dist) + self.clip_dist
+            return BK.clamp(distance, min=-self.clip_dist, max=self.clip_dist) + self.clip_dist
+
+    def obatin_from_distance(self, distance):
+        distance = self.get_dist_idxes(distance)
         dist_atts = self.edge_atts(distance)
         dist_values = self.edge_values(distance)
         return dist_atts, dist_values
 
-    def __call__(self, query_len, key_len):
+    def get_distance(self, query_len, key_len):
         dist_x = BK.unsqueeze(BK.arange_idx(0, key_len), 0)
         dist_y = BK.unsqueeze(BK.arange_idx(0, query_len), 1)
-        distance = dist_x - dist_y  # [query, key]
+        return dist_x - dist_y  # [query, key]
+
+    def __call__(self, query_len, key_len):
+        distance = self.get_distance(query_len, key_len)
         dist_atts, dist_values = self.obatin_from_distance(distance)
         # [lenq, lenk], [lenq, lenk, dim], [lenq, lenk, dim]
         return distance, dist_atts, dist_values
 
+    # [n_dist, dim], [n_dist, dim]
+    def get_full_tables(self):
+        all_idxes = BK.arange_idx(0, self.n_dist)
+        return self.edge_atts(all_idxes), self.edge_values(all_idxes)
+
+    # memory-efficient version: idxes into the (small) tables instead of the expanded embeddings
+    def get_tables(self, query_len, key_len):
+        distance = self.get_distance(query_len, key_len)
+        # [lenq, lenk], [lenq, lenk], [n_dist, dim], [n_dist, dim]
+        return (distance, self.get_dist_idxes(distance)) + self.get_full_tables()
+
 # =====
 # basic multi-head
 class MultiHeadAttention(AttentionNode):
@@ -165,6 +213,7 @@ class MultiHeadAttention(AttentionNode):
         self.d_kqv = aconf.d_kqv
         self.clip_dist = aconf.clip_dist
         self.use_neg_dist = aconf.use_neg_dist
+        self.rel_efficient = aconf.rel_efficient
         # =====
         # pre-fixed values for later computation
         self._att_scale = math.sqrt(self.d_kqv)
@@ -172,6 +221,8 @@ class MultiHeadAttention(AttentionNode):
             self.range_clipper = self.add_sub_node("rc", AttRangeHelper(pc, aconf))
         else:
             self.range_clipper = None
+        self.band_att = aconf.band_att and aconf.use_ranges
+        self.band_min_len = aconf.band_min_len
         # =====
         eff_hidden_size = self.head_count * self.d_kqv
         # todo(+2): should we use more dropouts here?
@@ -203,12 +254,19 @@ class MultiHeadAttention(AttentionNode):
         batch_dim_size = len(BK.get_shape(key))-2
         query_len = BK.get_shape(query, -2)
         key_len = BK.get_shape(key, -2)
+        # decide the banded mode before anything of [len_q, len_k] is built
+        use_band = self.band_att and query_len==key_len and key_len>self.band_min_len and mask_qk is None \
+                   and not (eprob_qk is not None and eprob_mix_rate>0. and eprob_head_count>0) \
+                   and 2*self.range_clipper.get_band_range()+1 < key_len//self.range_clipper.dilation
         #
-        # prepare distances if needed
-        if self.use_distance:
-            distance, dist_atts, dist_values = self.dist_helper(query_len, key_len)
-        else:
+        # prepare distances if needed (the banded mode prepares its own [c, c+2r] ones)
+        dist_idxes = None
+        if use_band or not self.use_distance:
             distance, dist_atts, dist_values = None, None, None
+        elif self.rel_efficient:
+            distance, dist_idxes, dist_atts, dist_values = self.dist_helper.get_tables(query_len, key_len)
+        else:
+            distance, dist_atts, dist_values = self.dist_helper(query_len, key_len)
         #
         # 1. project the three
         key_up = self._shape_project(self.affine_k(key))        # [*, head, len_k, d_k]
@@ -216,9 +274,17 @@ class MultiHeadAttention(AttentionNode):
         query_up = self._shape_project(self.affine_q(query))    # [*, head, len_q, d_k]
         # 2. calculate and scale scores
         query_up = query_up / self._att_scale
+        if use_band:
+            context = self._band_context(key_up, value_up, query_up, mask_k)  # [*, head, len_q, d_v]
+            return self.final_linear(self._unshape_project(context))
         scores = BK.matmul(query_up, BK.transpose(key_up, -1, -2))  # [*, head, len_q, len_k]
         # todo(+2): for convenience, assuming using pytorch here and *==batch_size
-        if self.use_distance:
+        if dist_idxes is not None:
+            # [*, head, len_q, d_k] * [n_dist, d_kqv] = [*, head, len_q, n_dist] -> gather by [len_q, len_k]
+            rel_scores = BK.matmul(query_up, BK.transpose(dist_atts, -1, -2))
+            dist_idxes = dist_idxes.expand(BK.get_shape(scores))  # [*, head, len_q, len_k]
+            scores += BK.gather(rel_scores, dist_idxes, -1)
+        elif self.use_distance:
             distance_out = dist_atts     # [query, key, d_kqv]
             out = distance_out.view([1]*batch_dim_size + [1, query_len, key_len, self.d_kqv])
             # [*, head, len_q, 1, d_k] * [*, 1, query, key, d_kqv] = [*, head, len_q, 1, len_k]
@@ -244,7 +310,11 @@ class MultiHeadAttention(AttentionNode):
             attn = BK.concat([attn0, attn1], 1)
         drop_attn = self.adrop(attn)  # [*, head, len_q, len_k]
         context = BK.matmul(drop_attn, value_up)     # [*, head, len_q, d_v]
-        if self.use_distance:
+        if dist_idxes is not None:
+            # sum the attn of the same distance: [*, head, len_q, n_dist] * [n_dist, dim] = [*, head, len_q, d_v]
+            attn_dist = BK.zeros(BK.get_shape(drop_attn)[:-1]+[self.dist_helper.n_dist]).scatter_add(-1, dist_idxes, drop_attn)
+            context += BK.matmul(attn_dist, dist_values)
+        elif self.use_distance:
             # specific rel-position values as in https://arxiv.org/pdf/1803.02155.pdf
             distance_out2 = dist_values      # [query, key, dim]
             out2 = distance_out2.view([1]*batch_dim_size + [1, query_len, key_len, self.d_kqv])
@@ -255,6 +325,58 @@ class MultiHeadAttention(AttentionNode):
         output = self.final_linear(context_merge)           # [*, len_q, mdim]
         return output
 
+    # banded self-attention, same results as the dense one (except for the padded queries)
+    # kqv: [*, head, len, d], mask_k: [*, len]
+    def _band_context(self, key_up, value_up, query_up, mask_k):
+        rc = self.range_clipper
+        dilation = rc.dilation
+        prefix_shape = BK.get_shape(key_up)[:-2]
+        orig_len = BK.get_shape(key_up, -2)
+        # 1. split into the dilated sub-seqs: [*, head, D, len//D, d]
+        sub_len = (orig_len + dilation - 1) // dilation
+        r = rc.get_band_range()
+        c = max(r, 1)  # chunk size
+        n_chunk = (sub_len + c - 1) // c
+        pad_len = n_chunk * c * dilation - orig_len
+        if mask_k is None:
+            mask_k = BK.constants(prefix_shape[:-1] + [orig_len], 1.)
+        def _split(t, r_pad):  # [*, head?, len, d] -> [*, head?, D, len//D, d] -> padding -> [*, head?, D, n_chunk, c+2r, d]
+            t_shape = BK.get_shape(t)
+            t = BK.concat([t, BK.zeros(t_shape[:-2] + [pad_len, t_shape[-1]])], -2)
+            t = BK.transpose(t.view(t_shape[:-2] + [n_chunk*c, dilation, t_shape[-1]]), -2, -3)
+            if r_pad:
+                zeros_r = BK.zeros(BK.get_shape(t)[:-2] + [r, t_shape[-1]])
+                t = BK.concat([zeros_r, t, zeros_r], -2).unfold(-2, c+2*r, c)  # [*, D, n_chunk, d, c+2r]
+                return BK.transpose(t, -1, -2)
+            else:
+                return t.view(BK.get_shape(t)[:-2] + [n_chunk, c, t_shape[-1]])
+        q_chunks = _split(query_up, False)  # [*, head, D, n_chunk, c, d]
+        k_chunks, v_chunks = _split(key_up, True), _split(value_up, True)  # [*, head, D, n_chunk, c+2r, d]
+        m_chunks = _split(mask_k.unsqueeze(-2).unsqueeze(-1), True).squeeze(-1)  # [*, 1, D, n_chunk, c+2r]
+        # 2. scores: [*, head, D, n_chunk, c, c+2r]
+        band_offsets = rc.get_band_offsets(c)  # [c, c+2r]
+        scores = BK.matmul(q_chunks, BK.transpose(k_chunks, -1, -2))
+        if self.use_distance:
+            dist_idxes = self.dist_helper.get_dist_idxes(band_offsets)  # [c, c+2r]
+            dist_atts, dist_values = self.dist_helper.get_full_tables()
+            rel_scores = BK.matmul(q_chunks, BK.transpose(dist_atts, -1, -2))  # [*, head, D, n_chunk, c, n_dist]
+            dist_idxes = dist_idxes.expand(BK.get_shape(scores))
+            scores += BK.gather(rel_scores, dist_idxes, -1)
+        scores += (1.-m_chunks).unsqueeze(-2) * Constants.REAL_PRAC_MIN
+        scores = rc.mask_band(band_offsets, scores)  # ranges of the heads
+        # 3. attention
+        attn = BK.softmax(scores, -1)
+        drop_attn = self.adrop(attn)
+        context = BK.matmul(drop_attn, v_chunks)  # [*, head, D, n_chunk, c, d_v]
+        if self.use_distance:
+            attn_dist = BK.zeros(BK.get_shape(drop_attn)[:-1]+[self.dist_helper.n_dist]).scatter_add(-1, dist_idxes, drop_attn)
+            context += BK.matmul(attn_dist, dist_values)
+        # 4. back to [*, head, len, d_v]
+        ctx_shape = BK.get_shape(context)
+        context = BK.transpose(context.view(ctx_shape[:-4] + [dilation, n_chunk*c, ctx_shape[-1]]), -2, -3)
+        context = context.reshape(ctx_shape[:-4] + [n_chunk*c*dilation, ctx_shape[-1]])
+        return context[..., :orig_len, :]
+
 # =====
 # relational attention: adopt another input for the relational embeddings
 # todo(+N): repeated codes with the class of "MultiHeadAttention"
@@ -266,6 +388,7 @@ class MultiHeadRelationalAttention(AttentionNode):
         self.head_count = aconf.head_count
         self.d_kqv = aconf.d_kqv
         self.d_r = aconf.dim_r
+        self.rel_efficient = aconf.rel_efficient
         # =====
         # pre-fixed values for later computation
         self._att_scale = math.sqrt(self.d_kqv)
@@ -305,10 +428,19 @@ class MultiHeadRelationalAttention(AttentionNode):
         # special for query, select parameters by relation
         query_up = self._shape_project(self.affine_q(query))  # [*, head, len_q, d_k*d_r]
         # 2. calculate relational att scores
-        key_up = (key_up / self._att_scale).unsqueeze(-3).unsqueeze(-2)  # [*, head, 1, len_k, 1, d_k]
-        query_up = query_up.view(BK.get_shape(query_up)[:-1]+[1,self.d_kqv,self.d_r])  # [*, head, len_q, 1, d_k, d_r]
-        scores0 = BK.matmul(key_up, query_up).squeeze(-2)  # [*, head, len_q, len_k, d_r]
-        scores = BK.sum(scores0 * rel.unsqueeze(-4), -1)  # [*, head, len_q, len_k]
+        if self.rel_efficient:
+            # one [*, head, len_q, len_k] for each rel-dim at one time
+            key_up = BK.transpose(key_up / self._att_scale, -1, -2)  # [*, head, d_k, len_k]
+            query_up = query_up.view(BK.get_shape(query_up)[:-1]+[self.d_kqv,self.d_r])  # [*, head, len_q, d_k, d_r]
+            rel = rel.unsqueeze(-4)  # [*, 1, len_q, len_k, d_r]
+            scores = 0.
+            for ridx in range(self.d_r):
+                scores = scores + BK.matmul(query_up[..., ridx], key_up) * rel[..., ridx]  # [*, head, len_q, len_k]
+        else:
+            key_up = (key_up / self._att_scale).unsqueeze(-3).unsqueeze(-2)  # [*, head, 1, len_k, 1, d_k]
+            query_up = query_up.view(BK.get_shape(query_up)[:-1]+[1,self.d_kqv,self.d_r])  # [*, head, len_q, 1, d_k, d_r]
+            scores0 = BK.matmul(key_up, query_up).squeeze(-2)  # [*, head, len_q, len_k, d_r]
+            scores = BK.sum(scores0 * rel.unsqueeze(-4), -1)  # [*, head, len_q, len_k]
         # 3. attention
         if mask_k is not None:
             # todo(warn): mask as [*, len]
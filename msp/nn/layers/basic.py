@@ -157,6 +157,8 @@ class Dropout(BasicNode):
     def __init__(self, pc, shape, which_drop="hdrop", name=None, init_rop=None, fix_rate=None):
         super().__init__(pc, name, init_rop)
         self.f_ = None
+        self.drop_ = 0.  # current rate (0. means identity)
+        self.fixed_mask_ = None  # current mask if fix_drop
         self.shape = shape
         #
         self.which_drop = which_drop
@@ -180,23 +182,25 @@ class Dropout(BasicNode):
         # todo(+3): another overall switch, not quite elegant!
         if not r.training:
             self.f_ = lambda x: x
+            self.drop_, self.fixed_mask_ = 0., None
         else:
-            self.f_ = Dropout._dropout_f_obtain(r.fix_drop, drop, self.shape)
+            self.f_, self.fixed_mask_ = Dropout._dropout_f_obtain(r.fix_drop, drop, self.shape)
+            self.drop_ = max(0., drop)
 
     def __call__(self, val):
         return self.f_(val)
 
-    # useful routines
+    # useful routines: return (f, fixed-mask)
     @staticmethod
     def _dropout_f_obtain(fix_drop, dropout, shape):
         if dropout <= 0.:
-            return lambda x: x
+            return (lambda x: x), None
         elif not fix_drop:
-            return lambda x: BK.dropout(x, dropout)
+            return (lambda x: BK.dropout(x, dropout)), None
         else:
             # fix dropout after each refresh
             cur_mask = BK.random_bernoulli(shape, 1.-dropout, 1./(1.-dropout))
-            return lambda x: BK.cmult(x, cur_mask)
+            return (lambda x: BK.cmult(x, cur_mask)), cur_mask
 
 # dropout the entire of last-N dim, like in dropout2d/3d/...
 # (dropout like Dropout, no fix_drop since that might be not intuitive)
@@ -64,7 +64,7 @@ class BiAffine(BasicNode):
 # todo(note): this module is deprecated by the following PairScorer
 # the final layer scorer (no dropout if used as the final scoring layer)
 class BiAffineScorer(BasicNode):
-    def __init__(self, pc, in_size0, in_size1, out_size, ff_hid_size=-1, ff_hid_layer=0, use_bias=True, use_biaffine=True, biaffine_div: float=None, use_ff=True, use_ff2=False, no_final_drop=True, name=None, init_rop=None, mask_value=Constants.REAL_PRAC_MIN, biaffine_init_ortho=False):
+    def __init__(self, pc, in_size0, in_size1, out_size, ff_hid_size=-1, ff_hid_layer=0, use_bias=True, use_biaffine=True, biaffine_div: float=None, use_ff=True, use_ff2=False, no_final_drop=True, name=None, init_rop=None, mask_value=Constants.REAL_PRAC_MIN, biaffine_init_ortho=False, biaffine_rank=0):
         super().__init__(pc, name, init_rop)
         #
         self.in_size0 = in_size0
@@ -74,6 +74,8 @@ class BiAffineScorer(BasicNode):
         self.use_bias = use_bias
         self.use_biaffine = use_biaffine
         self.biaffine_init_ortho = biaffine_init_ortho
+        # >0 means low-rank factorization of W: W[:,:,k] = U0 * diag(WL[:,k]) * U1^T
+        self.biaffine_rank = biaffine_rank
         #
         # divide the biaffine scores by `biaffine_div'
         if biaffine_div is None:
@@ -101,8 +103,14 @@ class BiAffineScorer(BasicNode):
             self.AA = self.add_sub_node("AA", get_mlp(pc, in_size0+in_size1, out_size, ff_hid_size, n_hidden_layer=ff_hid_layer,
                                                       final_bias=False, final_init_rop=NoDropRop()))
         if self.use_biaffine:
-            # this is different than BK.bilinear or layers.BiAffine
-            self.W = self.add_param(name="W", shape=(in_size0, in_size1*out_size), init=("ortho" if biaffine_init_ortho else "default"))
+            if biaffine_rank > 0:
+                # the rank-k factors (shared for all labels) and the per-label weights on them
+                self.U0 = self.add_param(name="U0", shape=(in_size0, biaffine_rank), init=("ortho" if biaffine_init_ortho else "default"))
+                self.U1 = self.add_param(name="U1", shape=(in_size1, biaffine_rank), init=("ortho" if biaffine_init_ortho else "default"))
+                self.WL = self.add_param(name="WL", shape=(biaffine_rank, out_size))
+            else:
+                # this is different than BK.bilinear or layers.BiAffine
+                self.W = self.add_param(name="W", shape=(in_size0, in_size1*out_size), init=("ortho" if biaffine_init_ortho else "default"))
         # todo(0): meaningless to use fix-drop
         if no_final_drop:
             self.drop_node = lambda x: x
@@ -125,10 +133,14 @@ class BiAffineScorer(BasicNode):
             cur_input = BK.concat([input0.expand(cur_shape), input1.expand(cur_shape)], dim=-1)
             ret += self.AA(cur_input)
         if self.use_biaffine:
-            # [*, in0] * [in0, in1*out] -> [*, in1*out] -> [*, in1, out]
-            expr0 = BK.matmul(input0, self.W).view(BK.get_shape(input0)[:-1]+[self.in_size1, self.out_size])
-            # [*, 1, in1] * [*, in1, out] -> [*, 1, out] -> [*, out]
-            expr1 = BK.matmul(input1.unsqueeze(-2), expr0).squeeze(-2)
+            if self.biaffine_rank > 0:
+                # ([*, in0] * [in0, k]) . ([*, in1] * [in1, k]) -> [*, k] * [k, out] -> [*, out]
+                expr1 = BK.matmul(BK.matmul(input0, self.U0) * BK.matmul(input1, self.U1), self.WL)
+            else:
+                # [*, in0] * [in0, in1*out] -> [*, in1*out] -> [*, in1, out]
+                expr0 = BK.matmul(input0, self.W).view(BK.get_shape(input0)[:-1]+[self.in_size1, self.out_size])
+                # [*, 1, in1] * [*, in1, out] -> [*, 1, out] -> [*, out]
+                expr1 = BK.matmul(input1.unsqueeze(-2), expr0).squeeze(-2)
             ret += expr1 / self.biaffine_div
         if self.use_bias:
             ret += self.B
@@ -160,10 +172,14 @@ class BiAffineScorer(BasicNode):
             cur_input = BK.concat([expand0.expand(shape0), expand1.expand(shape1)], dim=-1)
             ret += self.AA(cur_input)
         if self.use_biaffine:
-            # [*, len0, in0] * [in0, in1*out] -> [*, len0, in1*out] -> [*, len0, in1, out]
-            expr0 = BK.matmul(input0, self.W).view(BK.get_shape(input0)[:-1]+[self.in_size1, self.out_size])
-            # [*, 1, len1, in1] * [*, len0, in1, out]
-            expr1 = BK.matmul(expand1, expr0)
+            if self.biaffine_rank > 0:
+                # [*, len0, 1, k] . [*, ?, len1, k] -> [*, len0, len1, k] * [k, out] -> [*, len0, len1, out]
+                expr1 = BK.matmul(BK.matmul(expand0, self.U0) * BK.matmul(expand1, self.U1), self.WL)
+            else:
+                # [*, len0, in0] * [in0, in1*out] -> [*, len0, in1*out] -> [*, len0, in1, out]
+                expr0 = BK.matmul(input0, self.W).view(BK.get_shape(input0)[:-1]+[self.in_size1, self.out_size])
+                # [*, 1, len1, in1] * [*, len0, in1, out]
+                expr1 = BK.matmul(expand1, expr0)
             # [*, len0, len1, out]
             ret += expr1 / self.biaffine_div
         if self.use_bias:
@@ -186,7 +202,7 @@ class BiAffineScorer(BasicNode):
     # special runnings (pre-computating half of them)
     # todo(note): always plain mode here.
 
-    # [*, in_size0], [*] -> (ff: [*, out_size], ff2: [*, ff_hid_size], biaffine: [*, in_size1*out_size])
+    # [*, in_size0] -> (ff: [*, out_size], ff2: [*, ff_hid_size], biaffine: [*, in_size1*out_size] or [*, rank])
     def precompute_input0(self, input0):
         ff_score0 = None
         ff2_hid0 = None
@@ -197,27 +213,40 @@ class BiAffineScorer(BasicNode):
             # todo(+3)
             zfatal("Not supported in this mode!")
         if self.use_biaffine:
-            biaff_hid0 = BK.matmul(input0, self.W)
+            biaff_hid0 = BK.matmul(input0, self.U0 if self.biaffine_rank>0 else self.W)
         # return (ff_score0, ff2_hid0, biaff_hid0)
         return (ff_score0, biaff_hid0)
 
-    # basically following self.plain_score
-    # input0_package should be the tuple and already index_selected, input1: [*, input1]
-    def postcompute_input1(self, input0_package, input1, mask0=None, mask1=None, rel1_t=None):
-        # ff_score0, ff2_hid0, biaff_hid0 = input0_package
-        ff_score0, biaff_hid0 = input0_package
-        ret = 0
+    # [*, in_size1] -> (ff: [*, out_size], biaffine: [*, in_size1] or [*, rank])
+    def precompute_input1(self, input1, rel1_t=None):
+        ff_score1 = None
+        biaff_hid1 = None
         if rel1_t is not None:
             input1 = input1 + rel1_t
         if self.use_ff:
-            ret = ff_score0 + self.A1(input1)
+            ff_score1 = self.A1(input1)
         if self.use_ff2:
             zfatal("Not supported in this mode!")
         if self.use_biaffine:
-            # [*, in1, out]
-            expr0 = biaff_hid0.view(BK.get_shape(biaff_hid0)[:-1]+[self.in_size1, self.out_size])
-            # [*, 1, in1] * [*, in1, out] -> [*, 1, out] -> [*, out]
-            expr1 = BK.matmul(input1.unsqueeze(-2), expr0).squeeze(-2)
+            biaff_hid1 = BK.matmul(input1, self.U1) if self.biaffine_rank>0 else input1
+        return (ff_score1, biaff_hid1)
+
+    # combine the two (broadcastable) packages: -> [*, out_size]
+    def _combine_packages(self, input0_package, input1_package, mask0, mask1):
+        ff_score0, biaff_hid0 = input0_package
+        ff_score1, biaff_hid1 = input1_package
+        ret = 0
+        if self.use_ff:
+            ret = ff_score0 + ff_score1
+        if self.use_biaffine:
+            if self.biaffine_rank > 0:
+                # [*, k] * [k, out] -> [*, out]
+                expr1 = BK.matmul(biaff_hid0 * biaff_hid1, self.WL)
+            else:
+                # [*, in1, out]
+                expr0 = biaff_hid0.view(BK.get_shape(biaff_hid0)[:-1]+[self.in_size1, self.out_size])
+                # [*, 1, in1] * [*, in1, out] -> [*, 1, out] -> [*, out]
+                expr1 = BK.matmul(biaff_hid1.unsqueeze(-2), expr0).squeeze(-2)
             ret += expr1 / self.biaffine_div
         if self.use_bias:
             ret += self.B
@@ -228,6 +257,26 @@ class BiAffineScorer(BasicNode):
             ret += self.mask_value*(1.-mask1).unsqueeze(-1)
         return self.drop_node(ret)
 
+    # basically following self.plain_score
+    # input0_package should be the tuple and already index_selected, input1: [*, input1]
+    def postcompute_input1(self, input0_package, input1, mask0=None, mask1=None, rel1_t=None):
+        return self._combine_packages(input0_package, self.precompute_input1(input1, rel1_t), mask0, mask1)
+
+    # lazy scoring for only the selected input1s (for example, only the decoded heads)
+    # -> without the full [*, len0, len1, out_size] tensor as in paired_score
+    # packages are from precompute_input0/1: [*, len0, ?], [*, len1, ?]; sel_idxes: [*, len0, K] of len1-idxes
+    # masks: [*, len0], [*, len1] -> [*, len0, K, out_size]
+    def postcompute_selected(self, input0_package, input1_package, sel_idxes, mask0=None, mask1=None):
+        sel_shape = BK.get_shape(sel_idxes)
+        # [*, len0*K]
+        flat_idxes = sel_idxes.view(sel_shape[:-2] + [-1])
+        # [*, len0*K, ?] -> [*, len0, K, ?]
+        sel_package1 = [None if z is None else BK.gather(z, flat_idxes.unsqueeze(-1).expand(sel_shape[:-2]+[-1, BK.get_shape(z, -1)]), dim=-2).view(sel_shape+[-1]) for z in input1_package]
+        exp_package0 = [None if z is None else z.unsqueeze(-2) for z in input0_package]
+        sel_mask0 = None if mask0 is None else mask0.unsqueeze(-1)
+        sel_mask1 = None if mask1 is None else BK.gather(mask1, flat_idxes, dim=-1).view(sel_shape)
+        return self._combine_packages(exp_package0, sel_package1, sel_mask0, sel_mask1)
+
 # =====
 class PairScorerConf(Conf):
     def __init__(self):
@@ -168,7 +168,7 @@ class LstmNode2(RnnNode):
 # todo(warn): this layer accept special inputs, use RnnLayerBatchFirstWrapper for ordinary ones
 class RnnLayer(BasicNode):
     def __init__(self, pc, n_input, n_hidden, n_layers=1, node_type="lstm", node_init_rop=None, init_rop=None,
-                 bidirection=False, sep_bidirection=False, name=None, no_output_dropout=True):
+                 bidirection=False, sep_bidirection=False, name=None, no_output_dropout=True, fused=False):
         super().__init__(pc, name, init_rop)
         #
         def _get_node(name, n_input, n_hidden):
@@ -195,9 +195,11 @@ class RnnLayer(BasicNode):
         else:
             self.f_drop_nodes = [self.add_sub_node("fdrop", Dropout(pc, (self.n_hidden,))) for _ in range(n_layers)]
             self.b_drop_nodes = [self.add_sub_node("bdrop", Dropout(pc, (self.n_hidden,))) for _ in range(n_layers)]
+        # use the backend's fused rnn (over packed sequences) if possible, see call_fused
+        self.fused = fused
 
     def __repr__(self):
-        return f"# RnnLayer[fb={self.bidirection}, sep={self.sep_bidirection}] (input={self.n_input}, hidden={self.n_hidden})"
+        return f"# RnnLayer[fb={self.bidirection}, sep={self.sep_bidirection}, fused={self.fused}] (input={self.n_input}, hidden={self.n_hidden})"
 
     def get_output_dims(self, *input_dims):
         return (self.output_dim, )
@@ -237,7 +239,7 @@ class RnnLayer(BasicNode):
                 b_drop_node = self.b_drop_nodes[layer_idx]
                 tmp_b = [b_drop_node(z) for z in tmp_b]
             # concat if not sep
-            if not self.sep_bidirection:
+            if self.bidirection and not self.sep_bidirection:
                 ctx = [BK.concat([f, b]) for f, b in zip(tmp_f, tmp_b)]
                 f_outputs.append(ctx)
                 b_outputs.append(ctx)
@@ -251,6 +253,90 @@ class RnnLayer(BasicNode):
             final_outputs = f_outputs[-1]
         return final_outputs
 
+    # =====
+    # fused backend: one fused call (over the packed sequences) per layer (and per direction if the inputs differ)
+    # todo(note): the same params and semantics as the step-by-step one
+    #  -> the fixed (variational) masks of idrop/gdrop are folded into the columns of the weights
+    #  -> only for prefix masks (padding at the end), the padded steps get the carried-over states as before
+
+    # return lengths (np.array[bsize]) if fusable else None
+    def get_fused_lengths(self, bsize, slen, mask_arr):
+        if not self.fused or self.n_layers <= 0:
+            return None
+        for one_node in self.fnodes + (self.bnodes if self.bidirection else []):
+            if not isinstance(one_node, (LstmNode, LstmNode2, GruNode2)):
+                return None
+            if isinstance(one_node, GruNode2) and one_node.gdrop_node.drop_>0.:
+                return None  # todo(note): gru interpolates with the dropped hidden, not foldable
+        if mask_arr is None:
+            return np.full([bsize], slen, dtype=np.int64)
+        valid_arr = (mask_arr > 0.)
+        lengths = valid_arr.sum(-1).astype(np.int64)
+        if np.any(lengths <= 0) or not np.array_equal(valid_arr, np.arange(slen) < lengths[:, np.newaxis]):
+            return None
+        return lengths
+
+    # the backend's weights for one rnn-node: (w_ih, w_hh, b_ih, b_hh)
+    def _get_fused_weights(self, node):
+        if isinstance(node, GruNode2):
+            xw, hw, xb, hb = node.x2h, node.h2h, node.xb, node.hb
+        elif isinstance(node, LstmNode2):
+            xw, hw, xb, hb = node.xw, node.hw, node.xb, node.hb
+        else:
+            xw, hw, xb = node.xw, node.hw, node.b
+            hb = BK.zeros(BK.get_shape(xb))
+        # (x*m)W^T = x(W*m)^T
+        if node.idrop_node.fixed_mask_ is not None:
+            xw = xw * BK.unsqueeze(node.idrop_node.fixed_mask_, 0)
+        if node.gdrop_node.fixed_mask_ is not None:
+            hw = hw * BK.unsqueeze(node.gdrop_node.fixed_mask_, 0)
+        return (xw, hw, xb, hb)
+
+    # input for one rnn-node (non-fixed idrop is applied to the whole seq)
+    def _get_fused_input(self, node, input_expr):
+        if node.idrop_node.fixed_mask_ is None:
+            return node.idrop_node(input_expr)
+        return input_expr
+
+    # embeds: [bsize, slen, n_input], lengths: from get_fused_lengths
+    def call_fused(self, embeds, lengths):
+        rnn_type = "gru" if isinstance(self.fnodes[0], GruNode2) else "lstm"
+        f_input = b_input = embeds
+        for layer_idx in range(self.n_layers):
+            f_node = self.fnodes[layer_idx]
+            cur_f_input = self._get_fused_input(f_node, f_input)
+            if self.bidirection:
+                b_node = self.bnodes[layer_idx]
+                cur_b_input = self._get_fused_input(b_node, b_input)
+                if cur_f_input is cur_b_input:  # both directions in one call
+                    fb_output = BK.rnn_packed(rnn_type, cur_f_input, lengths, [self._get_fused_weights(f_node), self._get_fused_weights(b_node)])
+                    tmp_f, tmp_b = BK.chunk(fb_output, 2)
+                else:
+                    tmp_f = BK.rnn_packed(rnn_type, cur_f_input, lengths, [self._get_fused_weights(f_node)])
+                    tmp_b = BK.rnn_packed(rnn_type, cur_b_input, lengths, [self._get_fused_weights(b_node)], reverse=True)
+            else:
+                tmp_f = BK.rnn_packed(rnn_type, cur_f_input, lengths, [self._get_fused_weights(f_node)])
+                tmp_b = None
+            # output/middle dropouts
+            if not self.no_output_dropout:
+                tmp_f = self.f_drop_nodes[layer_idx](tmp_f)
+                if tmp_b is not None:
+                    tmp_b = self.b_drop_nodes[layer_idx](tmp_b)
+            # concat if not sep
+            if self.bidirection and not self.sep_bidirection:
+                f_input = b_input = BK.concat([tmp_f, tmp_b])
+            else:
+                f_input, b_input = tmp_f, tmp_b
+        # the padded steps of the forward direction carry over the last valid states
+        slen = BK.get_shape(embeds, 1)
+        if np.any(lengths < slen):
+            carry_idxes = BK.input_idx(np.minimum(np.arange(slen)[np.newaxis, :], (lengths-1)[:, np.newaxis]))  # [bsize, slen]
+            tmp_f = BK.gather(tmp_f, BK.unsqueeze(carry_idxes, -1).expand(BK.get_shape(tmp_f)), 1)
+        if self.bidirection:
+            return BK.concat([tmp_f, tmp_b])
+        else:
+            return tmp_f
+
 #
 class RnnLayerBatchFirstWrapper(BasicNode):
     def __init__(self, pc, rnn_node):
@@ -281,6 +367,10 @@ class RnnLayerBatchFirstWrapper(BasicNode):
         return self.rnn_node.get_output_dims(*input_dims)       # only change upper dims
 
     def __call__(self, embeds, mask_arr=None):
+        bsize, slen = BK.get_shape(embeds)[:2]
+        lengths = self.rnn_node.get_fused_lengths(bsize, slen, mask_arr)
+        if lengths is not None:
+            return self.rnn_node.call_fused(embeds, lengths)
         step_exprs, masks = RnnLayerBatchFirstWrapper.rnn_inputs(embeds, mask_arr)
         step_encodings = self.rnn_node(step_exprs, masks=masks)
         return RnnLayerBatchFirstWrapper.rnn_outputs(step_encodings)
@@ -324,12 +414,14 @@ CnnLayer = CnnNode
 # self attentional encoders
 
 # common helper
-def get_selfatt_node(pc, d_model, aconf: AttConf, fix_range_val):
-    orig_range_val = aconf._fixed_range_val
+def get_selfatt_node(pc, d_model, aconf: AttConf, fix_range_val, fix_dilation=None):
+    orig_range_val, orig_dilation = aconf._fixed_range_val, aconf.range_dilation
     if fix_range_val is not None:
         aconf._fixed_range_val = fix_range_val
+    if fix_dilation is not None:
+        aconf.range_dilation = fix_dilation
     node = AttentionNode.get_att_node(aconf.type, pc, d_model, d_model, d_model, aconf)
-    aconf._fixed_range_val = orig_range_val
+    aconf._fixed_range_val, aconf.range_dilation = orig_range_val, orig_dilation
     return node
 
 # =====
@@ -394,7 +486,8 @@ class Transformer2EncoderLayer(BasicNode):
         super().__init__(pc, name, init_rop)
         self.d_model = d_model
         # use range or not depends on the one argument
-        self.short_att = self.add_sub_node("sa", get_selfatt_node(pc, d_model, aconf, short_range))
+        # todo(note): range_dilation only for the long-range one
+        self.short_att = self.add_sub_node("sa", get_selfatt_node(pc, d_model, aconf, short_range, fix_dilation=1))
         self.long_att = self.add_sub_node("la", get_selfatt_node(pc, d_model, aconf, long_range))
         # final gated combiner (mix input/short-att/long-att)
         self.combiner = self.add_sub_node("fc", GatedMixer(pc, d_model, 3))
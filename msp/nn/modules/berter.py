@@ -7,12 +7,14 @@ try:
 except:
     transformers = None
 
+import time
 import numpy as np
 from typing import Tuple, Iterable, List
 from collections import namedtuple
 
 from msp.utils import Conf, zcheck, zlog, zwarn, Helper
 from msp.nn import BK
+from msp.zext.feat_cache import FeatCacheConf, FeatCache
 
 #
 class BerterConf(Conf):
@@ -34,8 +36,12 @@ class BerterConf(Conf):
         # specific
         self.bert_batch_size = 1  # forwarding batch size
         self.bert_single_len = 256  # if segement length >= this, then ignore bsize and forward one by one
+        # token-budget mode (if >0, ignore the above two): max (padded) subword tokens per forward, long segments are split into windows
+        self.bert_batch_tokens = 0
         # extra special one, zero padding embedding
         self.bert_zero_pademb = False  # whether make padding embedding zero vector
+        # cache for the extracted features
+        self.bert_fcache = FeatCacheConf()
 
 #
 SubwordToks = namedtuple('SubwordToks', ['subword_toks', 'subword_ids', 'subword_is_start', 'subword_typeid'])
@@ -75,6 +81,13 @@ class Berter(object):
             zlog(f"Moving bert model to default device {BK.DEFAULT_DEVICE}")
             BK.to_device(self.model)
             BK.to_device(self.wp_model)
+        # speed stat for the token-budget mode: (num_forward, num_subword, num_padded_subword, seconds)
+        self.speed_stat = [0, 0, 0, 0.]
+        # feature cache: key by the input (context-included) ids and starts
+        self.feat_cache = None
+        if bconf.bert_fcache.enabled():
+            self.feat_cache = FeatCache(bconf.bert_fcache, f"Berter:{MODEL_NAME}:{bconf.bert_lower_case}:"
+                                                           f"{bconf.bert_layers}:{bconf.bert_zero_pademb}")
 
     # if not using anymore, release the resources
     def delete_self(self):
@@ -133,12 +146,30 @@ class Berter(object):
             cur_all_len = len(cur_all_ids)
             assert cur_all_len == len(cur_all_starts)
             all_prep_sents.append((cur_all_ids, cur_all_starts, cur_all_len, sent_idx))  # put more info here
+        ret_arrs = [None] * num_sent
+        # check cache
+        feat_cache = self.feat_cache
+        if feat_cache is not None:
+            cache_keys = [feat_cache.get_key(z[0], z[1]) for z in all_prep_sents]  # sent_idx -> key
+            for one_key, one_sent in zip(cache_keys, all_prep_sents):
+                ret_arrs[one_sent[-1]] = feat_cache.get(one_key)
+            all_prep_sents = [z for z in all_prep_sents if ret_arrs[z[-1]] is None]
+            miss_sent_idxes = [z[-1] for z in all_prep_sents]
         # forward
-        bert_batch_size = bconf.bert_batch_size
-        bert_single_len = bconf.bert_single_len
+        if bconf.bert_batch_tokens > 0:
+            self._extract_features_budget(all_prep_sents, bconf.bert_batch_tokens, ret_arrs)
+        else:
+            self._extract_features_bsize(all_prep_sents, bconf.bert_batch_size, bconf.bert_single_len, ret_arrs)
+        # put cache
+        if feat_cache is not None:
+            for one_sent_idx in miss_sent_idxes:
+                feat_cache.put(cache_keys[one_sent_idx], ret_arrs[one_sent_idx])
+        return ret_arrs
+
+    # batch-size mode: batch by bert_batch_size and forward one by one for long ones
+    def _extract_features_bsize(self, all_prep_sents: List, bert_batch_size: int, bert_single_len: int, ret_arrs: List):
         hit_single_thresh = (bert_batch_size==1)  # if bsize==1, directly single mode
         all_prep_sents.sort(key=lambda x: x[-2])  # sort by sent length
-        ret_arrs = [None] * num_sent
         with BK.no_grad_env():
             cur_ss_idx = 0  # idx for sorted sentence
             while cur_ss_idx < len(all_prep_sents):
@@ -169,7 +200,83 @@ class Berter(object):
                             one_orig_idx = one_single_sent[-1]
                             assert ret_arrs[one_orig_idx] is None
                             ret_arrs[one_orig_idx] = one_feat_arr
-        return ret_arrs
+
+    # token-budget mode: split long segments into windows, sort all the pieces by length and
+    # greedily group them into batches of at most budget padded tokens
+    def _extract_features_budget(self, all_prep_sents: List, budget: int, ret_arrs: List):
+        MAX_LEN = 510  # save two for [CLS] and [SEP]
+        BACK_LEN = 100  # for splitting cases, still remaining some of previous sub-tokens for context
+        tokenizer = self.tokenizer
+        CLS_IDX, SEP_IDX, PAD_IDX = tokenizer.cls_token_id, tokenizer.sep_token_id, tokenizer.pad_token_id
+        output_layers = self.bconf.bert_layers
+        # =====
+        # prepare pieces: (ids, selected-idxes-in-piece, sent-idx, piece-idx-in-sent)
+        all_pieces = []
+        sent_num_pieces = [0] * len(ret_arrs)
+        for cur_ids, cur_starts, cur_len, sent_idx in all_prep_sents:
+            if cur_len < MAX_LEN+2:
+                all_pieces.append((cur_ids, [i for i in range(cur_len) if cur_starts[i]], sent_idx, 0))
+                sent_num_pieces[sent_idx] = 1
+            else:
+                # todo(note): the same windows as in forward_single
+                cur_sub_idx = 0
+                while cur_sub_idx < cur_len-1:  # minus 1 to ignore ending SEP
+                    cur_slice_start = max(1, cur_sub_idx - BACK_LEN)
+                    cur_slice_end = min(cur_slice_start + MAX_LEN, cur_len-1)
+                    cur_toks = [CLS_IDX] + cur_ids[cur_slice_start:cur_slice_end] + [SEP_IDX]
+                    # mapping from the original position to the position inside the piece
+                    piece_offset = 0 if cur_sub_idx == 0 else (1-cur_slice_start)
+                    cur_sels = [i+piece_offset for i in range(cur_sub_idx, cur_slice_end) if cur_starts[i]]
+                    all_pieces.append((cur_toks, cur_sels, sent_idx, sent_num_pieces[sent_idx]))
+                    sent_num_pieces[sent_idx] += 1
+                    cur_sub_idx = cur_slice_end
+        all_pieces.sort(key=lambda x: len(x[0]))
+        # =====
+        # forward
+        ret_pieces = [[None]*z for z in sent_num_pieces]
+        stat = self.speed_stat
+        time_start = time.time()
+        with BK.no_grad_env():
+            cur_idx = 0
+            while cur_idx < len(all_pieces):
+                # since sorted, the current one is the max length
+                cur_end = cur_idx + 1
+                while cur_end < len(all_pieces) and (cur_end-cur_idx+1)*len(all_pieces[cur_end][0]) <= budget:
+                    cur_end += 1
+                cur_batch = all_pieces[cur_idx:cur_end]
+                cur_idx = cur_end
+                # prepare inputs
+                bsize, max_len = len(cur_batch), len(cur_batch[-1][0])
+                input_ids_arr = np.full((bsize, max_len), PAD_IDX, dtype=np.int64)
+                input_mask_arr = np.full((bsize, max_len), 0., dtype=np.float32)
+                flat_sels = []
+                for bidx, one_piece in enumerate(cur_batch):
+                    one_len = len(one_piece[0])
+                    input_ids_arr[bidx, :one_len] = one_piece[0]
+                    input_mask_arr[bidx, :one_len] = 1.
+                    flat_sels.extend([bidx*max_len+z for z in one_piece[1]])
+                features = self.forward_features(BK.input_idx(input_ids_arr), BK.input_real(input_mask_arr), output_layers)
+                # only select the starts before moving to cpu
+                sel_arr = BK.get_value(BK.select(features.view([bsize*max_len, -1]), flat_sels, 0))  # [?, DIM*layer]
+                sel_start = 0
+                for one_piece in cur_batch:
+                    sel_end = sel_start + len(one_piece[1])
+                    ret_pieces[one_piece[2]][one_piece[3]] = sel_arr[sel_start:sel_end]
+                    sel_start = sel_end
+                stat[0] += 1
+                stat[1] += int(input_mask_arr.sum())
+                stat[2] += bsize * max_len
+        stat[3] += time.time() - time_start
+        for sent_idx, one_pieces in enumerate(ret_pieces):
+            if len(one_pieces) > 0:
+                assert ret_arrs[sent_idx] is None
+                ret_arrs[sent_idx] = one_pieces[0] if len(one_pieces)==1 else np.concatenate(one_pieces, 0)
+
+    # report for the token-budget mode
+    def speed_info(self):
+        num_forward, num_tok, num_padded_tok, num_sec = self.speed_stat
+        return f"Berter-speed: forward={num_forward}, tok={num_tok}, padded={num_padded_tok}" \
+               f"({num_tok/max(1,num_padded_tok):.4f}), sec={num_sec:.2f}, tok/sec={num_tok/max(1e-5,num_sec):.2f}"
 
     # simple mode for extracting features, ignoring certain confs
     # add one with CLS, but not SEP
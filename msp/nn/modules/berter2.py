@@ -14,6 +14,7 @@ from msp.utils import Conf, zcheck, zlog, zwarn, Helper, Random
 from msp.nn import BK
 from msp.nn.layers import BasicNode, Embedding
 from msp.nn.modules.berter import Berter
+from msp.zext.feat_cache import FeatCacheConf, FeatCache
 
 #
 class Berter2Conf(Conf):
@@ -37,6 +38,8 @@ class Berter2Conf(Conf):
         # other inputs (these two should match)
         self.bert2_other_input_names = []
         self.bert2_other_input_vsizes = []
+        # cache for the outputs, only effective if the outputs are fixed (no trainable layers, not weighted, no other inputs)
+        self.bert2_fcache = FeatCacheConf()
 
 # weighted (mixing) bert features
 class BertFeaturesWeightLayer(BasicNode):
@@ -214,6 +217,16 @@ class Berter2(BasicNode):
             self.output_dims = (self.hidden_size, )
         else:
             raise NotImplementedError(f"UNK mode for bert2 output: {bconf.bert2_output_mode}")
+        # =====
+        # feature cache (only for testing-mode forwarding)
+        self.feat_cache = None
+        if bconf.bert2_fcache.enabled():
+            if len(self.trainable_layers)==0 and bconf.bert2_output_mode!="weighted" and len(self.other_embeds)==0:
+                self.feat_cache = FeatCache(bconf.bert2_fcache, f"Berter2:{self.model_name}:{bconf.bert2_lower_case}:"
+                                                                f"{self.output_layers}:{bconf.bert2_output_mode}:"
+                                                                f"{bconf.bert2_zero_pademb}:{bconf.bert2_retinc_cls}")
+            else:
+                zwarn("Ignore bert2_fcache since the outputs are not fixed!")
 
     def __repr__(self):
         return f"Berter2({self.model_name}): output={self.output_layers}, trainable={self.trainable_layers}"
@@ -280,9 +293,40 @@ class Berter2(BasicNode):
         final_ret_exp = self.output_f(ret_expr)
         return final_ret_exp
 
-    # calculation: split for too long sentences (input List of Iterable)
+    # with cache: only forward the missed ones
     def forward_batch(self, batched_ids: List, batched_starts: List, batched_typeids: List,
                       training: bool, other_inputs: List[List]=None):
+        feat_cache = self.feat_cache
+        if feat_cache is None or training or other_inputs:
+            return self._forward_batch(batched_ids, batched_starts, batched_typeids, training, other_inputs)
+        bsize = len(batched_ids)
+        if batched_typeids is None:
+            batched_typeids = [None] * bsize
+        cache_keys = [feat_cache.get_key(a, b, ([] if c is None else c))
+                      for a, b, c in zip(batched_ids, batched_starts, batched_typeids)]
+        all_arrs = [feat_cache.get(k) for k in cache_keys]  # List[arr(?, *...)]
+        miss_idxes = [i for i,z in enumerate(all_arrs) if z is None]
+        if len(miss_idxes) > 0:
+            miss_typeids = [batched_typeids[i] for i in miss_idxes]
+            miss_expr, miss_masks = self._forward_batch(
+                [batched_ids[i] for i in miss_idxes], [batched_starts[i] for i in miss_idxes],
+                (None if all(z is None for z in miss_typeids) else miss_typeids), training)
+            miss_arr, miss_lens = BK.get_value(miss_expr), BK.get_value(miss_masks.sum(-1).long())
+            for one_idx, one_arr, one_len in zip(miss_idxes, miss_arr, miss_lens):
+                all_arrs[one_idx] = one_arr[:one_len]
+                feat_cache.put(cache_keys[one_idx], all_arrs[one_idx])
+        # re-batch
+        max_num = max(len(z) for z in all_arrs)
+        ret_arr = np.zeros([bsize, max_num] + list(all_arrs[0].shape[1:]), dtype=np.float32)
+        mask_arr = np.zeros([bsize, max_num], dtype=np.float32)
+        for bidx, one_arr in enumerate(all_arrs):
+            ret_arr[bidx, :len(one_arr)] = one_arr
+            mask_arr[bidx, :len(one_arr)] = 1.
+        return BK.input_real(ret_arr), BK.input_real(mask_arr)
+
+    # calculation: split for too long sentences (input List of Iterable)
+    def _forward_batch(self, batched_ids: List, batched_starts: List, batched_typeids: List,
+                       training: bool, other_inputs: List[List]=None):
         conf = self.bconf
         tokenizer = self.tokenizer
         PAD_IDX = tokenizer.pad_token_id
@@ -20,6 +20,7 @@ class EncConf(Conf):
         self.enc_rnn_layer = 1
         self.enc_rnn_bidirect = True
         self.enc_rnn_sep_bidirection = False
+        self.enc_rnn_fused = False  # use the backend's fused rnn over packed seqs (falling back if not applicable)
         # cnn
         self.enc_cnn_windows = [3, 5]   # split dim by windows
         self.enc_cnn_layer = 0
@@ -64,7 +65,7 @@ class MyEncoder(BasicNode):
                 if econf.enc_rnn_layer > 0:
                     rnn_bidirect, rnn_sep_bidirection = econf.enc_rnn_bidirect, econf.enc_rnn_sep_bidirection
                     rnn_enc_size = self.enc_hidden//2 if rnn_bidirect else self.enc_hidden
-                    rnn_layer = self.add_sub_node("rnn", RnnLayerBatchFirstWrapper(pc, RnnLayer(pc, last_dim, rnn_enc_size, econf.enc_rnn_layer, node_type=econf.enc_rnn_type, bidirection=rnn_bidirect, sep_bidirection=rnn_sep_bidirection)))
+                    rnn_layer = self.add_sub_node("rnn", RnnLayerBatchFirstWrapper(pc, RnnLayer(pc, last_dim, rnn_enc_size, econf.enc_rnn_layer, node_type=econf.enc_rnn_type, bidirection=rnn_bidirect, sep_bidirection=rnn_sep_bidirection, fused=econf.enc_rnn_fused)))
                     self.layers.append(rnn_layer)
             # todo(+2): different i/o sizes for cnn and att?
             elif name == "cnn":
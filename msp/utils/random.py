@@ -1,3 +1,5 @@
+import zlib
+import threading
 import numpy as np
 
 from .log import printing
@@ -9,9 +11,17 @@ class Random(object):
     _init_times = 0
     _init_seed = 9341
     _seeds = {}
+    _local = threading.local()  # thread-specific generators (see use_thread_generators)
 
     @staticmethod
     def get_generator(task):
+        local_seeds = getattr(Random._local, "seeds", None)
+        if local_seeds is not None:
+            g = local_seeds.get(task, None)
+            if g is None:
+                g = np.random.RandomState((Random._local.base_seed + zlib.crc32(task.encode())) % (1<<32))
+                local_seeds[task] = g
+            return g
         g = Random._seeds.get(task, None)
         if g is None:
             if Random._init_times==0:
@@ -26,6 +36,13 @@ class Random(object):
             Random._seeds[task] = g
         return g
 
+    # use separate generators (deterministically derived from `seed') for all tasks in the current thread,
+    # for example, in a background thread, thus not sharing the global ones with the main thread
+    @staticmethod
+    def use_thread_generators(seed):
+        Random._local.seeds = {}
+        Random._local.base_seed = int(seed)
+
     # separate one
     @staticmethod
     def create_sep_generator(seed):
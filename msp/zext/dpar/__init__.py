@@ -1,4 +1,4 @@
 #
 
 from .conllu_eval import ParserEvaler
-from .conllu_reader import ConlluReader, write_conllu, ConlluParse
+from .conllu_reader import ConlluReader, write_conllu, ConlluParse, ConlluFastReader, ConlluFastToken
@@ -2,6 +2,9 @@
 
 # specific conllu reader for UD conllu files
 
+import os
+import mmap
+
 from msp.utils import zcheck, FileHelper
 
 # one instance of parse
@@ -16,15 +19,7 @@ class ConlluToken:
         self.head = h
         self.label = la
         self.label0 = la.split(":")[0] if la is not None else None
-        self.misc = {}
-        if misc is not None and len(misc)>0 and misc != "_":
-            try:
-                for s in misc.split("|"):
-                    k, v = s.split("=")
-                    assert k not in self.misc, f"Err: Repeated key: {k}"
-                    self.misc[k] = v
-            except:
-                pass
+        self.misc = ConlluToken.parse_misc(misc)
         # enhanced dependencies
         self.enh_heads = enh_hs
         self.enh_labels = enh_ls
@@ -45,6 +40,19 @@ class ConlluToken:
     def __repr__(self):
         return "\t".join(str(z) for z in (self.idx, self.word, self.upos, self.xpos, self.head, self.label0, self.misc))
 
+    @staticmethod
+    def parse_misc(misc):
+        ret = {}
+        if misc is not None and len(misc)>0 and misc != "_":
+            try:
+                for s in misc.split("|"):
+                    k, v = s.split("=")
+                    assert k not in ret, f"Err: Repeated key: {k}"
+                    ret[k] = v
+            except:
+                pass
+        return ret
+
     def __getattr__(self, item):
         if item in self.__dict__:
             return self.__dict__[item]
@@ -304,3 +312,129 @@ def write_conllu(fd, word, pos, heads, labels, miscs=None, headlines=None):
         s = "\t".join(fields) + "\n"
         fd.write(s)
     fd.write("\n")
+
+# =====
+# fast-path reading: only parse the requested columns into lists (no full token objects or trees)
+# -> skip headlines, MWE lines and ellipsis lines (same as ConlluReader for the ordinary tokens)
+# todo(note): less checking than ConlluReader (only num of fields), use it on well-formed files
+
+CONLLU_COLUMNS = {"id": 0, "word": 1, "lemma": 2, "upos": 3, "xpos": 4, "feats": 5, "head": 6, "label": 7, "deps": 8, "misc": 9}
+
+# light-weighted token, misc and enhanced deps are parsed on need
+class ConlluFastToken:
+    __slots__ = ("idx", "word", "upos", "xpos", "head", "label", "_deps_str", "_misc_str", "_misc", "_enh")
+
+    def __init__(self, idx, w, up, xp, h, la, deps_str="_", misc_str="_"):
+        self.idx = idx
+        self.word = w
+        self.upos = up
+        self.xpos = xp
+        self.head = h
+        self.label = la
+        self._deps_str = deps_str
+        self._misc_str = misc_str
+        self._misc = None
+        self._enh = None
+
+    def __repr__(self):
+        return "\t".join(str(z) for z in (self.idx, self.word, self.upos, self.xpos, self.head, self.label0, self.misc))
+
+    @property
+    def label0(self):
+        return self.label.split(":")[0] if self.label is not None else None
+
+    @property
+    def misc(self):
+        if self._misc is None:
+            self._misc = ConlluToken.parse_misc(self._misc_str)
+        return self._misc
+
+    @property
+    def enh_heads(self):
+        if self._enh is None:
+            self._enh = ConlluReader().parse_enhance_dep(self._deps_str)
+        return self._enh[0]
+
+    @property
+    def enh_labels(self):
+        if self._enh is None:
+            self._enh = ConlluReader().parse_enhance_dep(self._deps_str)
+        return self._enh[1]
+
+class ConlluFastReader:
+    def __init__(self, columns=("word", "upos", "head", "label")):
+        self.columns = list(columns)
+        self.col_idxes = [CONLLU_COLUMNS[z] for z in self.columns]
+        self.head_col = self.columns.index("head") if "head" in self.columns else -1
+
+    # lines of one sentence -> {column: list}
+    def parse_lines(self, lines):
+        NF = ConlluParse.NUM_FIELDS
+        col_idxes = self.col_idxes
+        rets = [[] for _ in col_idxes]
+        for one_line in lines:
+            if one_line.startswith("#"):
+                continue
+            fields = one_line.rstrip("\n").split("\t")
+            zcheck(len(fields)==NF, "Conllu Error: Unmatched num of fields.")
+            id_str = fields[0]
+            if "-" in id_str or "." in id_str:
+                continue
+            for one_ret, one_cidx in zip(rets, col_idxes):
+                one_ret.append(fields[one_cidx])
+        if self.head_col >= 0:
+            rets[self.head_col] = [None if z=="_" else int(z) for z in rets[self.head_col]]
+        return {k: v for k, v in zip(self.columns, rets)}
+
+    # lines of one sentence -> list of tokens (without root)
+    def parse_tokens(self, lines):
+        rets = []
+        for one_line in lines:
+            if one_line.startswith("#"):
+                continue
+            fields = one_line.rstrip("\n").split("\t")
+            zcheck(len(fields)==ConlluParse.NUM_FIELDS, "Conllu Error: Unmatched num of fields.")
+            id_str = fields[0]
+            if "-" in id_str or "." in id_str:
+                continue
+            head = fields[6]
+            rets.append(ConlluFastToken(int(id_str), fields[1], fields[3], fields[4], None if head=="_" else int(head),
+                                        fields[7], fields[8], fields[9]))
+        return rets
+
+    def read_one(self, fd):
+        lines = FileHelper.read_multiline(fd, ConlluParse.SKIP_F)
+        if lines is None:
+            return None
+        return self.parse_lines(lines)
+
+    def yield_ones(self, fd):
+        while True:
+            one = self.read_one(fd)
+            if one is None:
+                break
+            yield one
+
+    # split the whole text by empty lines
+    def read_text(self, text: str):
+        rets = []
+        lines = []
+        for one_line in text.split("\n"):
+            if len(one_line.strip()) == 0:
+                if len(lines) > 0:
+                    rets.append(self.parse_lines(lines))
+                    lines = []
+            else:
+                lines.append(one_line)
+        if len(lines) > 0:
+            rets.append(self.parse_lines(lines))
+        return rets
+
+    # read the whole file (with mmap)
+    # todo(note): no multiprocessing mode, since pickling the parsed lists back costs more than the parsing itself
+    def read_file(self, path: str):
+        with open(path, 'rb') as fd:
+            if os.fstat(fd.fileno()).st_size == 0:
+                return []
+            with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return self.read_text(mm[:].decode("utf-8"))
@@ -0,0 +1,20 @@
+#
+
+# one-time conversion of txt pre-trained embeddings to the memory-mapped format (used by WordVectors.load if exists)
+# PYTHONPATH=../src/ python3 -m msp.zext.embed_mm INPUT.vec [--sep " "]
+
+import sys
+import argparse
+
+from msp.data import WordVectors
+
+def main(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputs", type=str, nargs="+")
+    parser.add_argument("--sep", type=str, default=" ")
+    a = parser.parse_args(args)
+    for one_input in a.inputs:
+        WordVectors.convert_txt_to_mm(one_input, a.sep)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
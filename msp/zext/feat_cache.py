@@ -0,0 +1,115 @@
+#
+
+# content-addressed cache for (frozen) features, for example, the ones from pre-trained bert
+# -> key: hash of the input ids (and whatever else decides the outputs, like model name and layers)
+# -> two tiers: in-memory LRU and on-disk (one npy per entry), both bounded by size (MB)
+
+import os
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+from msp.utils import Conf, zlog
+
+class FeatCacheConf(Conf):
+    def __init__(self):
+        self.fc_dir = ""  # on-disk dir, empty means no disk tier
+        self.fc_mem_mb = 0.  # memory tier size
+        self.fc_disk_mb = 10240.  # disk tier size, evict the least recently used ones if exceeding
+
+    def enabled(self):
+        return self.fc_mem_mb>0 or len(self.fc_dir)>0
+
+class FeatCache:
+    def __init__(self, conf: FeatCacheConf, signature: str):
+        self.conf = conf
+        self.signature = signature.encode()  # things other than the ids that decide the outputs
+        # memory tier: key -> arr
+        self.mem_limit = int(conf.fc_mem_mb * (1<<20))
+        self.mem_size = 0
+        self.mem_entries = OrderedDict()
+        # disk tier: key -> file-size
+        self.dir = conf.fc_dir
+        self.disk_limit = int(conf.fc_disk_mb * (1<<20))
+        self.disk_size = 0
+        self.disk_entries = OrderedDict()
+        if self.dir:
+            os.makedirs(self.dir, exist_ok=True)
+            # todo(note): recover the LRU order by mtime (refreshed at each hit)
+            all_files = []
+            for one_entry in os.scandir(self.dir):
+                if one_entry.name.endswith(".npy"):
+                    one_stat = one_entry.stat()
+                    all_files.append((one_stat.st_mtime, one_entry.name[:-4], one_stat.st_size))
+            for _, one_key, one_size in sorted(all_files):
+                self.disk_entries[one_key] = one_size
+                self.disk_size += one_size
+            zlog(f"Load FeatCache from {self.dir}: {len(self.disk_entries)} entries, {self.disk_size/(1<<20):.2f}MB")
+        # stat
+        self.num_hit, self.num_miss = 0, 0
+
+    def __repr__(self):
+        return f"FeatCache: hit={self.num_hit}, miss={self.num_miss}, mem={len(self.mem_entries)}({self.mem_size/(1<<20):.2f}MB), " \
+               f"disk={len(self.disk_entries)}({self.disk_size/(1<<20):.2f}MB)"
+
+    # the inputs are lists of ints (for example, subword ids and starts)
+    def get_key(self, *int_seqs):
+        h = hashlib.sha1(self.signature)
+        for one_seq in int_seqs:
+            one_arr = np.asarray(one_seq, dtype=np.int64)
+            h.update(len(one_arr).to_bytes(8, 'little'))
+            h.update(one_arr.tobytes())
+        return h.hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.dir, key+".npy")
+
+    def get(self, key):
+        ret = self.mem_entries.get(key)
+        if ret is not None:
+            self.mem_entries.move_to_end(key)
+        elif key in self.disk_entries:
+            try:
+                ret = np.load(self._get_path(key))
+                os.utime(self._get_path(key))
+                self.disk_entries.move_to_end(key)
+                self._put_mem(key, ret)
+            except OSError:  # maybe evicted by others
+                self._del_disk(key)
+        if ret is None:
+            self.num_miss += 1
+        else:
+            self.num_hit += 1
+        return ret
+
+    def put(self, key, arr: np.ndarray):
+        self._put_mem(key, arr)
+        if self.dir and key not in self.disk_entries:
+            # write to tmp and then rename, in case of others reading at the same time
+            path = self._get_path(key)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as fd:
+                np.save(fd, arr)
+            os.replace(tmp_path, path)
+            self.disk_entries[key] = os.path.getsize(path)
+            self.disk_size += self.disk_entries[key]
+            while self.disk_size > self.disk_limit and len(self.disk_entries)>0:
+                self._del_disk(next(iter(self.disk_entries)))
+
+    def _put_mem(self, key, arr: np.ndarray):
+        if self.mem_limit <= 0 or key in self.mem_entries:
+            return
+        if arr.base is not None:  # do not keep the possibly larger base array
+            arr = arr.copy()
+        self.mem_entries[key] = arr
+        self.mem_size += arr.nbytes
+        while self.mem_size > self.mem_limit and len(self.mem_entries)>0:
+            _, one_arr = self.mem_entries.popitem(last=False)
+            self.mem_size -= one_arr.nbytes
+
+    def _del_disk(self, key):
+        self.disk_size -= self.disk_entries.pop(key)
+        try:
+            os.remove(self._get_path(key))
+        except OSError:
+            pass
@@ -0,0 +1,127 @@
+#
+
+# memory-mapped feature store (for pre-computed features like aux_repr/aux_score)
+# -> "{path}": one contiguous raw payload (read with np.memmap), "{path}.idx.npz": offset index
+# -> each entry is one array or a list of arrays (for example, the (arc, lab) score tuple)
+# todo(note): the reader returns read-only zero-copy views, copy them if in-place modifications are needed
+
+import os
+import sys
+import argparse
+import numpy as np
+
+from msp.utils import zopen, zlog, zcheck, PickleRW
+
+FEAT_STORE_IDX_SUFFIX = ".idx.npz"
+
+# append-only writer
+class FeatStoreWriter:
+    def __init__(self, path: str, dtype="float16"):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.fd = open(path, 'wb')
+        # index
+        self.arr_offsets = [0]  # [M+1] in number of elements
+        self.arr_shapes = []  # [M] of tuple
+        self.entry_starts = [0]  # [N+1] in number of arrays
+        self.entry_is_seq = []  # [N]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self.entry_is_seq)
+
+    def add(self, one):
+        is_seq = isinstance(one, (list, tuple))
+        for one_arr in (one if is_seq else [one]):
+            one_arr = np.ascontiguousarray(one_arr, dtype=self.dtype)
+            one_arr.tofile(self.fd)
+            self.arr_offsets.append(self.arr_offsets[-1] + one_arr.size)
+            self.arr_shapes.append(one_arr.shape)
+        self.entry_starts.append(len(self.arr_shapes))
+        self.entry_is_seq.append(is_seq)
+
+    def add_list(self, ones):
+        for one in ones:
+            self.add(one)
+
+    def close(self):
+        if self.fd is None:
+            return
+        self.fd.close()
+        self.fd = None
+        # shapes are padded to the max ndim
+        max_ndim = max([len(z) for z in self.arr_shapes], default=0)
+        shape_arr = np.zeros([len(self.arr_shapes), max_ndim], dtype=np.int64)
+        ndim_arr = np.asarray([len(z) for z in self.arr_shapes], dtype=np.int64)
+        for i, one_shape in enumerate(self.arr_shapes):
+            shape_arr[i, :len(one_shape)] = one_shape
+        with open(self.path + FEAT_STORE_IDX_SUFFIX, 'wb') as fd:
+            np.savez(fd, dtype=np.asarray(self.dtype.str), arr_offsets=np.asarray(self.arr_offsets, dtype=np.int64),
+                     arr_shapes=shape_arr, arr_ndims=ndim_arr, entry_starts=np.asarray(self.entry_starts, dtype=np.int64),
+                     entry_is_seq=np.asarray(self.entry_is_seq, dtype=np.bool_))
+
+# random-access reader
+class FeatStore:
+    def __init__(self, path: str):
+        zcheck(FeatStore.is_store(path), f"Not a feat-store: {path}")
+        self.path = path
+        with np.load(path + FEAT_STORE_IDX_SUFFIX) as idx:
+            self.dtype = np.dtype(str(idx["dtype"]))
+            self.arr_offsets = idx["arr_offsets"]
+            self.arr_shapes = idx["arr_shapes"]
+            self.arr_ndims = idx["arr_ndims"]
+            self.entry_starts = idx["entry_starts"]
+            self.entry_is_seq = idx["entry_is_seq"]
+        # todo(note): np.memmap cannot map an empty file
+        if self.arr_offsets[-1] > 0:
+            self.payload = np.memmap(path, dtype=self.dtype, mode='r', shape=(int(self.arr_offsets[-1]), ))
+        else:
+            self.payload = np.zeros([0], dtype=self.dtype)
+
+    @staticmethod
+    def is_store(path):
+        return isinstance(path, str) and os.path.isfile(path + FEAT_STORE_IDX_SUFFIX)
+
+    def __len__(self):
+        return len(self.entry_is_seq)
+
+    def _get_arr(self, aidx):
+        start, end = self.arr_offsets[aidx], self.arr_offsets[aidx+1]
+        shape = tuple(self.arr_shapes[aidx, :self.arr_ndims[aidx]])
+        return self.payload[start:end].reshape(shape)
+
+    # one array or a list of arrays
+    def __getitem__(self, idx):
+        a_start, a_end = self.entry_starts[idx], self.entry_starts[idx+1]
+        if self.entry_is_seq[idx]:
+            return [self._get_arr(i) for i in range(a_start, a_end)]
+        else:
+            return self._get_arr(a_start)
+
+    def get_range(self, start, end):
+        return [self[i] for i in range(start, end)]
+
+# =====
+# convert pickled list (one pickle.dump per entry) to feat-store
+# PYTHONPATH=../src/ python3 -m msp.zext.feat_store INPUT.pkl OUTPUT [--dtype float16]
+def main(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", type=str)
+    parser.add_argument("output", type=str)
+    parser.add_argument("--dtype", type=str, default="float16")
+    a = parser.parse_args(args)
+    with zopen(a.input, 'rb', encoding=None) as fd, FeatStoreWriter(a.output, a.dtype) as writer:
+        try:
+            for one in PickleRW.yield_list(fd):
+                writer.add(one)
+        except EOFError:
+            pass
+        zlog(f"Convert {a.input} to {a.output}({a.dtype}): {len(writer)} entries.")
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
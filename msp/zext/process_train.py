@@ -1,5 +1,7 @@
 #
 
+import os
+import glob
 import math
 from typing import Dict
 
@@ -160,6 +162,7 @@ class RConf(Conf):
         # lrate schedule
         self.lrate = SVConf().init_from_kwargs(val=0.001, which_idx="aidx", mode="exp", m=0.75, min_val=0.00001)
         self.lrate_warmup = 0       # linear increasing lrate as warmup for how many steps (minus values means epoch)
+        self.epoch_len_file = ""    # persisted steps-per-epoch for minus lrate_warmup (read if the key matches, otherwise written)
         self.lrate_anneal_alpha = 0.  # similar to ATT-is-ALL-you-Need, sth like -0.5 (after warmup, step^anneal)
 
     def do_validate(self):
@@ -294,7 +297,31 @@ class TrainingRunner(object):
                 self.load(rconf.model_name+rconf.suffix_best, False)
         utils.zlog("")
 
-    def run(self, train_stream, dev_streams):
+    # key for the persisted epoch length: data files (with size and mtime) and the settings affecting the batching
+    # -> data_paths: list or ","-separated str of files (globs or dirs such as the compiled ones are expanded)
+    @staticmethod
+    def get_epoch_len_key(data_paths, sep=",", **settings):
+        if isinstance(data_paths, str):
+            data_paths = [z for z in data_paths.split(sep) if len(z)>0]
+        all_files = []
+        for one_path in data_paths:
+            for one_file in (sorted(glob.glob(one_path)) or [one_path]):
+                if os.path.isdir(one_file):
+                    all_files.extend(os.path.join(one_file, z) for z in sorted(os.listdir(one_file)))
+                else:
+                    all_files.append(one_file)
+        items = []
+        for one_file in all_files:
+            if os.path.isfile(one_file):
+                one_stat = os.stat(one_file)
+                items.append(f"{one_file}:{one_stat.st_size}:{one_stat.st_mtime_ns}")
+            else:
+                items.append(str(one_file))
+        items.extend(f"{k}={settings[k]}" for k in sorted(settings.keys()))
+        return "|".join(items)
+
+    # epoch_len_key: checked with the persisted one in epoch_len_file, see get_epoch_len_key
+    def run(self, train_stream, dev_streams, epoch_len_key=""):
         rconf = self.rconf
         last_report_uidx, last_dev_uidx = 0, 0
         if rconf.validate_first:
@@ -302,10 +329,22 @@ class TrainingRunner(object):
         # =====
         # for lrate warmup and annealing
         if rconf.lrate_warmup < 0:
-            # calculate epochs
-            steps_per_epoch = 0
-            for _ in train_stream:
-                steps_per_epoch += 1
+            # calculate epochs: persisted one > cheap estimation > a dry pass
+            steps_per_epoch = None
+            if rconf.epoch_len_file and os.path.isfile(rconf.epoch_len_file):
+                persisted = JsonRW.from_file(None, rconf.epoch_len_file)
+                if isinstance(persisted, dict) and persisted.get("key") == epoch_len_key:
+                    steps_per_epoch = persisted["steps"]
+                else:
+                    utils.zlog(f"Unmatched key in {rconf.epoch_len_file}, re-estimate the epoch length.")
+            if steps_per_epoch is None:
+                steps_per_epoch = train_stream.estimate_len()
+                if steps_per_epoch is None:
+                    steps_per_epoch = 0
+                    for _ in train_stream:
+                        steps_per_epoch += 1
+                if rconf.epoch_len_file:
+                    JsonRW.to_file({"key": epoch_len_key, "steps": steps_per_epoch}, rconf.epoch_len_file)
             n_epoch = -rconf.lrate_warmup
             n_steps = n_epoch * steps_per_epoch
             utils.zlog(f"Calculating warmup steps for {n_epoch} epochs: {steps_per_epoch} steps per epoch.")
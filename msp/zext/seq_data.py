@@ -31,7 +31,7 @@ class SeqFactor(object):
     # two directions: val <=> idx
     # init-val -> idx
     def build_idxes(self, voc: Vocab):
-        self.idxes = [voc.get_else_unk(w) for w in self.vals]
+        self.idxes = voc.lookup(self.vals)
 
     # set idx & val
     def build_vals(self, idxes, voc: Vocab):
@@ -45,7 +45,9 @@ class InputCharFactor(SeqFactor):
         super().__init__(words)
 
     def build_idxes(self, c_voc):
-        self.idxes = [[c_voc.get_else_unk(c) for c in w] for w in self.vals]
+        flat, offsets = c_voc.lookup_batch(self.vals)
+        flat = flat.tolist()
+        self.idxes = [flat[a:b] for a, b in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
 
 # =====
 # tagging schemes for segments: BIO/BIOES
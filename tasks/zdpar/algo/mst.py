@@ -14,7 +14,7 @@ NEG_INF = Constants.REAL_PRAC_MIN
 
 # helper: find cycles, return (bool, set())
 def _find_cycle(par, cur_length, cur_nodes):
-    added = np.zeros(cur_length, np.bool)
+    added = np.zeros(cur_length, bool)
     added[0] = True
     cycle = set()
     findcycle = False
@@ -170,7 +170,7 @@ def mst_unproj(scores, lengths, labeled=True):
         cur_score_matrix = np.array(cur_scores, copy=True)
         cur_oldI = np.zeros([cur_length, cur_length], dtype=np.int32)
         cur_oldO = np.zeros([cur_length, cur_length], dtype=np.int32)
-        cur_nodes = np.zeros(cur_length, dtype=np.bool)
+        cur_nodes = np.zeros(cur_length, dtype=bool)
         cur_reps = [set() for _ in range(cur_length)]
         # initialize some values
         for s in range(cur_length):
@@ -205,19 +205,376 @@ def mst_unproj(scores, lengths, labeled=True):
     return ret_heads, ret_lables, ret_scores
 
 # =====
-# todo(warn): the rest of the algorithms are not provided here (either in cmst or nn-based)
+# batched unproj-mst algo: the same Chu-Liu-Edmonds procedure as above, but operating on the whole batch of arrays
+# -- contracting one cycle per instance at each level, all bookkeeping is done by [bs, *] arrays (no recursion),
+# -- and only the instances that still have cycles are involved at each level
+# todo(warn): the outputs are the same as mst_unproj/cmst_unproj (including ret_scores[:,0]=scores[:,0,len-1] for the root),
+#  except that the tie-breaking might differ on exactly tied scores (argmax over whole arrays vs. sequential loops)
+
+# helper: find the first cycle (as in _find_cycle) of the greedy graph for each instance
+# par: [bs, len] (root and dead nodes point to themselves), alive: [bs, len]; return (has_cycle[bs], cycle_mask[bs, len])
+def _batched_find_cycle(par, alive):
+    batch_size, max_length = par.shape
+    # pointer doubling: min-idx along the path & the 2^K-th ancestor
+    min_idx = np.broadcast_to(np.arange(max_length), par.shape).copy()
+    jump = par
+    for _ in range(max(1, int(np.ceil(np.log2(max(max_length, 2)))))):
+        min_idx = np.minimum(min_idx, np.take_along_axis(min_idx, jump, axis=1))
+        jump = np.take_along_axis(jump, jump, axis=1)
+    # after enough steps, every node has arrived at its terminal cycle (root or dead nodes are self-loops)
+    on_cycle = np.zeros(par.shape, dtype=bool)
+    on_cycle[np.arange(batch_size)[:, None], jump] = True
+    # the cycle-label (min-idx in the cycle) that each node runs into
+    terminal = np.take_along_axis(min_idx, jump, axis=1)
+    reach_cycle = alive & (terminal != 0)
+    reach_cycle[:, 0] = False
+    has_cycle = reach_cycle.any(axis=1)
+    # select the one reached by the first node
+    first_node = reach_cycle.argmax(axis=1)
+    cycle_label = terminal[np.arange(batch_size), first_node]
+    cycle_mask = on_cycle & alive & (min_idx == cycle_label[:, None]) & has_cycle[:, None]
+    return has_cycle, cycle_mask
+
+# todo(warn): assume SYMBOLIC ROOT for both input/output
+def mst_unproj_batched(scores, lengths, labeled=True):
+    # [bs, len, len] or [bs, len, len, N]
+    if labeled:
+        assert scores.ndim == 4, 'dimension of energies is not equal to 4'
+    else:
+        assert scores.ndim == 3, 'dimension of energies is not equal to 3'
+    input_shape = scores.shape
+    batch_size = input_shape[0]
+    max_length = input_shape[1]
+    lengths = np.asarray(lengths)
+    # max over labels if labeled: [bs, len-m, len-h]
+    if labeled:
+        label_argmax = scores.argmax(axis=-1).astype(np.int32)
+        unlabeled_scores = scores.max(axis=-1)
+    else:
+        label_argmax = None
+        unlabeled_scores = scores
+    arange_len = np.arange(max_length)
+    valid = arange_len[None, :] < lengths[:, None]      # [bs, len]
+    # initialize score matrix to original score matrix (float64 to avoid accumulating errors with the contractions)
+    score_matrix = np.array(unlabeled_scores, dtype=np.float64, copy=True)
+    score_matrix[:, arange_len, arange_len] = -np.inf
+    score_matrix[~valid[:, None, :].repeat(max_length, axis=1)] = -np.inf
+    # create greedy best graph (root and padded ones point to themselves)
+    self_loop = ~valid
+    self_loop[:, 0] = True
+    par = np.where(self_loop, arange_len[None, :], score_matrix.argmax(axis=-1))
+    alive = valid.copy()
+    # =====
+    # forward: contract one cycle per instance until no cycles
+    records = []
+    act_bidxes = np.arange(batch_size)
+    while len(act_bidxes) > 0:
+        act_par, act_alive = par[act_bidxes], alive[act_bidxes]
+        has_cycle, cycle_mask = _batched_find_cycle(act_par, act_alive)
+        act_bidxes, act_par, act_alive, cycle_mask = \
+            act_bidxes[has_cycle], act_par[has_cycle], act_alive[has_cycle], cycle_mask[has_cycle]
+        if len(act_bidxes) == 0:
+            break
+        num_act = len(act_bidxes)
+        arange_act = np.arange(num_act)
+        # gather the cycle nodes: [A, C], padded ones are marked by cyc_valid
+        cyc_len = cycle_mask.sum(axis=-1).max()
+        cyc_nodes = np.argsort(~cycle_mask, axis=-1, kind='stable')[:, :cyc_len]
+        cyc_valid = np.take_along_axis(cycle_mask, cyc_nodes, axis=-1)
+        rep = cyc_nodes[:, 0]       # [A], the first node in the cycle as the representative
+        act_scores = score_matrix[act_bidxes]       # [A, m, h]
+        # out-links: the best head inside the cycle for each node: [A, m, C]
+        out_scores = np.take_along_axis(act_scores, np.broadcast_to(cyc_nodes[:, None, :], (num_act, max_length, cyc_len)), axis=-1)
+        out_scores[~np.broadcast_to(cyc_valid[:, None, :], out_scores.shape)] = -np.inf
+        out_argmax = out_scores.argmax(axis=-1)
+        max_out_link = np.take_along_axis(cyc_nodes, out_argmax, axis=-1)         # [A, m]
+        max_out_score = np.take_along_axis(out_scores, out_argmax[:, :, None], axis=-1).squeeze(-1)
+        # in-links: breaking the cycle at one node (the cycle's weight is a constant here and thus omitted): [A, C, h]
+        cyc_par = np.take_along_axis(act_par, cyc_nodes, axis=-1)
+        cyc_par_scores = act_scores[arange_act[:, None], cyc_nodes, cyc_par]      # [A, C]
+        in_scores = act_scores[arange_act[:, None], cyc_nodes] - np.where(cyc_valid, cyc_par_scores, 0.)[:, :, None]
+        in_scores[~np.broadcast_to(cyc_valid[:, :, None], in_scores.shape)] = -np.inf
+        in_argmax = in_scores.argmax(axis=1)
+        max_in_link = np.take_along_axis(cyc_nodes, in_argmax, axis=-1)           # [A, h]
+        max_in_score = np.take_along_axis(in_scores, in_argmax[:, None, :], axis=1).squeeze(1)
+        records.append((act_bidxes, cycle_mask, rep, act_par, max_out_link, max_in_link, act_alive))
+        # contract: the outside nodes link to/from the rep
+        outside = act_alive & (~cycle_mask)
+        act_scores[arange_act, :, rep] = np.where(outside, max_out_score, -np.inf)
+        act_scores[arange_act, rep, :] = np.where(outside, max_in_score, -np.inf)
+        new_alive = act_alive & ~(cycle_mask & (arange_len[None, :] != rep[:, None]))
+        # update the greedy graph: nodes previously linked into the cycle now link to the rep, and re-select for rep
+        new_par = np.where(np.take_along_axis(cycle_mask, act_par, axis=-1) & outside, rep[:, None], act_par)
+        new_par[arange_act, rep] = act_scores[arange_act, rep].argmax(axis=-1)
+        new_par = np.where(new_alive, new_par, arange_len[None, :])
+        new_par[:, 0] = 0
+        # write back
+        score_matrix[act_bidxes] = act_scores
+        alive[act_bidxes] = new_alive
+        par[act_bidxes] = new_par
+    # =====
+    # backward: expand the cycles in reversed order
+    final_heads = par
+    for act_bidxes, cycle_mask, rep, act_par, max_out_link, max_in_link, act_alive in reversed(records):
+        arange_act = np.arange(len(act_bidxes))
+        act_heads = final_heads[act_bidxes]
+        rep_head = act_heads[arange_act, rep]
+        # outside nodes attached to the rep
+        fix_out = act_alive & (~cycle_mask) & (act_heads == rep[:, None])
+        act_heads = np.where(fix_out, max_out_link, act_heads)
+        # inside nodes take the cycle-links, except for the breaking point
+        act_heads = np.where(cycle_mask, act_par, act_heads)
+        act_heads[arange_act, max_in_link[arange_act, rep_head]] = rep_head
+        final_heads[act_bidxes] = act_heads
+    # =====
+    # returned values
+    final_heads = np.where(valid, final_heads, 0)
+    final_heads[:, 0] = 0
+    ret_heads = final_heads.astype(np.int32)
+    ret_scores = np.take_along_axis(unlabeled_scores, final_heads[:, :, None], axis=-1).squeeze(-1).astype(np.float32)
+    ret_scores[~valid] = NEG_INF
+    # todo(note): the root's one is meaningless, but keep the same as the others: the edge to the last token
+    ret_scores[:, 0] = unlabeled_scores[np.arange(batch_size), 0, np.maximum(lengths-1, 0)]
+    if labeled:
+        ret_lables = np.take_along_axis(label_argmax, final_heads[:, :, None], axis=-1).squeeze(-1)
+        ret_lables[~valid] = 0
+        ret_lables[:, 0] = 0
+    else:
+        ret_lables = None
+    return ret_heads, ret_lables, ret_scores
+
+# =====
+# the rest of the algorithms, vectorized over the batch (and the span starts for the proj ones)
+# todo(WARN): remember that the score-matrix is [m,h]
+
+# helper: masks of valid modifiers and heads (no root-mod, no self-loop): [bs, len-m, len-h]
+def _valid_arcs(lengths, max_length):
+    arange_len = np.arange(max_length)
+    valid = arange_len[np.newaxis, :] < np.asarray(lengths)[:, np.newaxis]
+    valid_m = valid.copy()
+    valid_m[:, 0] = False
+    return valid_m[:, :, np.newaxis] & valid[:, np.newaxis, :] & (arange_len[:, np.newaxis] != arange_len[np.newaxis, :])
+
+# helper: logsumexp at one axis (with finite NEG_INF, no need to care about -inf)
+def _logsumexp(x, axis):
+    x_max = x.max(axis=axis, keepdims=True)
+    return (x_max + np.log(np.exp(x - x_max).sum(axis=axis, keepdims=True))).squeeze(axis)
+
+# helper: unlabeled scores and labeled-distributing function
+def _split_labeled(scores, labeled, use_max):
+    if labeled:
+        assert scores.ndim == 4, 'dimension of energies is not equal to 4'
+        if use_max:
+            return scores.max(axis=-1), scores.argmax(axis=-1).astype(np.int32)
+        else:
+            return _logsumexp(scores, -1), None
+    else:
+        assert scores.ndim == 3, 'dimension of energies is not equal to 3'
+        return scores, None
+
+# -----
+# Eisner's algorithm
+# -- the charts are [s, t, bs] as in cmst: [s,t] (s<t) is "s->t" (head s), [t,s] is "s<-t" (head t)
+# -- each span width is one step, all the starts and instances are calculated together
+# todo(note): marginal_proj is on par or faster than cmst, but mst_proj (whose backtracking is sequential over
+#  the tree depth) is still several times slower than cmst_proj, prefer cmst if compiled (see main6 in test_mst)
+
+# [n, n, bs] -> [n-w, w, bs]: x[i+o0, i+o1+k] if dim==1 else x[i+o0+k, i+o1], for i in range(n-w), k in range(w)
+# todo(note): the elements of one stripe never overlap, thus it is safe to write (add) to a writeable one
+def _stripe(x, w, offset, dim, writeable=False):
+    n = x.shape[0]
+    s0, s1, s2 = x.strides
+    return np.lib.stride_tricks.as_strided(x[offset[0]:, offset[1]:], shape=(n-w, w, x.shape[2]),
+                                           strides=(s0+s1, (s1 if dim==1 else s0), s2), writeable=writeable)
+
+# scores_t: [m, h, bs] -> charts (com, incom) with max or logsumexp
+def _eisner_inside(scores_t, use_max):
+    n, _, batch_size = scores_t.shape
+    chart_com = np.full([n, n, batch_size], NEG_INF, dtype=scores_t.dtype)
+    chart_incom = np.full([n, n, batch_size], NEG_INF, dtype=scores_t.dtype)
+    arange_len = np.arange(n)
+    chart_com[arange_len, arange_len] = 0.
+    chart_incom[arange_len, arange_len] = 0.
+    # [n-w, w, bs] -> [n-w, bs]
+    _reduce = (lambda v: v.max(axis=1)) if use_max else (lambda v: _logsumexp(v, 1))
+    for w in range(1, n):
+        s = arange_len[:n-w]
+        t = s + w
+        # 1. incomplete ones, I[s->t]/I[s<-t]: C[s->r] + C[r+1<-t]
+        best = _reduce(_stripe(chart_com, w, (0, 0), 1) + _stripe(chart_com, w, (w, 1), 1))
+        chart_incom[t, s] = best + scores_t[s, t]
+        chart_incom[s, t] = best + scores_t[t, s]
+        # 2.1 complete right -> left, C[s<-t]: C[s<-r] + I[r<-t]
+        chart_com[t, s] = _reduce(_stripe(chart_incom, w, (w, 0), 1) + _stripe(chart_com, w, (0, 0), 0))
+        # 2.2 complete left -> right, C[s->t]: I[s->r] + C[r->t]
+        chart_com[s, t] = _reduce(_stripe(chart_incom, w, (0, 1), 1) + _stripe(chart_com, w, (1, w), 0))
+    return chart_com, chart_incom
+
+# backtracking (as cmst's _inside_max_fill), but for all the instances together and without stored pointers:
+# -- the items (bidx, h, m, comp) of one level are expanded together, re-finding their best splits from the charts
+def _eisner_backtrack(chart_com, chart_incom, lengths):
+    n, _, batch_size = chart_com.shape
+    heads = np.zeros([batch_size, n], dtype=np.int32)
+    R = np.arange(n)[np.newaxis, :]  # [1, n]
+    # batch-first copies for gathering whole rows: [bs, x, r] for chart[x, r] and chart[r, x]
+    incom_rows = np.ascontiguousarray(chart_incom.transpose(2, 0, 1))
+    com_rows = np.ascontiguousarray(chart_com.transpose(2, 0, 1))
+    com_cols = np.ascontiguousarray(chart_com.transpose(2, 1, 0))
+    # for chart[x, r+1]
+    com_rows_next = np.concatenate([com_rows[:, :, 1:], np.full([batch_size, n, 1], NEG_INF, dtype=com_rows.dtype)], -1)
+    lengths = np.asarray(lengths)
+    B, H, M, COMP = np.arange(batch_size), np.zeros(batch_size, dtype=np.int64), lengths-1, np.ones(batch_size, dtype=bool)
+    while True:
+        keep = (H != M)
+        B, H, M, COMP = B[keep], H[keep], M[keep], COMP[keep]
+        if len(B) == 0:
+            break
+        H1, M1 = H[:, np.newaxis], M[:, np.newaxis]
+        LO, HI = np.minimum(H, M), np.maximum(H, M)
+        # comp: C[h..m] = I[h->r] + C[r..m], r in (h, m] or [m, h); incom: I = C[lo->r] + C[r+1<-hi], r in [lo, hi)
+        comp_vals = incom_rows[B, H] + com_cols[B, M]
+        comp_valid = np.where(H1 < M1, (R > H1) & (R <= M1), (R >= M1) & (R < H1))
+        incom_vals = com_rows[B, LO] + com_rows_next[B, HI]
+        incom_valid = (R >= LO[:, np.newaxis]) & (R < HI[:, np.newaxis])
+        C1 = COMP[:, np.newaxis]
+        vals = np.where(np.where(C1, comp_valid, incom_valid), np.where(C1, comp_vals, incom_vals), -np.inf)
+        index = vals.argmax(axis=-1)
+        heads[B[COMP], index[COMP]] = H[COMP]
+        # new items
+        # comp: I(h, r), C(r, m); incom: C(h, r or r+1), C(m, r+1 or r)
+        is_left = (H > M)
+        first_m = np.where(COMP | ~is_left, index, index+1)
+        second_h = np.where(COMP, index, M)
+        second_m = np.where(COMP, M, np.where(is_left, index, index+1))
+        B = np.concatenate([B, B])
+        H = np.concatenate([H, second_h])
+        M = np.concatenate([first_m, second_m])
+        COMP = np.concatenate([~COMP, np.ones_like(COMP)])
+    return heads
+
+# outside algorithm as the back-propagation of the inside one (the gradients of logZ are the marginals)
+# -- going through the same stripes in the reversed order, each span width is one step as in _eisner_inside
+# [n, n, bs] -> marginals of the arcs: [m, h, bs]
+def _eisner_outside(scores_t, beta_com, beta_incom, lengths):
+    n, _, batch_size = scores_t.shape
+    grad_com = np.zeros([n, n, batch_size], dtype=scores_t.dtype)
+    grad_incom = np.zeros([n, n, batch_size], dtype=scores_t.dtype)
+    grad_scores = np.zeros([n, n, batch_size], dtype=scores_t.dtype)
+    grad_com[0, np.asarray(lengths)-1, np.arange(batch_size)] = 1.
+    arange_len = np.arange(n)
+    # [n-w, w, bs], [n-w, bs], [n-w, bs] -> [n-w, w, bs]
+    def _distribute(v, lse, g):
+        return np.exp(v - lse[:, np.newaxis]) * g[:, np.newaxis]
+    for w in range(n-1, 0, -1):
+        s = arange_len[:n-w]
+        t = s + w
+        # 2.2 C[s->t]: I[s->r] + C[r->t]
+        v = _stripe(beta_incom, w, (0, 1), 1) + _stripe(beta_com, w, (1, w), 0)
+        g = _distribute(v, beta_com[s, t], grad_com[s, t])
+        _stripe(grad_incom, w, (0, 1), 1, True)[:] += g
+        _stripe(grad_com, w, (1, w), 0, True)[:] += g
+        # 2.1 C[s<-t]: C[s<-r] + I[r<-t]
+        v = _stripe(beta_incom, w, (w, 0), 1) + _stripe(beta_com, w, (0, 0), 0)
+        g = _distribute(v, beta_com[t, s], grad_com[t, s])
+        _stripe(grad_incom, w, (w, 0), 1, True)[:] += g
+        _stripe(grad_com, w, (0, 0), 0, True)[:] += g
+        # 1. I[s->t]/I[s<-t]: C[s->r] + C[r+1<-t] (+ the arc)
+        g_left, g_right = grad_incom[t, s], grad_incom[s, t]
+        grad_scores[s, t] = g_left
+        grad_scores[t, s] = g_right
+        v = _stripe(beta_com, w, (0, 0), 1) + _stripe(beta_com, w, (w, 1), 1)
+        g = _distribute(v, beta_incom[t, s] - scores_t[s, t], g_left + g_right)
+        _stripe(grad_com, w, (0, 0), 1, True)[:] += g
+        _stripe(grad_com, w, (w, 1), 1, True)[:] += g
+    return grad_scores
+
+# first-order mst-proj Eisner's algorithm
 def mst_proj(scores, lengths, labeled=True):
-    raise NotImplementedError("Compile/Use Cython/NN version for this one!")
+    unlabeled_scores, label_argmax = _split_labeled(scores, labeled, True)
+    batch_size, max_length = unlabeled_scores.shape[:2]
+    scores_t = np.ascontiguousarray(unlabeled_scores.transpose(1, 2, 0), dtype=np.float32)
+    chart_com, chart_incom = _eisner_inside(scores_t, True)
+    # returned values
+    ret_heads = _eisner_backtrack(chart_com, chart_incom, lengths)
+    ret_heads[:, 0] = 0
+    valid_m = np.arange(max_length)[np.newaxis, :] < np.asarray(lengths)[:, np.newaxis]
+    valid_m[:, 0] = False
+    ret_scores = np.where(valid_m, np.take_along_axis(unlabeled_scores, ret_heads[:, :, np.newaxis], axis=-1).squeeze(-1), NEG_INF).astype(np.float32)
+    if labeled:
+        ret_lables = np.where(valid_m, np.take_along_axis(label_argmax, ret_heads[:, :, np.newaxis], axis=-1).squeeze(-1), 0).astype(np.int32)
+    else:
+        ret_lables = None
+    return ret_heads, ret_lables, ret_scores
 
+# greedily select the best head (and label) for each modifier
 def mst_greedy(scores, lengths, labeled=True):
-    raise NotImplementedError("Compile/Use Cython/NN version for this one!")
+    if labeled:
+        assert scores.ndim == 4, 'dimension of energies is not equal to 4'
+    else:
+        assert scores.ndim == 3, 'dimension of energies is not equal to 3'
+    batch_size, max_length = scores.shape[:2]
+    valid_arcs = _valid_arcs(lengths, max_length)
+    if labeled:
+        num_label = scores.shape[-1]
+        combined_scores = np.where(valid_arcs[:, :, :, np.newaxis], scores, NEG_INF).reshape([batch_size, max_length, -1])
+        combined_argmax = combined_scores.argmax(axis=-1)
+        ret_heads, ret_lables = combined_argmax // num_label, combined_argmax % num_label
+        ret_scores = np.take_along_axis(combined_scores, combined_argmax[:, :, np.newaxis], axis=-1).squeeze(-1)
+    else:
+        masked_scores = np.where(valid_arcs, scores, NEG_INF)
+        ret_heads, ret_lables = masked_scores.argmax(axis=-1), None
+        ret_scores = np.take_along_axis(masked_scores, ret_heads[:, :, np.newaxis], axis=-1).squeeze(-1)
+    # root and paddings
+    valid_m = valid_arcs.any(axis=-1)
+    ret_heads = np.where(valid_m, ret_heads, 0).astype(np.int32)
+    ret_scores = np.where(valid_m, ret_scores, NEG_INF).astype(np.float32)
+    if labeled:
+        ret_lables = np.where(valid_m, ret_lables, 0).astype(np.int32)
+    return ret_heads, ret_lables, ret_scores
 
 #
+def _labeled_marginals(marginals_unlabeled, scores, unlabeled_scores, labeled):
+    if labeled:
+        marginals_unlabeled = marginals_unlabeled[:, :, :, np.newaxis] * np.exp(scores - unlabeled_scores[:, :, :, np.newaxis])
+    return marginals_unlabeled.astype(np.float32)
+
+# Matrix-Tree Theorem (the same as nmst.nmarginal_unproj, with row-max shifting)
 def marginal_unproj(scores, lengths, labeled=True):
-    raise NotImplementedError("Compile/Use Cython/NN version for this one!")
+    unlabeled_scores, _ = _split_labeled(scores.astype(np.float64), labeled, False)
+    batch_size, max_length = unlabeled_scores.shape[:2]
+    valid_arcs = _valid_arcs(lengths, max_length)
+    valid_m = valid_arcs.any(axis=-1)  # [bs, m]
+    masked_scores = np.where(valid_arcs, unlabeled_scores, NEG_INF)
+    row_max = np.where(valid_m, masked_scores.max(axis=-1), 0.)[:, :, np.newaxis]
+    A = np.where(valid_arcs, np.exp(masked_scores - row_max), 0.)  # [bs, m, h]
+    # L = D - A, set identity for invalid rows
+    L = -A
+    arange_len = np.arange(max_length)
+    L[:, arange_len, arange_len] += A.sum(axis=-1) + (~valid_m)
+    LM00_inv = np.zeros([batch_size, max_length, max_length])
+    LM00_inv[:, 1:, 1:] = np.linalg.inv(L[:, 1:, 1:])
+    # marginal(m,h) = A[m,h] * (INV[m,m] - INV[h,m])
+    inv_diag = LM00_inv[:, arange_len, arange_len][:, :, np.newaxis]  # [bs, m, 1]
+    marginals_unlabeled = A * (inv_diag - LM00_inv.transpose(0, 2, 1))
+    return _labeled_marginals(marginals_unlabeled, scores, unlabeled_scores, labeled)
 
+# inside-outside for Eisner's algorithm
 def marginal_proj(scores, lengths, labeled=True):
-    raise NotImplementedError("Compile/Use Cython/NN version for this one!")
+    unlabeled_scores, _ = _split_labeled(scores.astype(np.float64), labeled, False)
+    batch_size, max_length = unlabeled_scores.shape[:2]
+    scores_t = np.ascontiguousarray(unlabeled_scores.transpose(1, 2, 0))
+    beta_com, beta_incom = _eisner_inside(scores_t, False)
+    marginals_t = _eisner_outside(scores_t, beta_com, beta_incom, lengths)  # [m, h, bs]
+    marginals_unlabeled = np.where(_valid_arcs(lengths, max_length), marginals_t.transpose(2, 0, 1), 0.)
+    return _labeled_marginals(marginals_unlabeled, scores, unlabeled_scores, labeled)
 
+# locally normalized for each modifier
 def marginal_greedy(scores, lengths, labeled=True):
-    raise NotImplementedError("Compile/Use Cython/NN version for this one!")
+    batch_size, max_length = scores.shape[:2]
+    valid_arcs = _valid_arcs(lengths, max_length)
+    if labeled:
+        valid_arcs = np.broadcast_to(valid_arcs[:, :, :, np.newaxis], scores.shape)
+    masked_scores = np.where(valid_arcs, scores.astype(np.float64), NEG_INF).reshape([batch_size, max_length, -1])
+    log_z = _logsumexp(masked_scores, -1)[:, :, np.newaxis]
+    marginals = np.where(valid_arcs, np.exp(masked_scores - log_z).reshape(scores.shape), 0.)
+    return marginals.astype(np.float32)
@@ -6,34 +6,39 @@
 # todo(warn): the arguments are different than the CPU versions!
 
 import math
+import numpy as np
 from msp.nn import BK
 from msp.utils import Constants, zwarn
 
 # todo(warn): specially differentiate nmst and mst, accepting and returning different things (tensor vs. arr)
+# todo(note): no cython versions for greedy and marginal_unproj/greedy, always use the python (numpy) ones
+from .mst import mst_greedy, marginal_unproj, marginal_greedy
 try:
     from .cmst import cmst_unproj as mst_unproj
     from .cmst import cmst_proj as mst_proj
-    from .cmst import cmst_greedy as mst_greedy
-    from .cmst import cmarginal_unproj as marginal_unproj
     from .cmst import cmarginal_proj as marginal_proj
-    from .cmst import cmarginal_greedy as marginal_greedy
 except:
     zwarn("cython version of MST has not been compiled, use python version instead!")
-    from .mst import mst_unproj, mst_proj, mst_greedy
-    from .mst import marginal_unproj, marginal_proj, marginal_greedy
+    from .mst import mst_unproj_batched as mst_unproj
+    from .mst import mst_proj
+    from .mst import marginal_proj
 
 # =====
 # algorithm wrappers
 
 # todo(+1): simple for unlabeled situation
-def _common_nmst(CPU_f, scores_expr, mask_expr, lengths_arr, labeled, ret_arr):
+# pool: optional DecPool to shard the CPU decoding across workers
+def _common_nmst(CPU_f, scores_expr, mask_expr, lengths_arr, labeled, ret_arr, pool=None):
     assert labeled
     with BK.no_grad_env():
         # argmax-label: [BS, m, h]
         scores_unlabeled_max, labels_argmax = scores_expr.max(-1)
         #
         scores_unlabeled_max_arr = BK.get_value(scores_unlabeled_max)
-        mst_heads_arr, _, mst_scores_arr = CPU_f(scores_unlabeled_max_arr, lengths_arr, labeled=False)
+        if pool is None:
+            mst_heads_arr, _, mst_scores_arr = CPU_f(scores_unlabeled_max_arr, lengths_arr, labeled=False)
+        else:
+            mst_heads_arr, _, mst_scores_arr = pool.run_batched(CPU_f, scores_unlabeled_max_arr, lengths_arr, labeled=False)
         # [BS, m]
         mst_heads_expr = BK.input_idx(mst_heads_arr)
         mst_labels_expr = BK.gather_one_lastdim(labels_argmax, mst_heads_expr).squeeze(-1)
@@ -44,11 +49,23 @@ def _common_nmst(CPU_f, scores_expr, mask_expr, lengths_arr, labeled, ret_arr):
             return mst_heads_expr, mst_labels_expr, BK.input_real(mst_scores_arr)
 
 #
-def nmst_unproj(scores_expr, mask_expr, lengths_arr, labeled=True, ret_arr=False):
-    return _common_nmst(mst_unproj, scores_expr, mask_expr, lengths_arr, labeled, ret_arr)
+def nmst_unproj(scores_expr, mask_expr, lengths_arr, labeled=True, ret_arr=False, pool=None):
+    return _common_nmst(mst_unproj, scores_expr, mask_expr, lengths_arr, labeled, ret_arr, pool)
 
-def nmst_proj(scores_expr, mask_expr, lengths_arr, labeled=True, ret_arr=False):
-    return _common_nmst(mst_proj, scores_expr, mask_expr, lengths_arr, labeled, ret_arr)
+# use_tensor: use the tensorized Eisner (on-device), otherwise the CPU version
+def nmst_proj(scores_expr, mask_expr, lengths_arr, labeled=True, ret_arr=False, pool=None, use_tensor=False):
+    if not use_tensor:
+        return _common_nmst(mst_proj, scores_expr, mask_expr, lengths_arr, labeled, ret_arr, pool)
+    assert labeled
+    with BK.no_grad_env():
+        scores_unlabeled_max, labels_argmax = scores_expr.max(-1)
+        mst_heads_expr, mst_scores_expr = tmst_proj(scores_unlabeled_max, lengths_arr)
+        mst_labels_expr = BK.gather_one_lastdim(labels_argmax, mst_heads_expr).squeeze(-1)
+        if ret_arr:
+            return BK.get_value(mst_heads_expr).astype(np.int32), BK.get_value(mst_labels_expr).astype(np.int32), \
+                   BK.get_value(mst_scores_expr)
+        else:
+            return mst_heads_expr, mst_labels_expr, mst_scores_expr
 
 # [BS, Len, Len, L], [BS, Len] -> [BS, Len]
 # todo(warn): assume the inputs' unmasked entries have already been masked with small values
@@ -206,21 +223,157 @@ def nmarginal_unproj(scores_expr, mask_expr, lengths_arr, labeled=True):
 
 # b tasks/zdpar/algo/nmst:102
 
+# =====
+# log-space Matrix-Tree: logZ = log(det(LM00)) by batched LU, and marginals = d(logZ)/d(scores) by autograd
+# -- each row (modifier) is shifted by its max score (exactly one head for each m, thus simply added back to logZ)
+# -- instances are bucketed by length to avoid the LU on the padded parts of long matrices
+# todo(warn): still ill-conditioned if very peaky scores make cycles in the greedy graph (-inf logZ if underflow)
+
+# [bs, m, h] (double, unlabeled), [bs, m] -> [bs]
+def _logz_unproj(scores_unlabeled, mask_expr):
+    maxlen = BK.get_shape(scores_unlabeled, 1)
+    valid_m = mask_expr.clone()
+    valid_m[:, 0] = 0.  # root is not a modifier
+    valid_mh = (valid_m.unsqueeze(-1) * mask_expr.unsqueeze(-2) * (1.-BK.eye(maxlen).double())) > 0.  # [bs, m, h]
+    scores_masked = scores_unlabeled.masked_fill(~valid_mh, float("-inf"))
+    # [bs, m, 1], no gradients needed since logZ is exactly the same for any shifting
+    row_max = scores_masked.max(-1, keepdim=True)[0].detach()
+    row_max = row_max.masked_fill(valid_m.unsqueeze(-1) <= 0., 0.)
+    A = BK.exp(scores_masked - row_max)  # [bs, m, h], 0. for invalid ones
+    # L = D - A, set identity for the invalid rows to make it a block-diag one
+    D = A.sum(-1) + (1.-valid_m)
+    L = BK.diag_embed(D) - A
+    logabsdet = BK.get_logabsdet(L[:, 1:, 1:])
+    return logabsdet + row_max.squeeze(-1).sum(-1)
+
+# [BS, Len, Len, L], [BS, Len] -> [BS]; differentiable w.r.t scores_expr (if not under no_grad_env)
+# todo(warn): assume that there are solutions (otherwise -inf); the same masking as nmarginal_unproj
+def nlogz_unproj(scores_expr, mask_expr, lengths_arr, labeled=True, bucket_width=10):
+    scores_expr_d = scores_expr.double()
+    mask_expr_d = mask_expr.double()
+    scores_unlabeled = BK.logsumexp(scores_expr_d, dim=-1) if labeled else scores_expr_d  # [BS, m, h]
+    bsize, maxlen = BK.get_shape(mask_expr)
+    if lengths_arr is None:
+        lengths_arr = BK.get_value(mask_expr.sum(-1)).astype(np.int32)
+    # length-bucketing
+    if bucket_width <= 0:
+        return _logz_unproj(scores_unlabeled, mask_expr_d)
+    bucket_ids = (np.asarray(lengths_arr)-1) // bucket_width
+    all_idxes, all_logz = [], []
+    for one_bid in np.unique(bucket_ids):
+        one_idxes = (bucket_ids == one_bid).nonzero()[0]
+        one_len = min(maxlen, int(np.max(lengths_arr[one_idxes])))
+        one_idxes_expr = BK.input_idx(one_idxes)
+        all_idxes.append(one_idxes_expr)
+        all_logz.append(_logz_unproj(scores_unlabeled[one_idxes_expr, :one_len, :one_len],
+                                     mask_expr_d[one_idxes_expr, :one_len]))
+    ret = BK.zeros([bsize]).double().index_copy(0, BK.concat(all_idxes, 0), BK.concat(all_logz, 0))
+    return ret
+
+# [BS, Len, Len, L], [BS, Len] -> ([BS, Len, Len, L], [BS]); the returned logZ is kept non-finite for the fallback ones
+def nmarginal_unproj_logz(scores_expr, mask_expr, lengths_arr, labeled=True, bucket_width=10):
+    with BK.grad_env():
+        scores_leaf = scores_expr.detach().requires_grad_(True)
+        logz = nlogz_unproj(scores_leaf, mask_expr, lengths_arr, labeled, bucket_width)
+        marginals, = BK.get_grad(logz.sum(), scores_leaf)
+    with BK.no_grad_env():
+        # 0. for the no-solution ones
+        marginals = marginals.masked_fill(BK.isnan(marginals), 0.)
+        if labeled:
+            marginals = _ensure_margins_norm(marginals)
+        # todo(note): fall back to the (regularized) inverse-based ones for the ill-conditioned (non-finite logZ)
+        fallback_idxes = (~np.isfinite(BK.get_value(logz))).nonzero()[0]
+        if len(fallback_idxes) > 0:
+            fallback_idxes_expr = BK.input_idx(fallback_idxes)
+            fallback_scores = scores_expr[fallback_idxes_expr]
+            fallback_marginals = nmarginal_unproj(fallback_scores if labeled else fallback_scores.unsqueeze(-1),
+                                                  mask_expr[fallback_idxes_expr], None, labeled=True)
+            marginals[fallback_idxes_expr] = fallback_marginals if labeled else fallback_marginals.squeeze(-1)
+    return marginals, logz.detach().float()
+
 # [BS, Len, Len, L], [BS, Len] -> [BS, Len, Len, L]
 # use CPU's UNLABELED dynamic-programming inside-outside algorithm
 # todo(+1): simple for unlabeled situation
 # todo(warn): outside is similar to unproj, but do not need that much masks here,
 #  since most are handled well in the CPU algorithm
-def nmarginal_proj(scores_expr, mask_expr, lengths_arr, labeled=True):
+def nmarginal_proj(scores_expr, mask_expr, lengths_arr, labeled=True, pool=None, use_tensor=False):
     assert labeled
     with BK.no_grad_env():
         # first make it unlabeled by sum-exp
         scores_unlabeled = BK.logsumexp(scores_expr, dim=-1)  # [BS, m, h]
         # marginal for unlabeled
-        scores_unlabeled_arr = BK.get_value(scores_unlabeled)
-        marginals_unlabeled_arr = marginal_proj(scores_unlabeled_arr, lengths_arr, False)
+        if use_tensor:
+            marginals_unlabeled_expr = tmarginal_proj(scores_unlabeled, lengths_arr)
+        else:
+            scores_unlabeled_arr = BK.get_value(scores_unlabeled)
+            if pool is None:
+                marginals_unlabeled_arr = marginal_proj(scores_unlabeled_arr, lengths_arr, False)
+            else:
+                marginals_unlabeled_arr = pool.run_batched(marginal_proj, scores_unlabeled_arr, lengths_arr, labeled=False)
+            marginals_unlabeled_expr = BK.input_real(marginals_unlabeled_arr)
         # back to labeled values
-        marginals_unlabeled_expr = BK.input_real(marginals_unlabeled_arr)
         marginals_labeled_expr = marginals_unlabeled_expr.unsqueeze(-1) * BK.exp(scores_expr - scores_unlabeled.unsqueeze(-1))
         # [BS, m, h, L]
         return _ensure_margins_norm(marginals_labeled_expr)
+
+# =====
+# tensorized Eisner's algorithm (first-order projective), looping over span widths while vectorizing the whole batch
+# -- the charts are [s, t, BS] as in the CPU version: [s,t] (s<t) is "s->t" (head s), [t,s] is "s<-t" (head t)
+# -- Viterbi and marginals are obtained by autograd on the root chart (d(max)/d(score) is the one-hot tree)
+# todo(warn): here the scores are also [BS, m, h], and no single-root constraint (the same as the CPU version)
+
+# [n, n, BS] -> [n-w, w, BS]: x[i+o0, i+o1+k] if dim==1 else x[i+o0+k, i+o1], for i in range(n-w), k in range(w)
+def _eisner_stripe(x, n, w, offset, dim):
+    numel = BK.get_shape(x, -1)
+    stride = [(n+1)*numel, (1 if dim==1 else n)*numel, 1]
+    return x.as_strided([n-w, w, numel], stride, storage_offset=(offset[0]*n+offset[1])*numel)
+
+# [BS, m, h], [BS] -> [BS], log-partition (use_max=False) or the best tree score (use_max=True)
+def _eisner_inside(scores_unlabeled, lengths_arr, use_max):
+    bsize, maxlen = BK.get_shape(scores_unlabeled)[:2]
+    reduce_f = (lambda t: t.max(-1)[0]) if use_max else (lambda t: BK.logsumexp(t, dim=-1))
+    scores_t = scores_unlabeled.permute(1, 2, 0)  # [m, h, BS]
+    chart_com = BK.constants([maxlen, maxlen, bsize], Constants.REAL_PRAC_MIN, dtype=scores_unlabeled.dtype)
+    chart_incom = BK.constants([maxlen, maxlen, bsize], Constants.REAL_PRAC_MIN, dtype=scores_unlabeled.dtype)
+    chart_com.diagonal().fill_(0.)
+    chart_incom.diagonal().fill_(0.)
+    for w in range(1, maxlen):
+        # 1. incomplete ones, I[s->t]/I[s<-t]: C[s->r] + C[r+1<-t]
+        incom_r = reduce_f((_eisner_stripe(chart_com, maxlen, w, (0, 0), 1)
+                            + _eisner_stripe(chart_com, maxlen, w, (w, 1), 1)).permute(2, 0, 1))  # [BS, n]
+        chart_incom.diagonal(-w).copy_(incom_r + scores_t.diagonal(w))
+        chart_incom.diagonal(w).copy_(incom_r + scores_t.diagonal(-w))
+        # 2.1 complete right -> left, C[s<-t]: C[s<-r] + I[r<-t]
+        com_left = reduce_f((_eisner_stripe(chart_incom, maxlen, w, (w, 0), 1)
+                             + _eisner_stripe(chart_com, maxlen, w, (0, 0), 0)).permute(2, 0, 1))
+        chart_com.diagonal(-w).copy_(com_left)
+        # 2.2 complete left -> right, C[s->t]: I[s->r] + C[r->t]
+        com_right = reduce_f((_eisner_stripe(chart_incom, maxlen, w, (0, 1), 1)
+                              + _eisner_stripe(chart_com, maxlen, w, (1, w), 0)).permute(2, 0, 1))
+        chart_com.diagonal(w).copy_(com_right)
+    # from 0 to the rest
+    lengths_expr = BK.input_idx(lengths_arr)
+    return chart_com[0, lengths_expr-1, BK.arange_idx(bsize)]
+
+# [BS, m, h], [BS] -> (heads[BS, m], scores[BS, m])
+def tmst_proj(scores_unlabeled, lengths_arr):
+    bsize, maxlen = BK.get_shape(scores_unlabeled)[:2]
+    with BK.grad_env():
+        scores_leaf = scores_unlabeled.detach().requires_grad_(True)
+        best_scores = _eisner_inside(scores_leaf, lengths_arr, True)
+        tree_indicators, = BK.get_grad(best_scores.sum(), scores_leaf)  # [BS, m, h], one-hot for m>0
+    heads = tree_indicators.max(-1)[1]
+    heads[:, 0] = 0
+    valid_mask = BK.arange_idx(maxlen).unsqueeze(0) < BK.input_idx(lengths_arr).unsqueeze(-1)
+    heads *= valid_mask.long()
+    arc_scores = BK.gather_one_lastdim(scores_unlabeled, heads).squeeze(-1)
+    arc_scores = arc_scores.masked_fill(~valid_mask, Constants.REAL_PRAC_MIN)
+    return heads, arc_scores
+
+# [BS, m, h], [BS] -> [BS, m, h]
+def tmarginal_proj(scores_unlabeled, lengths_arr):
+    with BK.grad_env():
+        scores_leaf = scores_unlabeled.detach().requires_grad_(True)
+        log_partitions = _eisner_inside(scores_leaf, lengths_arr, False)
+        marginals, = BK.get_grad(log_partitions.sum(), scores_leaf)
+    return marginals
@@ -0,0 +1,77 @@
+#
+
+# decoding pools: shard the CPU decoding of a batch (mst_*/marginal_* or per-sentence hop_decode) across workers
+# todo(note): the CPU decoders are independent for each instance, thus the results are bit-identical to the serial path
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+
+from msp.utils import Conf, zcheck
+
+class DecPoolConf(Conf):
+    def __init__(self):
+        self.mode = "serial"        # serial/thread/process: thread only helps if the decoder releases the GIL
+        self.num_workers = 4
+        self.min_shard_size = 4     # no splitting if the batch is smaller than this *num_workers
+
+# run one shard in the worker, the CPU_f should be a module-level function (picklable for the process mode)
+def _run_shard(CPU_f, scores_arr, lengths_arr, labeled):
+    return CPU_f(scores_arr, lengths_arr, labeled=labeled)
+
+# call f(*args) in the worker
+def _run_one(f, args):
+    return f(*args)
+
+class DecPool:
+    def __init__(self, conf: DecPoolConf):
+        self.conf = conf
+        zcheck(conf.mode in ["serial", "thread", "process"], "Unknown dec-pool mode: " + conf.mode)
+        self.num_workers = max(1, conf.num_workers)
+        self.serial = (conf.mode == "serial") or (self.num_workers <= 1)
+        self._executor = None   # lazily built
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.conf.mode == "thread":
+                self._executor = ThreadPoolExecutor(self.num_workers)
+            else:
+                self._executor = ProcessPoolExecutor(self.num_workers)
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    # CPU_f: [bs, len, len, *], [bs] -> tuple of ([bs, *] or None); shard the batch dimension
+    def run_batched(self, CPU_f, scores_arr, lengths_arr, labeled=False):
+        batch_size = len(lengths_arr)
+        num_shards = min(self.num_workers, batch_size // max(1, self.conf.min_shard_size))
+        if self.serial or num_shards <= 1:
+            return CPU_f(scores_arr, lengths_arr, labeled=labeled)
+        # interleaved shards: the batch is usually sorted by length, this makes the costs more balanced
+        shard_idxes = [np.arange(i, batch_size, num_shards) for i in range(num_shards)]
+        executor = self._get_executor()
+        futures = [executor.submit(_run_shard, CPU_f, scores_arr[one_idxes], lengths_arr[one_idxes], labeled)
+                   for one_idxes in shard_idxes]
+        shard_results = [f.result() for f in futures]
+        # scatter back
+        if not isinstance(shard_results[0], tuple):
+            return self._scatter(shard_idxes, shard_results, batch_size)
+        return tuple(self._scatter(shard_idxes, [z[i] for z in shard_results], batch_size)
+                     for i in range(len(shard_results[0])))
+
+    def _scatter(self, shard_idxes, pieces, batch_size):
+        if pieces[0] is None:
+            return None
+        ret = np.empty((batch_size, ) + pieces[0].shape[1:], dtype=pieces[0].dtype)
+        for one_idxes, one_piece in zip(shard_idxes, pieces):
+            ret[one_idxes] = one_piece
+        return ret
+
+    # list of args -> list of f(*args), in the original order
+    def map(self, f, list_args):
+        if self.serial or len(list_args) <= 1:
+            return [f(*args) for args in list_args]
+        executor = self._get_executor()
+        return list(executor.map(_run_one, [f]*len(list_args), list_args))
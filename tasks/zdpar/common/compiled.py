@@ -0,0 +1,114 @@
+#
+
+# compiled corpus: flat arrays of string-ids and vocab-idxes (with sentence offsets), built once with a vocab package
+# -> "{dir}/meta.json": string tables, aug-code and the vocab signature
+# -> "{dir}/*.npy": token-level arrays (including the artificial ROOT), loaded with mmap
+
+import os
+import json
+from typing import List
+import numpy as np
+
+from msp.utils import zopen, zlog, zcheck
+from msp.data import Streamer
+
+from .data import ParseInstance
+from .vocab import ParserVocabPackage
+
+# token-level fields: (name, factor-name, is-str)
+_COMPILED_FIELDS = [("word_s", "words", True), ("pos_s", "poses", True), ("label_s", "labels", True),
+                    ("word_i", "words", False), ("pos_i", "poses", False), ("label_i", "labels", False),
+                    ("head", "heads", False)]
+
+# compile the (raw) parse stream with the vpack
+def compile_corpus(stream, vpack: ParserVocabPackage, output_dir: str, aug_code: str):
+    from .run import IndexerStreamer  # todo(note): avoid circular import
+    os.makedirs(output_dir, exist_ok=True)
+    str_maps = {"words": {}, "poses": {}, "labels": {}}  # str -> id
+    buffers = {z[0]: [] for z in _COMPILED_FIELDS}
+    char_buffer, char_lens, sent_lens = [], [], []
+    has_fields = None
+    for inst in IndexerStreamer(stream, vpack, None):
+        cur_has = {n: getattr(inst, n).has_vals() for n in ["poses", "heads", "labels"]}
+        if has_fields is None:
+            has_fields = cur_has
+        zcheck(has_fields == cur_has, "Inconsistent fields for compiling")
+        # todo(note): store the raw words (without aug-code) and re-aug when reading
+        raw_words = [ParseInstance.ROOT_SYMBOL] + inst.chars.vals[1:]
+        for name, factor_name, is_str in _COMPILED_FIELDS:
+            factor = getattr(inst, factor_name)
+            if factor_name != "words" and not has_fields[factor_name]:
+                continue
+            if is_str:
+                one_map = str_maps[factor_name]
+                vals = raw_words if factor_name=="words" else factor.vals
+                buffers[name].extend([one_map.setdefault(z, len(one_map)) for z in vals])
+            else:
+                buffers[name].extend(factor.vals if factor_name=="heads" else factor.idxes)
+        for one_cidxes in inst.chars.idxes:
+            char_buffer.extend(one_cidxes)
+            char_lens.append(len(one_cidxes))
+        sent_lens.append(len(inst)+1)
+    # write
+    meta = {"aug_code": aug_code, "vocab_sig": vpack.get_sig(), "has_fields": has_fields,
+            "strs": {k: list(v.keys()) for k,v in str_maps.items()}}
+    with zopen(os.path.join(output_dir, "meta.json"), 'w') as fd:
+        json.dump(meta, fd)
+    for name, one_buffer in buffers.items():
+        np.save(os.path.join(output_dir, name+".npy"), np.asarray(one_buffer, dtype=np.int32))
+    np.save(os.path.join(output_dir, "char_i.npy"), np.asarray(char_buffer, dtype=np.int32))
+    np.save(os.path.join(output_dir, "char_offsets.npy"), np.cumsum([0]+char_lens, dtype=np.int64))
+    np.save(os.path.join(output_dir, "sent_offsets.npy"), np.cumsum([0]+sent_lens, dtype=np.int64))
+    zlog(f"Compile corpus to {output_dir}: {len(sent_lens)} sents, {sum(sent_lens)} toks.")
+    return len(sent_lens)
+
+# lazily materialize (already indexed) instances from the compiled corpus
+class CompiledParseReader(Streamer):
+    def __init__(self, input_dir: str, cut=-1):
+        super().__init__()
+        with zopen(os.path.join(input_dir, "meta.json")) as fd:
+            meta = json.load(fd)
+        self.aug_code = meta["aug_code"]
+        self.vocab_sig = meta["vocab_sig"]
+        self.has_fields = meta["has_fields"] or {}
+        self.strs = meta["strs"]
+        _load = lambda name: np.load(os.path.join(input_dir, name+".npy"), mmap_mode='r')
+        self.arrs = {z[0]: _load(z[0]) for z in _COMPILED_FIELDS}
+        self.char_i, self.char_offsets, self.sent_offsets = _load("char_i"), _load("char_offsets"), _load("sent_offsets")
+        self.num_sent = len(self.sent_offsets) - 1
+        self.cut = cut
+
+    def __len__(self):
+        return self.num_sent
+
+    def _restart(self):
+        pass
+
+    def _estimate_len(self):
+        return self.num_sent if self.cut<0 else min(self.cut, self.num_sent)
+
+    def _next(self):
+        if self.count_ == self.cut or self.count_ >= self.num_sent:
+            return None
+        return self.get(self.count_)
+
+    # random access by index
+    def get(self, idx: int):
+        a, b = int(self.sent_offsets[idx]), int(self.sent_offsets[idx+1])
+        arrs, strs, has_fields = self.arrs, self.strs, self.has_fields
+        _get_strs = lambda name, factor_name: [strs[factor_name][z] for z in arrs[name][a+1:b]]
+        one = ParseInstance(_get_strs("word_s", "words"),
+                            _get_strs("pos_s", "poses") if has_fields.get("poses") else None,
+                            arrs["head"][a+1:b].tolist() if has_fields.get("heads") else None,
+                            _get_strs("label_s", "labels") if has_fields.get("labels") else None, code=self.aug_code)
+        # set idxes
+        one.words.set_idxes(arrs["word_i"][a:b].tolist())
+        char_offsets, char_i = self.char_offsets, self.char_i
+        one.chars.idxes = [char_i[char_offsets[t]:char_offsets[t+1]].tolist() for t in range(a, b)]
+        if has_fields.get("poses"):
+            one.poses.set_idxes(arrs["pos_i"][a:b].tolist())
+        if has_fields.get("labels"):
+            one.labels.set_idxes(arrs["label_i"][a:b].tolist())
+        one.compiled_vocab_sig = self.vocab_sig
+        one.init_idx = idx
+        return one
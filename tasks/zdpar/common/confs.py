@@ -12,12 +12,19 @@ class DConf(Conf):
     def __init__(self):
         # whether allow multi-source mode
         self.multi_source = False  # split file names for inputs (use multi_reader)
+        self.ms_train_weights = ""  # sampling weights (split by ",") of the train sources, empty means round-robin
+        self.ms_train_temperature = 0.  # >0 means sampling with prob~w**(1/T), (sizes as w if no ms_train_weights)
         # data paths
         self.train = ""
         self.dev = ""
         self.test = ""
         self.cache_data = True          # turn off if large data
         self.to_cache_shuffle = False
+        self.cache_compact = False  # cache as CompactParseInstance (array-backed) to save memory
+        # data pipeline: indexing with a worker pool, prefetching batches in a background thread
+        self.data_workers = 0  # 0 means indexing in the main thread
+        self.data_worker_mode = "thread"  # thread/process (inst_preparer always runs in the main process)
+        self.data_prefetch = 0  # queue size of prefetched batches, 0 means no prefetching
         self.dict_dir = "./"
         # cuttings for training (simply for convenience without especially preparing data...)
         self.cut_train = ""
@@ -32,7 +39,7 @@ class DConf(Conf):
         # save name for trainer not here!!
         self.model_load_name = "zmodel.best"         # load name
         self.output_file = "zout"
-        # format (conllu, plain, json)
+        # format (conllu, conllu_fast, plain, json, compiled)
         self.input_format = "conllu"
         self.output_format = "conllu"
         # pretrain
@@ -2,15 +2,17 @@
 
 # data for dependency parsing
 
+import sys
 import json
 from typing import Iterable, List, Set, Dict
 import numpy as np
 import pickle
 
 from msp.utils import zfatal, zopen, zwarn, Random, Helper, MathHelper, zcheck
-from msp.data import Instance, FileOrFdStreamer, VocabHelper, MultiHelper, AdapterStreamer, MultiJoinStreamer
-from msp.zext.dpar import ConlluReader, write_conllu, ConlluParse
+from msp.data import Instance, FileOrFdStreamer, VocabHelper, MultiHelper, AdapterStreamer, MultiMixStreamer
+from msp.zext.dpar import ConlluReader, write_conllu, ConlluParse, ConlluFastReader
 from msp.zext.seq_data import InstanceHelper, SeqFactor, InputCharFactor
+from msp.zext.feat_store import FeatStore
 
 #
 def get_aug_words(ws, aug_code):
@@ -278,17 +280,198 @@ class ParseInstance(Instance):
                     ret[zn] = None
         return ret
 
+# =====
+# compact (array-backed) instance, mainly for the cached corpus
+# -> int fields (idxes, heads) as int32 arrays, chars as one ragged array (flat + offsets), strs are interned
+# -> the lazy caches are class-level None until computed, pred factors are created on access
+# todo(note): vals of int fields (heads) are arrays rather than lists
+
+class CompactSeqFactor:
+    __slots__ = ("vals", "_idxes", "int_vals", "_buf")
+
+    def __init__(self, vals, int_vals=False, prealloc=0):
+        self.int_vals = int_vals
+        self._buf = np.zeros(prealloc, dtype=np.int32) if prealloc>0 else None  # reused for int vals
+        self.vals = None
+        self._idxes = None
+        self.set_vals(vals)
+
+    def __len__(self):
+        return len(self.vals)
+
+    def has_vals(self):
+        return self.vals is not None
+
+    @property
+    def idxes(self):
+        return self._idxes
+
+    @idxes.setter
+    def idxes(self, idxes):
+        self._idxes = None if idxes is None else np.asarray(idxes, dtype=np.int32)
+
+    def set_vals(self, vals):
+        if vals is not None and self.int_vals:
+            buf = self._buf
+            if buf is not None and len(buf) == len(vals):
+                buf[:] = vals
+                vals = buf
+            else:
+                vals = np.asarray(vals, dtype=np.int32)
+        self.vals = vals
+        self._idxes = None
+
+    def set_idxes(self, idxes):
+        zcheck(len(idxes)==len(self.vals), "Unmatched length of input idxes.")
+        self.idxes = idxes
+
+    def build_idxes(self, voc):
+        self.idxes = voc.lookup(self.vals)
+
+    def build_vals(self, idxes, voc):
+        self.idxes = idxes
+        self.vals = [voc.idx2word(i) for i in idxes]
+
+# chars: ragged array
+class CompactCharFactor:
+    __slots__ = ("vals", "_flat", "_offsets")
+
+    def __init__(self, words):
+        self.vals = words
+        self._flat = None
+        self._offsets = None
+
+    def __len__(self):
+        return len(self.vals)
+
+    def has_vals(self):
+        return self.vals is not None
+
+    @property
+    def idxes(self):
+        if self._flat is None:
+            return None
+        flat, offsets = self._flat, self._offsets
+        return [flat[offsets[i]:offsets[i+1]] for i in range(len(offsets)-1)]
+
+    @idxes.setter
+    def idxes(self, idxes):
+        if idxes is None:
+            self._flat, self._offsets = None, None
+        else:
+            self._offsets = np.cumsum([0] + [len(z) for z in idxes], dtype=np.int32)
+            self._flat = np.asarray([c for z in idxes for c in z], dtype=np.int32)
+
+    def build_idxes(self, c_voc):
+        self._flat, self._offsets = c_voc.lookup_batch(self.vals)
+
+class CompactParseInstance(ParseInstance):
+    PRED_NAMES = ["pred_poses", "pred_pos_scores", "pred_heads", "pred_labels", "pred_par_scores", "pred_miscs"]
+    # lazy ones
+    children_mask_arr = None
+    children_list = None
+    descendant_list = None
+    free_dist_alpha = None
+    _unprojs = None
+    _sibs = None
+    _gps = None
+    _children_left = None
+    _children_right = None
+    _children_all = None
+    _extra_features = None
+    _extra_pred_misc = None
+
+    # todo(note): not calling ParseInstance.__init__
+    def __init__(self, words, poses=None, heads=None, labels=None, code=""):
+        Instance.__init__(self)
+        _intern = lambda vs: None if vs is None else [sys.intern(z) for z in vs]
+        words, poses, labels = _intern(words), _intern(poses), _intern(labels)
+        root = ParseInstance.ROOT_SYMBOL
+        self.code = code
+        aug_words = _intern(get_aug_words(words, code)) if code else words
+        self.words = CompactSeqFactor([root] + aug_words)
+        self.chars = CompactCharFactor([""] + words)
+        self.poses = CompactSeqFactor(None if poses is None else [root] + poses)
+        self.heads = CompactSeqFactor(None if heads is None else [0] + list(heads), int_vals=True)
+        self.labels = CompactSeqFactor(None if labels is None else [root] + labels)
+        self.length = InstanceHelper.check_equal_length([self.words, self.chars, self.poses, self.heads, self.labels]) - 1
+
+    # from an (indexed) ParseInstance
+    @staticmethod
+    def from_inst(inst: ParseInstance):
+        raw_words = inst.chars.vals[1:]
+        ret = CompactParseInstance(raw_words, inst.get_real_values_select(["poses"])[0],
+                                   inst.get_real_values_select(["heads"])[0], inst.get_real_values_select(["labels"])[0], inst.code)
+        for name in ["words", "chars", "poses", "labels"]:
+            getattr(ret, name).idxes = getattr(inst, name).idxes
+        ret.init_idx = inst.init_idx
+        # extra ones
+        if any(v is not None for v in inst.extra_features.values()):
+            ret.extra_features.update(inst.extra_features)
+        if len(inst.extra_pred_misc) > 0:
+            ret.extra_pred_misc.update(inst.extra_pred_misc)
+        for k, v in vars(inst).items():
+            if k not in ret.__dict__ and not k.startswith("_") and v is not None and k not in CompactParseInstance.PRED_NAMES \
+                    and k not in ["extra_features", "extra_pred_misc"]:
+                setattr(ret, k, v)
+        return ret
+
+    @property
+    def extra_features(self):
+        if self._extra_features is None:
+            self._extra_features = {"aux_repr": None}
+        return self._extra_features
+
+    @property
+    def extra_pred_misc(self):
+        if self._extra_pred_misc is None:
+            self._extra_pred_misc = {}
+        return self._extra_pred_misc
+
+    def _get_pred(self, name):
+        one = self.__dict__.get(name)
+        if one is None:
+            # todo(note): preallocated int32 buffer for heads
+            one = CompactSeqFactor(None, int_vals=(name=="pred_heads"), prealloc=(self.length+1 if name=="pred_heads" else 0))
+            self.__dict__[name] = one
+        return one
+
+    pred_poses = property(lambda self: self._get_pred("pred_poses"))
+    pred_pos_scores = property(lambda self: self._get_pred("pred_pos_scores"))
+    pred_heads = property(lambda self: self._get_pred("pred_heads"))
+    pred_labels = property(lambda self: self._get_pred("pred_labels"))
+    pred_par_scores = property(lambda self: self._get_pred("pred_par_scores"))
+    pred_miscs = property(lambda self: self._get_pred("pred_miscs"))
+
+    def get_real_values_select(self, selections):
+        ret = []
+        for name in selections:
+            zv = getattr(self, name)
+            if zv.has_vals():
+                vs = zv.vals[1:]
+                ret.append(vs.tolist() if isinstance(vs, np.ndarray) else vs)
+            else:
+                ret.append(None)
+        return ret
+
+    def get_real_values_all(self):
+        names = ["words", "chars", "poses", "heads", "labels"] + CompactParseInstance.PRED_NAMES
+        return {k: v for k, v in zip(names, self.get_real_values_select(names))}
+
 # ===== Data Reader
 def get_data_reader(file_or_fd, input_format, aug_code, use_la0, aux_repr_file=None, aux_score_file=None, cut=None):
     cut = -1 if (cut is None or len(cut)==0) else int(cut)
-    if input_format == "conllu":
-        r = ParseConlluReader(file_or_fd, aug_code, use_la0=use_la0, cut=cut)
+    if input_format in ["conllu", "conllu_fast"]:
+        r = ParseConlluReader(file_or_fd, aug_code, use_la0=use_la0, cut=cut, fast=(input_format=="conllu_fast"))
     elif input_format == "plain":
         r = ParseTextReader(file_or_fd, aug_code, cut=cut)
     elif input_format == "json":
         r = ParseJsonReader(file_or_fd, aug_code, use_la0=use_la0, cut=cut)
+    elif input_format == "compiled":
+        from .compiled import CompiledParseReader  # todo(note): avoid circular import
+        r = CompiledParseReader(file_or_fd, cut=cut)  # aug_code and use_la0 are decided at compiling
     else:
-        zfatal("Unknown input_format %s, should select from {conllu,plain,json}" % input_format)
+        zfatal("Unknown input_format %s, should select from {conllu,conllu_fast,plain,json,compiled}" % input_format)
         r = None
     if aux_repr_file is not None and len(aux_repr_file)>0:
         r = AuxDataReader(r, aux_repr_file, "aux_repr")
@@ -297,12 +480,14 @@ def get_data_reader(file_or_fd, input_format, aug_code, use_la0, aux_repr_file=N
     return r
 
 # pre-computed auxiliary data
+# -> either the sequential pickle file or the random-access feat-store (detected by the existence of its index)
 class AuxDataReader(AdapterStreamer):
     def __init__(self, base_streamer, aux_repr_file, aux_name):
         super().__init__(base_streamer)
         self.file = aux_repr_file
         self.fd = None
         self.aux_name = aux_name
+        self.store = FeatStore(aux_repr_file) if FeatStore.is_store(aux_repr_file) else None
 
     def __del__(self):
         if self.fd is not None:
@@ -310,7 +495,9 @@ class AuxDataReader(AdapterStreamer):
 
     def _restart(self):
         self.base_streamer_.restart()
-        if isinstance(self.file, str):
+        if self.store is not None:
+            pass  # random access by self.count()
+        elif isinstance(self.file, str):
             if self.fd is not None:
                 self.fd.close()
             self.fd = zopen(self.file, mode='rb', encoding=None)
@@ -321,7 +508,10 @@ class AuxDataReader(AdapterStreamer):
         one = self.base_streamer_.next()
         if self.base_streamer_.is_eos(one):
             return None
-        res = pickle.load(self.fd)
+        if self.store is not None:
+            res = self.store[self.count()]
+        else:
+            res = pickle.load(self.fd)
         # todo(warn): specific checks
         if isinstance(res, (tuple, list)):
             assert len(res) == 2
@@ -332,12 +522,15 @@ class AuxDataReader(AdapterStreamer):
         return one
 
 # read from conllu file
+# fast: only read the needed columns with ConlluFastReader
 class ParseConlluReader(FileOrFdStreamer):
-    def __init__(self, file_or_fd, aug_code, use_xpos=False, use_la0=False, cut=-1):
+    def __init__(self, file_or_fd, aug_code, use_xpos=False, use_la0=False, cut=-1, fast=False):
         super().__init__(file_or_fd)
         self.aug_code = aug_code
         self.reader = ConlluReader()
         self.cut = cut
+        self.fast_reader = ConlluFastReader(("word", "xpos" if use_xpos else "upos", "head", "label")) if fast else None
+        self.use_la0 = use_la0
         #
         if use_xpos:
             self.pos_f = lambda t: t.xpos
@@ -351,6 +544,8 @@ class ParseConlluReader(FileOrFdStreamer):
     def _next(self):
         if self.count_ == self.cut:
             return None
+        if self.fast_reader is not None:
+            return self._next_fast()
         parse = self.reader.read_one(self.fd)
         if parse is None:
             return None
@@ -361,6 +556,17 @@ class ParseConlluReader(FileOrFdStreamer):
             one.init_idx = self.count()
             return one
 
+    def _next_fast(self):
+        cols = self.fast_reader.read_one(self.fd)
+        if cols is None:
+            return None
+        words, poses, heads, labels = [cols[z] for z in self.fast_reader.columns]
+        if self.use_la0:
+            labels = [z.split(":")[0] for z in labels]
+        one = ParseInstance(words, poses, heads, labels, code=self.aug_code)
+        one.init_idx = self.count()
+        return one
+
 # read raw text from plain file, no annotations (mainly for prediction)
 class ParseTextReader(FileOrFdStreamer):
     def __init__(self, file_or_fd, aug_code, skip_empty_line=False, sep=None, cut=-1):
@@ -476,8 +682,9 @@ class ParserJsonWriter(ParserWriter):
 # =====
 # multi-source reader
 # split the srings by ","
-# todo(note): best if input data are balanced, otherwise mix and shuffle data should be better
-def get_multisoure_data_reader(file, input_format, aug_code, use_la0, aux_repr_file="", aux_score_file="", cut="", sep=","):
+# todo(note): round-robin by default (best if input data are balanced), otherwise use weights/temperature for sampling
+def get_multisoure_data_reader(file, input_format, aug_code, use_la0, aux_repr_file="", aux_score_file="", cut="", sep=",",
+                               weights="", temperature=0.):
     # -----
     def _get_and_pad(num, s, pad):
         results = s.split(sep) if len(s)>0 else []
@@ -494,5 +701,6 @@ def get_multisoure_data_reader(file, input_format, aug_code, use_la0, aux_repr_f
     # prepare all streams
     list_streams = [get_data_reader(f, input_format, ac, use_la0, arf, asf, cc)
                     for f, ac, arf, asf, cc in zip(list_file, list_aug_code, list_aux_repr_file, list_aux_score_file, list_cut)]
-    # join them
-    return MultiJoinStreamer(list_streams)
+    # mix them
+    list_weights = [float(z) for z in _get_and_pad(num_files, weights, "1.")] if len(weights)>0 else None
+    return MultiMixStreamer(list_streams, weights=list_weights, temperature=temperature, report_stat=(list_weights is not None or temperature>0))
@@ -17,6 +17,7 @@ from msp.zext.seq_helper import DataPadder
 from msp.zext.process_train import RConf, SVConf, ScheduledValue, OptimConf
 
 from .data import ParseInstance
+from ..algo import DecPoolConf, DecPool
 
 # =====
 # the input modeling part
@@ -272,6 +273,7 @@ class BaseInferenceConf(Conf):
         # overall
         self.batch_size = 32
         self.infer_single_length = 100  # single-inst batch if >= this length
+        self.dec_pool_conf = DecPoolConf()  # workers for the CPU decoding algorithms
 
 # training conf
 class BaseTrainingConf(RConf):
@@ -283,6 +285,7 @@ class BaseTrainingConf(RConf):
         self.load_process = False
         # batch arranger
         self.batch_size = 32
+        self.batch_cost = ""  # ""(sent count) or token-budget with padded cost: tok(max_len*n), tok2(max_len^2*n)
         self.train_min_length = 0
         self.train_skip_length = 120
         self.shuffle_train = True
@@ -360,6 +363,8 @@ class BaseParser(Model):
         self.reg_scores_lambda = conf.tconf.reg_scores_lambda
         # for refreshing dropouts
         self.previous_refresh_training = True
+        # pool for CPU decoding
+        self.dec_pool = DecPool(conf.iconf.dec_pool_conf)
 
     # to be implemented
     def build_decoder(self):
@@ -4,32 +4,33 @@
 from typing import List, Iterable, Dict
 
 from msp.utils import zlog, zopen, GLOBAL_RECORDER, Helper, zcheck
-from msp.data import FAdapterStreamer, BatchArranger, InstCacher
+from msp.data import FAdapterStreamer, BatchArranger, InstCacher, PrefetchStreamer, ParallelMapStreamer
 from msp.zext.process_train import TrainingRunner, RecordResult
 from msp.zext.process_test import TestingRunner, ResultManager
 from msp.zext.dpar import ParserEvaler
 
-from .data import ParseInstance, get_data_writer
+from .data import ParseInstance, CompactParseInstance, get_data_writer
 from .vocab import ParserVocabPackage
 
-# for indexing instances
-class IndexerStreamer(FAdapterStreamer):
-    def __init__(self, in_stream, vpack: ParserVocabPackage, inst_preparer):
-        super().__init__(in_stream, self._go_index, False)
-        #
+# indexing function (picklable, only depending on the vocabs)
+class ParseInstIndexer:
+    def __init__(self, vpack: ParserVocabPackage):
         self.word_normer = vpack.word_normer
         self.w_vocab = vpack.get_voc("word")
         self.c_vocab = vpack.get_voc("char")
         self.p_vocab = vpack.get_voc("pos")
         self.l_vocab = vpack.get_voc("label")
-        self.inst_preparer = inst_preparer
+        self.vocab_sig = vpack.get_sig()
 
-    def _go_index(self, inst: ParseInstance):
+    def __call__(self, inst: ParseInstance):
+        # todo(note): compiled instances are already indexed if with the same vocabs
+        if getattr(inst, "compiled_vocab_sig", None) == self.vocab_sig:
+            return inst
         # word
         # todo(warn): remember to norm word; replace singleton at model's input, not here
         if inst.words.has_vals():
             w_voc = self.w_vocab
-            inst.words.set_idxes([w_voc.get_else_unk(w) for w in self.word_normer.norm_stream(inst.words.vals)])
+            inst.words.set_idxes(w_voc.lookup(self.word_normer.norm_stream(inst.words.vals)))
         # others
         if inst.chars.has_vals():
             inst.chars.build_idxes(self.c_vocab)
@@ -37,29 +38,55 @@ class IndexerStreamer(FAdapterStreamer):
             inst.poses.build_idxes(self.p_vocab)
         if inst.labels.has_vals():
             inst.labels.build_idxes(self.l_vocab)
+        # in fact, inplaced
+        return inst
+
+# for indexing instances
+class IndexerStreamer(FAdapterStreamer):
+    def __init__(self, in_stream, vpack: ParserVocabPackage, inst_preparer):
+        super().__init__(in_stream, self._go_index, False)
+        #
+        self.indexer = ParseInstIndexer(vpack)
+        self.inst_preparer = inst_preparer
+
+    def _go_index(self, inst: ParseInstance):
+        inst = self.indexer(inst)
         if self.inst_preparer is not None:
             inst = self.inst_preparer(inst)
         # in fact, inplaced if not wrapping model specific preparer
         return inst
 
 #
-def index_stream(in_stream, vpack, cached, cache_shuffle, inst_preparer):
-    i_stream = IndexerStreamer(in_stream, vpack, inst_preparer)
+# num_workers>0: indexing in a worker pool (in order)
+# cache_compact: convert to CompactParseInstance before caching
+def index_stream(in_stream, vpack, cached, cache_shuffle, inst_preparer, num_workers=0, worker_mode="thread", cache_compact=False):
+    if num_workers > 0:
+        # todo(note): only the (picklable) indexing runs in the workers, the model-specific preparer still runs here
+        i_stream = ParallelMapStreamer(in_stream, ParseInstIndexer(vpack), False, num_workers, worker_mode)
+        if inst_preparer is not None:
+            i_stream = FAdapterStreamer(i_stream, inst_preparer, False)
+    else:
+        i_stream = IndexerStreamer(in_stream, vpack, inst_preparer)
     if cached:
+        if cache_compact:
+            i_stream = FAdapterStreamer(i_stream, CompactParseInstance.from_inst, False)
         return InstCacher(i_stream, shuffle=cache_shuffle)
     else:
         return i_stream
 
-# for arrange batches
-def batch_stream(in_stream, ticonf, training):
+# for arrange batches, prefetch>0: prepare batches ahead in a background thread
+def batch_stream(in_stream, ticonf, training, prefetch=0):
     if training:
         b_stream = BatchArranger(in_stream, batch_size=ticonf.batch_size, maxibatch_size=20, batch_size_f=None,
                                  dump_detectors=lambda one: len(one)>=ticonf.train_skip_length or len(one)<ticonf.train_min_length,
-                                 single_detectors=None, sorting_keyer=len, shuffling=ticonf.shuffle_train)
+                                 single_detectors=None, sorting_keyer=len, shuffling=ticonf.shuffle_train,
+                                 padding_cost=BatchArranger.get_padding_cost(ticonf.batch_cost))
     else:
         b_stream = BatchArranger(in_stream, batch_size=ticonf.batch_size, maxibatch_size=-1, batch_size_f=None,
                                  dump_detectors=None, single_detectors=lambda one: len(one)>=ticonf.infer_single_length,
                                  sorting_keyer=len, shuffling=False)
+    if prefetch > 0:
+        b_stream = PrefetchStreamer(b_stream, prefetch)
     return b_stream
 
 # =====
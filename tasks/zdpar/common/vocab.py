@@ -1,6 +1,7 @@
 #
 
 from typing import Dict
+import hashlib
 
 from msp.utils import Conf, zlog
 from msp.data import VocabPackage, VocabBuilder, WordNormer, WordVectors, VocabHelper
@@ -14,6 +15,16 @@ class ParserVocabPackage(VocabPackage):
         #
         self.word_normer = WordNormer(lower_case=dconf.lower_case, norm_digit=dconf.norm_digit)
 
+    # signature of the indexing results (vocabs and word-normer), for checking pre-indexed (compiled) data
+    def get_sig(self):
+        h = hashlib.sha1(f"{self.word_normer.lower_case}:{self.word_normer.norm_digit}".encode())
+        for name in ["word", "char", "pos", "label"]:
+            voc = self.get_voc(name)
+            h.update(f"|{name}:".encode())
+            if voc is not None:
+                h.update("\n".join(voc.final_words).encode())
+        return h.hexdigest()
+
     @staticmethod
     def build_by_reading(dconf):
         zlog("Load vocabs from files.")
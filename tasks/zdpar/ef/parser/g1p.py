@@ -166,7 +166,7 @@ class G1Parser(BaseParser):
         mst_lengths = [len(z) + 1 for z in insts]  # +=1 to include ROOT for mst decoding
         mst_lengths_arr = np.asarray(mst_lengths, dtype=np.int32)
         mst_heads_arr, mst_labels_arr, mst_scores_arr = nmst_unproj(full_score, mask_expr, mst_lengths_arr,
-                                                                    labeled=True, ret_arr=True)
+                                                                    labeled=True, ret_arr=True, pool=self.dec_pool)
         if self.conf.iconf.output_marginals:
             # todo(note): here, we care about marginals for arc
             # lab_marginals = nmarginal_unproj(full_score, mask_expr, None, labeled=True)
@@ -13,7 +13,7 @@ from msp.zext.seq_helper import DataPadder
 from ...common.data import ParseInstance
 from ...common.model import BaseParserConf, BaseInferenceConf, BaseTrainingConf, BaseParser
 from ..scorer import Scorer, ScorerConf, SL0Layer, SL0Conf
-from ...algo import hop_decode
+from ...algo import hop_decode, DecPool
 
 from .g1p import G1Parser, PreG1Conf, PruneG1Conf
 
@@ -84,7 +84,7 @@ class G2Parser(BaseParser):
         self.lambda_g1_lab_testing = conf.pre_g1_conf.lambda_g1_lab_testing
         #
         self.add_slayer()
-        self.dl = G2DL(self.scorer, self.slayer, conf)
+        self.dl = G2DL(self.scorer, self.slayer, conf, self.dec_pool)
         #
         self.predict_padder = DataPadder(2, pad_vals=0)
         self.num_label = self.label_vocab.trg_len(True)  # todo(WARN): use the original idx
@@ -216,7 +216,7 @@ class G2Parser(BaseParser):
 
 # decoder and losser
 class G2DL:
-    def __init__(self, scorer: Scorer, slayer: SL0Layer, conf: G2ParserConf):
+    def __init__(self, scorer: Scorer, slayer: SL0Layer, conf: G2ParserConf, dec_pool: DecPool=None):
         self.scorer = scorer
         self.slayer = slayer
         self.gm_type = conf.gm_type
@@ -235,6 +235,8 @@ class G2DL:
         iconf: G2InferenceConf = conf.iconf
         self.mb_dec_lb = iconf.mb_dec_lb
         self.mb_dec_sb = iconf.mb_dec_sb
+        # pool for the per-sentence hop_decode (serial if None)
+        self.dec_pool = DecPool(iconf.dec_pool_conf) if dec_pool is None else dec_pool
 
     # get parsing loss (perceptron styled)
     # todo(+3): assume the same margin for both arc and label
@@ -407,15 +409,23 @@ class G2DL:
             final_scores = arc_scores
         # =====
         # step 3: actual decode
-        res_heads = []
+        # step 3.1: prepare all the inputs in one pass (batch_idxes are sorted since they come from nonzero())
+        all_o1_masks = BK.get_value(mb_valid_expr.int())
+        all_o1_scores = BK.get_value(go1_arc_scores.double()) if (go1_arc_scores is not None) else None
+        arr_input_pack = [(None if z is None else BK.get_value(z.int())) for z in (m_idxes, h_idxes, sib_idxes, gp_idxes)] \
+                         + [BK.get_value(final_scores.double())]
+        arr_batch_idxes = BK.get_value(batch_idxes)
+        bidx_ends = np.cumsum(np.bincount(arr_batch_idxes, minlength=mb_size))
+        all_dec_args = []
         for sid, inst in enumerate(mb_insts):
             slen = len(inst) + 1  # plus one for the art-root
-            arr_o1_masks = BK.get_value(mb_valid_expr[sid, :slen, :slen].int())
-            arr_o1_scores = BK.get_value(go1_arc_scores[sid, :slen, :slen].double()) if (go1_arc_scores is not None) else None
-            cur_bidx_mask = (batch_idxes == sid)
-            input_pack = [m_idxes, h_idxes, sib_idxes, gp_idxes, final_scores]
-            one_heads = self.helper.decode_one(slen, self.projective, arr_o1_masks, arr_o1_scores, input_pack, cur_bidx_mask)
-            res_heads.append(one_heads)
+            arr_o1_masks = all_o1_masks[sid, :slen, :slen]
+            arr_o1_scores = all_o1_scores[sid, :slen, :slen] if (all_o1_scores is not None) else None
+            cur_start, cur_end = (bidx_ends[sid-1] if sid>0 else 0), bidx_ends[sid]
+            one_arr_input_pack = [(None if z is None else z[cur_start:cur_end]) for z in arr_input_pack]
+            all_dec_args.append(self.helper.get_dec_args(slen, self.projective, arr_o1_masks, arr_o1_scores, one_arr_input_pack))
+        # step 3.2: decode (possibly concurrently with the pool, results are in order)
+        res_heads = self.dec_pool.map(hop_decode, all_dec_args)
         # =====
         # step 4: get labels back and pred_pack
         pred_b_idxes, pred_m_idxes, pred_h_idxes, pred_sib_idxes, pred_gp_idxes, _ = \
@@ -556,14 +566,16 @@ class G2O1Helper:
         mod_unpruned_mask[batch_idxes[gold_mask], m_idxes[gold_mask]] = 1
         return mod_unpruned_mask, gold_mask
 
-    def decode_one(self, slen: int, projective: bool, arr_o1_masks, arr_o1_scores, input_pack, cur_bidx_mask):
-        m_idxes, h_idxes, _, _, final_scores = input_pack
+    # the arguments for hop_decode of one sentence
+    def get_dec_args(self, slen: int, projective: bool, arr_o1_masks, arr_o1_scores, arr_input_pack):
+        m_idxes, h_idxes, _, _, final_scores = arr_input_pack
         if arr_o1_scores is None:
             arr_o1_scores = np.full([slen, slen], 0., dtype=np.double)
+        else:
+            arr_o1_scores = arr_o1_scores.copy()
         # direct add to the scores
-        m_idxes, h_idxes, final_scores = m_idxes[cur_bidx_mask], h_idxes[cur_bidx_mask], final_scores[cur_bidx_mask]
-        arr_o1_scores[BK.get_value(m_idxes), BK.get_value(h_idxes)] += BK.get_value(final_scores)
-        return hop_decode(slen, projective, arr_o1_masks, arr_o1_scores, None, None, None)
+        arr_o1_scores[m_idxes, h_idxes] += final_scores
+        return (slen, projective, arr_o1_masks, arr_o1_scores, None, None, None)
 
 # [m, h, sib]
 class G2O2sibHelper:
@@ -587,11 +599,9 @@ class G2O2sibHelper:
         mod_unpruned_mask[batch_idxes[gold_mask], m_idxes[gold_mask]] = 1
         return mod_unpruned_mask, gold_mask
 
-    def decode_one(self, slen: int, projective: bool, arr_o1_masks, arr_o1_scores, input_pack, cur_bidx_mask):
-        m_idxes, h_idxes, sib_idxes, _, final_scores = input_pack
-        o2sib_pack = [m_idxes[cur_bidx_mask].int(), h_idxes[cur_bidx_mask].int(), sib_idxes[cur_bidx_mask].int(), final_scores[cur_bidx_mask].double()]
-        o2sib_arr_pack = [BK.get_value(z) for z in o2sib_pack]
-        return hop_decode(slen, projective, arr_o1_masks, arr_o1_scores, o2sib_arr_pack, None, None)
+    def get_dec_args(self, slen: int, projective: bool, arr_o1_masks, arr_o1_scores, arr_input_pack):
+        m_idxes, h_idxes, sib_idxes, _, final_scores = arr_input_pack
+        return (slen, projective, arr_o1_masks, arr_o1_scores, [m_idxes, h_idxes, sib_idxes, final_scores], None, None)
 
 # [m, h, gp]
 class G2O2gHelper:
@@ -614,11 +624,9 @@ class G2O2gHelper:
         mod_unpruned_mask[batch_idxes[gold_mask], m_idxes[gold_mask]] = 1
         return mod_unpruned_mask, gold_mask
 
-    def decode_one(self, slen: int, projective: bool, arr_o1_masks, arr_o1_scores, input_pack, cur_bidx_mask):
-        m_idxes, h_idxes, _, gp_idxes, final_scores = input_pack
-        o2g_pack = [m_idxes[cur_bidx_mask].int(), h_idxes[cur_bidx_mask].int(), gp_idxes[cur_bidx_mask].int(), final_scores[cur_bidx_mask].double()]
-        o2g_arr_pack = [BK.get_value(z) for z in o2g_pack]
-        return hop_decode(slen, projective, arr_o1_masks, arr_o1_scores, None, o2g_arr_pack, None)
+    def get_dec_args(self, slen: int, projective: bool, arr_o1_masks, arr_o1_scores, arr_input_pack):
+        m_idxes, h_idxes, _, gp_idxes, final_scores = arr_input_pack
+        return (slen, projective, arr_o1_masks, arr_o1_scores, None, [m_idxes, h_idxes, gp_idxes, final_scores], None)
 
 # [m, h, sib, gp]
 class G2O3gsibHelper:
@@ -648,10 +656,8 @@ class G2O3gsibHelper:
         mod_unpruned_mask[batch_idxes[gold_mask], m_idxes[gold_mask]] = 1
         return mod_unpruned_mask, gold_mask
 
-    def decode_one(self, slen: int, projective: bool, arr_o1_masks, arr_o1_scores, input_pack, cur_bidx_mask):
-        m_idxes, h_idxes, sib_idxes, gp_idxes, final_scores = input_pack
-        o3gsib_pack = [m_idxes[cur_bidx_mask].int(), h_idxes[cur_bidx_mask].int(), sib_idxes[cur_bidx_mask].int(), gp_idxes[cur_bidx_mask].int(), final_scores[cur_bidx_mask].double()]
-        o3gsib_arr_pack = [BK.get_value(z) for z in o3gsib_pack]
-        return hop_decode(slen, projective, arr_o1_masks, arr_o1_scores, None, None, o3gsib_arr_pack)
+    def get_dec_args(self, slen: int, projective: bool, arr_o1_masks, arr_o1_scores, arr_input_pack):
+        m_idxes, h_idxes, sib_idxes, gp_idxes, final_scores = arr_input_pack
+        return (slen, projective, arr_o1_masks, arr_o1_scores, None, None, [m_idxes, h_idxes, sib_idxes, gp_idxes, final_scores])
 
 # b tasks/zdpar/ef/parser/g2p.py:316
@@ -3,7 +3,7 @@
 from typing import List
 import numpy as np
 
-from msp.utils import zfatal, Constants
+from msp.utils import zfatal, zwarn, Constants
 from msp.data import VocabPackage
 from msp.nn import BK
 from msp.zext.seq_helper import DataPadder
@@ -11,7 +11,7 @@ from msp.zext.seq_helper import DataPadder
 from .scorer import GraphScorerConf, GraphScorer
 from ..common.data import ParseInstance
 from ..common.model import BaseParserConf, BaseInferenceConf, BaseTrainingConf, BaseParser
-from ..algo import nmst_unproj, nmst_proj, nmst_greedy, nmarginal_unproj, nmarginal_proj
+from ..algo import nmst_unproj, nmst_proj, nmst_greedy, nmarginal_unproj, nmarginal_proj, nlogz_unproj, nmarginal_unproj_logz
 
 # =====
 # confs
@@ -22,7 +22,9 @@ class InferenceConf(BaseInferenceConf):
         super().__init__()
         # method
         self.dec_algorithm = "unproj"       # proj/unproj/greedy
+        self.dec_proj_tensor = False        # use the tensorized Eisner for proj (on-device) instead of the CPU one
         self.dec_single_neg = False         # also consider neg links for single-norm (but this might make it unstable for labels?)
+        self.dec_label_topk = 0             # >0: only score labels for the top-k heads (by arc scores) of each mod, others are pruned
 
 # training conf
 class TraningConf(BaseTrainingConf):
@@ -32,6 +34,8 @@ class TraningConf(BaseTrainingConf):
         self.loss_div_tok = True        # loss divide by token or by sent?
         self.loss_function = "prob"     # prob/hinge/mr: probability or hinge/perceptron based or min-risk(partially supported)
         self.loss_single_sample = 2.0   # sampling negative ones (<1: rate, >=2: number) to balance for single-norm
+        self.loss_global_logz = False   # for global+prob+unproj: directly use logZ (by LU) as loss rather than the marginal-based one
+        self.logz_bucket_width = 10     # length-bucketing for the logZ calculation (also for the unproj marginals)
 
 # overall parser conf
 class GraphParserConf(BaseParserConf):
@@ -175,6 +179,48 @@ class GraphParser(BaseParser):
         # <bad> fake_losses = BK.clamp(fake_losses, min=0.)
         return fake_losses
 
+    # directly logZ - score(gold): the gradients are the same as the marginal-based one, but with only one pass
+    def _losses_global_logz(self, full_score_expr, gold_heads_expr, gold_labels_expr, mask_expr, lengths_arr):
+        bucket_width = self.conf.tconf.logz_bucket_width
+        # [BS]
+        logz_expr = nlogz_unproj(full_score_expr, mask_expr, lengths_arr, labeled=True, bucket_width=bucket_width)
+        # todo(note): the slogdet can still fail (non-finite logZ) for the ill-conditioned ones (peaky scores),
+        #  recompute logZ with constant scores for them (otherwise nan gradients) and use the marginal-based loss instead
+        fallback_idxes = self._warn_nonfinite_logz(logz_expr)
+        if len(fallback_idxes) > 0:
+            fallback_flags = np.zeros(len(lengths_arr), dtype=np.float32)
+            fallback_flags[fallback_idxes] = 1.
+            fallback_mask = BK.input_real(fallback_flags) > 0.
+            logz_expr = nlogz_unproj(full_score_expr.masked_fill(fallback_mask.view([-1, 1, 1, 1]), 0.), mask_expr,
+                                     lengths_arr, labeled=True, bucket_width=bucket_width)
+        logz_expr = logz_expr.float()
+        # [BS, m]
+        full_shape = BK.get_shape(full_score_expr)
+        combined_score_expr = full_score_expr.view(full_shape[:-2] + [-1])
+        gold_combined_idx_expr = gold_heads_expr * full_shape[-1] + gold_labels_expr
+        losses = -BK.gather_one_lastdim(combined_score_expr, gold_combined_idx_expr).squeeze(-1)
+        # put the sentence-level logZ to the first real token
+        if full_shape[1] > 1:
+            losses[:, 1] += logz_expr
+        if len(fallback_idxes) > 0:
+            fb_idxes_expr = BK.input_idx(fallback_idxes)
+            fb_score_expr, fb_mask_expr = full_score_expr[fb_idxes_expr], mask_expr[fb_idxes_expr]
+            fb_marginals_expr = nmarginal_unproj(fb_score_expr, fb_mask_expr, None, labeled=True)
+            fb_losses = self._losses_global_prob(fb_score_expr, gold_heads_expr[fb_idxes_expr],
+                                                 gold_labels_expr[fb_idxes_expr], fb_marginals_expr, fb_mask_expr)
+            losses = losses.index_copy(0, fb_idxes_expr, fb_losses)
+        # no loss for the ones without real tokens
+        has_tok_expr = BK.input_real((np.asarray(lengths_arr) > 1).astype(np.float32))
+        return losses * has_tok_expr.unsqueeze(-1)
+
+    # report the sentences with non-finite logZ (which need the fallbacks), return their idxes
+    def _warn_nonfinite_logz(self, logz_expr):
+        logz_arr = BK.get_value(logz_expr)
+        fallback_idxes = (~np.isfinite(logz_arr)).nonzero()[0]
+        if len(fallback_idxes) > 0:
+            zwarn(f"Non-finite logZ for {len(fallback_idxes)}/{len(logz_arr)} sentences, fall back to the inverse-based marginals.")
+        return fallback_idxes
+
     # for single-norm: 0-1 loss
     # [*, L], [*], float
     def _losses_single(self, score_expr, gold_idxes_expr, single_sample, is_hinge=False, margin=0.):
@@ -214,13 +260,46 @@ class GraphParser(BaseParser):
             final_losses = losses_all.mean(-1)
         return final_losses
 
+    # combine arc and label scores for decoding
+    # expr[BS, m, h], expr[BS, m, h, L] -> expr[BS, m, h, L], whether to provide PROB by exp
+    # -> if topk_heads_expr[BS, m, K] is provided, the label scores are [BS, m, K, L] and so will be the output
+    def _normalize_scores(self, full_arc_score, full_label_score, topk_heads_expr=None):
+        final_exp_score = False
+        if self.norm_local and self.loss_prob:
+            arc_score = BK.log_softmax(full_arc_score, -1)
+            label_score = BK.log_softmax(full_label_score, -1)
+            final_exp_score = True
+        elif self.norm_hlocal and self.loss_prob:
+            # normalize at m dimension, ignore each nodes's self-finish step.
+            arc_score = BK.log_softmax(full_arc_score, -2)
+            label_score = BK.log_softmax(full_label_score, -1)
+        elif self.norm_single and self.loss_prob:
+            if self.conf.iconf.dec_single_neg:
+                # todo(+2): add all-neg for prob explanation
+                full_arc_probs = BK.sigmoid(full_arc_score)
+                full_label_probs = BK.sigmoid(full_label_score)
+                arc_score = BK.log(full_arc_probs) - BK.log(1.-full_arc_probs)
+                label_score = BK.log(full_label_probs) - BK.log(1.-full_label_probs)
+            else:
+                arc_score = BK.logsigmoid(full_arc_score)
+                label_score = BK.logsigmoid(full_label_score)
+                final_exp_score = True
+        else:
+            arc_score = full_arc_score
+            label_score = full_label_score
+        if topk_heads_expr is not None:
+            arc_score = BK.gather(arc_score, topk_heads_expr, dim=-1)
+        full_score = arc_score.unsqueeze(-1) + label_score
+        return full_score, final_exp_score
+
     # =====
     # expr[BS, m, h, L], arr[BS] -> arr[BS, m]
     def _decode(self, full_score_expr, maske_expr, lengths_arr):
         if self.alg_unproj:
-            return nmst_unproj(full_score_expr, maske_expr, lengths_arr, labeled=True, ret_arr=True)
+            return nmst_unproj(full_score_expr, maske_expr, lengths_arr, labeled=True, ret_arr=True, pool=self.dec_pool)
         elif self.alg_proj:
-            return nmst_proj(full_score_expr, maske_expr, lengths_arr, labeled=True, ret_arr=True)
+            return nmst_proj(full_score_expr, maske_expr, lengths_arr, labeled=True, ret_arr=True, pool=self.dec_pool,
+                             use_tensor=self.conf.iconf.dec_proj_tensor)
         elif self.alg_greedy:
             return nmst_greedy(full_score_expr, maske_expr, lengths_arr, labeled=True, ret_arr=True)
         else:
@@ -230,9 +309,13 @@ class GraphParser(BaseParser):
     # expr[BS, m, h, L], arr[BS] -> expr[BS, m, h, L]
     def _marginal(self, full_score_expr, maske_expr, lengths_arr):
         if self.alg_unproj:
-            marginals_expr = nmarginal_unproj(full_score_expr, maske_expr, lengths_arr, labeled=True)
+            # by LU and autograd of logZ, the ill-conditioned ones fall back to the inverse-based nmarginal_unproj
+            marginals_expr, logz_expr = nmarginal_unproj_logz(full_score_expr, maske_expr, lengths_arr, labeled=True,
+                                                              bucket_width=self.conf.tconf.logz_bucket_width)
+            self._warn_nonfinite_logz(logz_expr)
         elif self.alg_proj:
-            marginals_expr = nmarginal_proj(full_score_expr, maske_expr, lengths_arr, labeled=True)
+            marginals_expr = nmarginal_proj(full_score_expr, maske_expr, lengths_arr, labeled=True, pool=self.dec_pool,
+                                            use_tensor=self.conf.iconf.dec_proj_tensor)
         else:
             zfatal("Unsupported marginal-calculation for the decoding algorithm of " + self.conf.iconf.dec_algorithm)
             marginals_expr = None
@@ -255,32 +338,37 @@ class GraphParser(BaseParser):
             # ===== calculate
             scoring_expr_pack, mask_expr, jpos_pack = self._prepare_score(insts, False)
             full_arc_score = self._score_arc_full(scoring_expr_pack, mask_expr, False, 0.)
-            full_label_score = self._score_label_full(scoring_expr_pack, mask_expr, False, 0.)
-            # normalizing scores
-            full_score = None
-            final_exp_score = False         # whether to provide PROB by exp
-            if self.norm_local and self.loss_prob:
-                full_score = BK.log_softmax(full_arc_score, -1).unsqueeze(-1) + BK.log_softmax(full_label_score, -1)
-                final_exp_score = True
-            elif self.norm_hlocal and self.loss_prob:
-                # normalize at m dimension, ignore each nodes's self-finish step.
-                full_score = BK.log_softmax(full_arc_score, -2).unsqueeze(-1) + BK.log_softmax(full_label_score, -1)
-            elif self.norm_single and self.loss_prob:
-                if self.conf.iconf.dec_single_neg:
-                    # todo(+2): add all-neg for prob explanation
-                    full_arc_probs = BK.sigmoid(full_arc_score)
-                    full_label_probs = BK.sigmoid(full_label_score)
-                    fake_arc_scores = BK.log(full_arc_probs) - BK.log(1.-full_arc_probs)
-                    fake_label_scores = BK.log(full_label_probs) - BK.log(1.-full_label_probs)
-                    full_score = fake_arc_scores.unsqueeze(-1) + fake_label_scores
-                else:
-                    full_score = BK.logsigmoid(full_arc_score).unsqueeze(-1) + BK.logsigmoid(full_label_score)
-                    final_exp_score = True
+            label_topk = self.conf.iconf.dec_label_topk
+            maxlen = BK.get_shape(full_arc_score, -1)
+            if label_topk > 0 and label_topk < maxlen:
+                # only the top-k heads: [BS, len-m, K], [BS, len-m, K, L]
+                # todo(note): exclude self-loops from the top-k since they can never be decoded
+                no_self_arc_score = full_arc_score + BK.diagflat(BK.constants([maxlen], Constants.REAL_PRAC_MIN))
+                _, topk_heads_expr = BK.topk(no_self_arc_score, label_topk, dim=-1)
+                _, _, lm_expr, lh_expr = scoring_expr_pack
+                full_label_score = self.scorer.score_label_heads(lm_expr, lh_expr, topk_heads_expr, mask_expr, mask_expr)
             else:
-                full_score = full_arc_score.unsqueeze(-1) + full_label_score
+                topk_heads_expr = None
+                full_label_score = self._score_label_full(scoring_expr_pack, mask_expr, False, 0.)
+            # normalizing scores
+            full_score, final_exp_score = self._normalize_scores(full_arc_score, full_label_score, topk_heads_expr)
             # decode
             mst_lengths = [len(z)+1 for z in insts]  # +=1 to include ROOT for mst decoding
-            mst_heads_arr, mst_labels_arr, mst_scores_arr = self._decode(full_score, mask_expr, np.asarray(mst_lengths, dtype=np.int32))
+            if topk_heads_expr is None:
+                mst_heads_arr, mst_labels_arr, mst_scores_arr = self._decode(full_score, mask_expr, np.asarray(mst_lengths, dtype=np.int32))
+            else:
+                # the labels are independent given the heads: first max over L, then put back to [BS, len-m, len-h, 1]
+                topk_scores, _ = full_score.max(-1)
+                # todo(note): pruned ones must be above the decoders' NEG_INF (=REAL_PRAC_MIN), otherwise they cannot be forced
+                pruned_score = BK.constants(BK.get_shape(full_arc_score), Constants.REAL_PRAC_MIN/2).scatter(-1, topk_heads_expr, topk_scores)
+                mst_heads_arr, _, mst_scores_arr = self._decode(pruned_score.unsqueeze(-1), mask_expr, np.asarray(mst_lengths, dtype=np.int32))
+                # re-score the labels for the decoded heads, since the tree may force heads that are pruned out of top-k
+                mst_heads_expr = BK.input_idx(mst_heads_arr).unsqueeze(-1)  # [BS, len-m, 1]
+                dec_label_score = self.scorer.score_label_heads(lm_expr, lh_expr, mst_heads_expr, mask_expr, mask_expr)
+                dec_score, _ = self._normalize_scores(full_arc_score, dec_label_score, mst_heads_expr)
+                dec_scores, dec_labels = dec_score.squeeze(-2).max(-1)  # [BS, len-m]
+                mst_labels_arr = BK.get_value(dec_labels)
+                mst_scores_arr[:, 1:] = BK.get_value(dec_scores)[:, 1:]  # keep the decoder's one for the root
             if final_exp_score:
                 mst_scores_arr = np.exp(mst_scores_arr)
             # jpos prediction (directly index, no converting as in parsing)
@@ -358,7 +446,9 @@ class GraphParser(BaseParser):
             # +=1 to include ROOT for mst decoding
             mst_lengths_arr = np.asarray([len(z) + 1 for z in annotated_insts], dtype=np.int32)
             # do inference
-            if self.loss_prob:
+            if self.loss_prob and self.alg_unproj and self.conf.tconf.loss_global_logz:
+                final_losses = self._losses_global_logz(full_score, gold_heads_expr, gold_labels_expr, mask_expr, mst_lengths_arr)
+            elif self.loss_prob:
                 marginals_expr = self._marginal(full_score, mask_expr, mst_lengths_arr)     # [BS, m, h, L]
                 final_losses = self._losses_global_prob(full_score, gold_heads_expr, gold_labels_expr, marginals_expr, mask_expr)
                 if self.alg_proj:
@@ -24,6 +24,7 @@ class GraphScorerConf(Conf):
         #
         self.transform_act = "elu"
         self.biaffine_init_ortho = False
+        self.lab_biaffine_rank = 0  # >0: low-rank factorized biaffine for the labels (rank-k, shared by all labels)
         # distance clip?
         self.arc_dist_clip = -1
         self.arc_use_neg = False
@@ -61,7 +62,7 @@ class GraphScorer(BasicNode):
         # labeling
         self.lab_m = self.add_sub_node("lm", Affine(pc, input_dim, lab_space, act=transform_act))
         self.lab_h = self.add_sub_node("lh", Affine(pc, input_dim, lab_space, act=transform_act))
-        self.lab_scorer = self.add_sub_node("ls", BiAffineScorer(pc, lab_space, lab_space, sconf._num_label, ff_hid_size, ff_hid_layer=ff_hid_layer, use_biaffine=use_biaffine, use_ff=use_ff, use_ff2=use_ff2, biaffine_div=biaffine_div, biaffine_init_ortho=biaffine_init_ortho))
+        self.lab_scorer = self.add_sub_node("ls", BiAffineScorer(pc, lab_space, lab_space, sconf._num_label, ff_hid_size, ff_hid_layer=ff_hid_layer, use_biaffine=use_biaffine, use_ff=use_ff, use_ff2=use_ff2, biaffine_div=biaffine_div, biaffine_init_ortho=biaffine_init_ortho, biaffine_rank=sconf.lab_biaffine_rank))
 
     # transform to specific space (currently arc/label * m/h)
     # [*, len, input_dim] -> *[*, len, space_dim]
@@ -99,3 +100,11 @@ class GraphScorer(BasicNode):
     def score_label_select(self, am_expr_sel, ah_expr_sel, mask):
         lab_scores = self.lab_scorer.plain_score(am_expr_sel, ah_expr_sel, mask, None)
         return lab_scores
+
+    # score the selected heads' all labels (lazily, without the full [*, len1, len2, N])
+    # [*, len1, D1], [*, len2, D2], [*, len1, K] (idxes of len2), [*, len1], [*, len2] -> [*, len1, K, N]
+    def score_label_heads(self, lm_expr, lh_expr, head_idxes_expr, m_mask_expr, h_mask_expr):
+        lm_pack = self.lab_scorer.precompute_input0(lm_expr)
+        lh_pack = self.lab_scorer.precompute_input1(lh_expr)
+        lab_scores = self.lab_scorer.postcompute_selected(lm_pack, lh_pack, head_idxes_expr, m_mask_expr, h_mask_expr)
+        return lab_scores
@@ -0,0 +1,25 @@
+#
+
+# compile the data (train/dev/test) into flat arrays with the vocabs (from dict_dir), later read with input_format:compiled
+# todo(note): the compiled data is only valid with the same vocabs, otherwise re-indexed when reading
+
+from msp import utils
+
+from ..common.confs import init_everything
+from ..common.data import get_data_reader
+from ..common.vocab import ParserVocabPackage
+from ..common.compiled import compile_corpus
+
+def main(args):
+    conf = init_everything(args+["partype:fp"])
+    dconf = conf.dconf
+    vpack = ParserVocabPackage.build_by_reading(dconf)
+    for one_file, one_code in zip([dconf.train, dconf.dev, dconf.test], [dconf.code_train, dconf.code_dev, dconf.code_test]):
+        if one_file:
+            one_streamer = get_data_reader(one_file, dconf.input_format, one_code, dconf.use_label0)
+            compile_corpus(one_streamer, vpack, one_file+".compiled", one_code)
+    utils.zlog("Finish compiling.")
+
+# SRC_DIR="../src/"
+# PYTHONPATH=${SRC_DIR}/ python3 ${SRC_DIR}/tasks/cmd.py zdpar.main.compile_data train:[input] dev:[input] input_format:conllu dict_dir:[vocab_dir]
+# -> later: train:[input].compiled dev:[input].compiled input_format:compiled
@@ -63,7 +63,8 @@ def prepare_test(args, ConfType=None):
     # =====
     # No Cache!!
     test_inst_preparer = model.get_inst_preper(False)
-    test_iter = batch_stream(index_stream(test_streamer, vpack, False, False, test_inst_preparer), iconf, False)
+    test_iter = batch_stream(index_stream(test_streamer, vpack, False, False, test_inst_preparer,
+                                          dconf.data_workers, dconf.data_worker_mode), iconf, False, dconf.data_prefetch)
     return conf, model, vpack, test_iter
 
 #
@@ -33,10 +33,12 @@ def main(args):
     # data
     if dconf.multi_source:
         _reader_getter = get_multisoure_data_reader
+        train_mix_kwargs = {"weights": dconf.ms_train_weights, "temperature": dconf.ms_train_temperature}
     else:
         _reader_getter = get_data_reader
+        train_mix_kwargs = {}
     train_streamer = _reader_getter(dconf.train, dconf.input_format, dconf.code_train, dconf.use_label0,
-                                     dconf.aux_repr_train, dconf.aux_score_train, cut=dconf.cut_train)
+                                     dconf.aux_repr_train, dconf.aux_score_train, cut=dconf.cut_train, **train_mix_kwargs)
     dt_streamers = [_reader_getter(f, dconf.input_format, c, dconf.use_label0, aux_r, aux_s, cut=one_cut)
                     for f, c, aux_r, aux_s, one_cut in zip(dt_golds, dt_codes, dt_aux_reprs, dt_aux_scores, dt_cuts)]
     # vocab
@@ -54,12 +56,15 @@ def main(args):
     to_cache = dconf.cache_data
     to_cache_shuffle = dconf.to_cache_shuffle
     # todo(note): make sure to cache both train and dev to save time for cached computation
-    train_iter = batch_stream(index_stream(train_streamer, vpack, to_cache, to_cache_shuffle, train_inst_preparer), tconf, True)
-    dt_iters = [batch_stream(index_stream(z, vpack, to_cache, to_cache_shuffle, test_inst_preparer), iconf, False) for z in dt_streamers]
+    dw, dwm, dp = dconf.data_workers, dconf.data_worker_mode, dconf.data_prefetch
+    train_iter = batch_stream(index_stream(train_streamer, vpack, to_cache, to_cache_shuffle, train_inst_preparer, dw, dwm, dconf.cache_compact), tconf, True, dp)
+    dt_iters = [batch_stream(index_stream(z, vpack, to_cache, to_cache_shuffle, test_inst_preparer, dw, dwm, dconf.cache_compact), iconf, False, dp) for z in dt_streamers]
     # training runner
     tr = ParserTrainingRunner(tconf, model, vpack, dev_outfs=dconf.output_file, dev_goldfs=dt_golds, dev_out_format=dconf.output_format)
     if tconf.load_model:
         tr.load(dconf.model_load_name, tconf.load_process)
     # go
-    tr.run(train_iter, dt_iters)
+    epoch_len_key = tr.get_epoch_len_key(dconf.train, cut=dconf.cut_train, batch_size=tconf.batch_size, batch_cost=tconf.batch_cost,
+                                         min_len=tconf.train_min_length, skip_len=tconf.train_skip_length, **train_mix_kwargs)
+    tr.run(train_iter, dt_iters, epoch_len_key)
     utils.zlog("The end of Training.")
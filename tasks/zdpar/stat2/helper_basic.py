@@ -40,6 +40,7 @@ class SDBasicConf(Conf):
         self.already_pre_computed = False
         self.fake_scores = False  # create all 0. distance scores for debugging
         self.fconf = FeaturerConf()
+        self.score_batch_sents = 1  # how many sents to score together (with fconf.pt_batch_tokens>0)
         self.which_fold = 8  # 7~9 generally slightly better
         # msp
         self.niconf = NIConf()  # nn-init-conf
@@ -261,6 +262,7 @@ def main_loop(conf: SDBasicConf, sp: SentProcessor):
             inputs = list(input_stream)
             np.random.shuffle(inputs)
             input_stream = inputs
+        pending_insts, num_pending_scores = [], 0
         for one_inst in input_stream:
             # -----
             # make sure the results are the same; to check whether we mistakenly use gold in that jumble of analysis
@@ -297,27 +299,18 @@ def main_loop(conf: SDBasicConf, sp: SentProcessor):
                             sent_fixed.append(new_fixed)  # once fixed, always fixed
                         one_inst.extra_features["sd3_repls"] = sent_repls
                         one_inst.extra_features["sd3_fixed"] = sent_fixed
-                        # ===== score
-                        folded_distances = featurer.get_scores(sent_repls[-1])
-                        assert len(sent_repls[-1]) == len(word_seq)
+                        one_inst.extra_features["feat_seq"] = word_seq
                         # ---
                         records["repl_count"] += len(word_seq)
                         records["repl_repl"] += sum(a!=b for a,b in zip(sent_repls[-1], word_seq))
-                        # ---
-                        one_inst.extra_features["sd2_scores"] = folded_distances
-                        one_inst.extra_features["feat_seq"] = word_seq
-                if output_pic_fd is not None:
-                    pickle.dump(one_inst, output_pic_fd)
-                if conf.processing:
-                    one_info = sp.test_one_sent(one_inst)
-                    # put prediction
-                    one_inst.pred_heads.set_vals([0] + list(one_info["output"][0]))
-                    one_inst.pred_labels.set_vals(["_"] * len(one_inst.labels.vals))
-                    #
-                    phrase_tree_string = one_info.get("phrase_tree")
-                    if phrase_tree_string is not None:
-                        one_inst.extra_pred_misc["phrase_tree"] = phrase_tree_string
-                all_insts.append(one_inst)
+                        # ===== score (later in batch)
+                        num_pending_scores += 1
+                pending_insts.append(one_inst)
+            # todo(note): score and process the pending ones together, directly process if nothing to score
+            if num_pending_scores == 0 or num_pending_scores >= conf.score_batch_sents:
+                _flush_pending(conf, sp, featurer, pending_insts, output_pic_fd, all_insts)
+                num_pending_scores = 0
+        _flush_pending(conf, sp, featurer, pending_insts, output_pic_fd, all_insts)
     if output_pic_fd is not None:
         output_pic_fd.close()
     if conf.output_file:
@@ -332,3 +325,26 @@ def main_loop(conf: SDBasicConf, sp: SentProcessor):
     # -----
     Helper.printd(records)
     Helper.printd(sp.summary())
+
+# score and process the pending insts (in the original order)
+def _flush_pending(conf: SDBasicConf, sp: SentProcessor, featurer: Featurer, pending_insts: List, output_pic_fd, all_insts: List):
+    to_score_insts = [z for z in pending_insts if z.extra_features.get("sd2_scores") is None]
+    if len(to_score_insts) > 0:
+        all_scores = featurer.get_scores_batch([z.extra_features["sd3_repls"][-1] for z in to_score_insts])
+        for one_inst, folded_distances in zip(to_score_insts, all_scores):
+            assert len(one_inst.extra_features["sd3_repls"][-1]) == len(one_inst.extra_features["feat_seq"])
+            one_inst.extra_features["sd2_scores"] = folded_distances
+    for one_inst in pending_insts:
+        if output_pic_fd is not None:
+            pickle.dump(one_inst, output_pic_fd)
+        if conf.processing:
+            one_info = sp.test_one_sent(one_inst)
+            # put prediction
+            one_inst.pred_heads.set_vals([0] + list(one_info["output"][0]))
+            one_inst.pred_labels.set_vals(["_"] * len(one_inst.labels.vals))
+            #
+            phrase_tree_string = one_info.get("phrase_tree")
+            if phrase_tree_string is not None:
+                one_inst.extra_pred_misc["phrase_tree"] = phrase_tree_string
+        all_insts.append(one_inst)
+    pending_insts.clear()
@@ -35,6 +35,9 @@ class FeaturerConf(Conf):
         self.br_vocab_file = ""
         self.br_rank_thresh = 100  # rank threshold >=this for non-topical words
         self.br_only_topical = True  # only change topical words
+        # perturbation engine: batch the masked variants of (many) sents under a token budget, 0 means per-sent encode_bert
+        self.pt_batch_tokens = 0
+        self.pt_partial_layers = True  # only forward up to the max needed bert layer
 
     def do_validate(self):
         assert self.use_bert, "currently only implemented the bert mode"
@@ -49,6 +52,7 @@ class Featurer:
         self.br_vocab = Vocab.read(conf.br_vocab_file) if conf.br_vocab_file else None
         self.br_rthresh = conf.br_rank_thresh
         self.br_only_topical = conf.br_only_topical
+        self.pengine = PerturbEngine(conf.pt_batch_tokens) if conf.pt_batch_tokens>0 else None
 
     # replace (simplify) sentence by replacing with bert predictions
     # todo(note): remember that the main purpose is to remove surprising topical words but retain syntax structure
@@ -107,9 +111,22 @@ class Featurer:
 
     # get influence scores
     def get_scores(self, sent: List[str]):
-        # get features
+        return self.get_scores_batch([sent])[0]
+
+    def get_scores_batch(self, sents: List[List[str]]):
+        conf = self.conf
+        all_inputs = [self._prepare_input(z) for z in sents]
+        input_sents = [z[0] for z in all_inputs]
+        if self.pengine is not None:
+            all_features = [BK.input_real(z) for z in encode_bert_batch(
+                self.pengine, self.berter, input_sents, conf.b_mask_mode, conf.b_mask_repl, conf.pt_partial_layers)]
+        else:
+            all_features = [encode_bert(self.berter, z, conf.b_mask_mode, conf.b_mask_repl) for z in input_sents]
+        return [self._get_scores(f, z[1], len(s)) for f, z, s in zip(all_features, all_inputs, sents)]
+
+    # return input_sent, word_ranges
+    def _prepare_input(self, sent: List[str]):
         conf = self.conf
-        # =====
         if conf.b_use_subword:
             range_base_idx = 0
             input_sent = []
@@ -129,9 +146,13 @@ class Featurer:
         else:
             word_ranges = None
             input_sent = sent
+        return input_sent, word_ranges
+
+    # features: [1+slen, 1+slen, fold*D]
+    def _get_scores(self, features, word_ranges, slen: int):
+        conf = self.conf
         # =====
         # normal calculating
-        features = encode_bert(self.berter, input_sent, conf.b_mask_mode, conf.b_mask_repl)  # [1+slen, 1+slen, fold*D]
         orig_feature_shape = BK.get_shape(features)
         folded_shape = orig_feature_shape[:-1] + [self.fold, orig_feature_shape[-1]//self.fold]
         all_features = features.view(folded_shape)  # [1+slen, 1+slen, fold, D]
@@ -149,7 +170,6 @@ class Featurer:
         # convert back to word mode if needed
         aggr_f = {"max": np.max, "avg": np.mean}[conf.b_subword_aggr]
         if conf.b_use_subword:
-            slen = len(sent)
             assert slen == len(word_ranges)
             # repack scores_arr
             new_scores_arr = np.zeros([slen, slen+1, self.fold])
@@ -192,20 +212,121 @@ def encode_bert(berter: Berter, sent: List[str], b_mask_mode, b_mask_repl):
 
 #
 def encode_model(model: G1Parser, sent: List[str], g1p_replace_unk):
+    # todo(note): budget 0 means all the variants of this sent in one batch
+    return BK.input_real(encode_model_batch(PerturbEngine(0), model, [sent], g1p_replace_unk)[0])
+
+# =====
+# perturbation engine: batch all masked variants (of many sents) under a token budget,
+# and write the selected outputs into the preallocated [1+slen, 1+slen, D] arrays
+
+class PerturbEngine:
+    def __init__(self, batch_tokens: int):
+        self.batch_tokens = batch_tokens  # <=0 means no limit
+
+    # variants: List[(ids, sel_idxes, sent_idx, row_idx, col_idxes)], forward_f: (ids_arr, mask_arr) -> [bs, len, D]
+    def run(self, variants: List, rets: List[np.ndarray], forward_f, pad_idx=0):
+        budget = self.batch_tokens
+        variants = sorted(variants, key=lambda x: len(x[0]))
+        cur_idx = 0
+        while cur_idx < len(variants):
+            # since sorted, the current one is the max length
+            cur_end = cur_idx + 1
+            while cur_end < len(variants) and (budget<=0 or (cur_end-cur_idx+1)*len(variants[cur_end][0]) <= budget):
+                cur_end += 1
+            cur_batch = variants[cur_idx:cur_end]
+            cur_idx = cur_end
+            bsize, max_len = len(cur_batch), len(cur_batch[-1][0])
+            ids_arr = np.full([bsize, max_len], pad_idx, dtype=np.int64)
+            mask_arr = np.zeros([bsize, max_len], dtype=np.float32)
+            flat_sels = []
+            for bidx, one_variant in enumerate(cur_batch):
+                one_len = len(one_variant[0])
+                ids_arr[bidx, :one_len] = one_variant[0]
+                mask_arr[bidx, :one_len] = 1.
+                flat_sels.extend([bidx*max_len+z for z in one_variant[1]])
+            output_t = forward_f(ids_arr, mask_arr)  # [bs, len, D]
+            sel_arr = BK.get_value(BK.select(output_t.view([bsize*max_len, -1]), flat_sels, 0))  # [?, D]
+            sel_start = 0
+            for one_variant in cur_batch:
+                sel_end = sel_start + len(one_variant[1])
+                rets[one_variant[2]][one_variant[3], one_variant[4]] = sel_arr[sel_start:sel_end]
+                sel_start = sel_end
+        return rets
+
+# List[sent] -> List[arr(1(whole)+slen, 1(R)+slen, fold*D)]
+def encode_bert_batch(engine: PerturbEngine, berter: Berter, sents: List[List[str]], b_mask_mode, b_mask_repl,
+                      partial_layers=True):
+    assert berter.bconf.bert_sent_extend == 0
+    assert berter.bconf.bert_root_mode == -1
+    MAX_LEN = 510  # save two for [CLS] and [SEP]
+    tokenizer, model = berter.tokenizer, berter.model
+    CLS_IDX, SEP_IDX, PAD_IDX = tokenizer.cls_token_id, tokenizer.sep_token_id, tokenizer.pad_token_id
+    output_layers = berter.bconf.bert_layers
+    # prepare variants: 0 is the original one, i(>0) is masking the i-th word
+    variants, long_variants = [], []
+    for sent_idx, sent in enumerate(sents):
+        slen = len(sent)
+        for vidx in range(1+slen):
+            one_subword = berter.subword_tokenize(sent.copy(), True, mask_idx=vidx-1, mask_mode=b_mask_mode, mask_repl=b_mask_repl)
+            cur_ids = [CLS_IDX] + one_subword.subword_ids + [SEP_IDX]
+            cur_starts = [1] + one_subword.subword_is_start + [0]  # root_mode==-1 -> CLS
+            cur_sels = [i for i,z in enumerate(cur_starts) if z]
+            # todo(note): leave the col of the passed word as 0.
+            cur_cols = [i for i in range(1+slen) if i != vidx] if (b_mask_mode=="pass" and vidx>0) else list(range(1+slen))
+            assert len(cur_sels) == len(cur_cols)
+            if len(cur_ids) > MAX_LEN+2:
+                long_variants.append((cur_ids, cur_starts, sent_idx, vidx, cur_cols))
+            else:
+                variants.append((cur_ids, cur_sels, sent_idx, vidx, cur_cols))
+    # forward
+    if partial_layers:
+        num_layers = len(model.encoder.layer) + 1  # +1 for embeddings
+        output_layers = [i if i>=0 else (num_layers+i) for i in output_layers]
+        forward_f = lambda ids_arr, mask_arr: _forward_bert_partial(model, BK.input_idx(ids_arr), BK.input_real(mask_arr), output_layers)
+    else:
+        forward_f = lambda ids_arr, mask_arr: berter.forward_features(BK.input_idx(ids_arr), BK.input_real(mask_arr), output_layers)
+    with BK.no_grad_env():
+        dim = BK.get_shape(forward_f(np.asarray([[CLS_IDX, SEP_IDX]]), np.ones([1, 2], dtype=np.float32)), -1)
+        rets = [np.zeros([1+len(z), 1+len(z), dim], dtype=np.float32) for z in sents]
+        engine.run(variants, rets, forward_f, PAD_IDX)
+        # too long ones are split by forward_single
+        for cur_ids, cur_starts, sent_idx, vidx, cur_cols in long_variants:
+            rets[sent_idx][vidx, cur_cols] = berter.forward_single(cur_ids, cur_starts)
+    return rets
+
+# forward the embeddings and encoders up to the max needed layer
+# todo(+N): specific: looking inside BertModel.forward
+def _forward_bert_partial(model, ids_t, mask_t, output_layers):
+    extended_mask_t = (1.0 - mask_t.unsqueeze(1).unsqueeze(2)) * -10000.0
+    last_output = model.embeddings(ids_t)
+    all_outputs = [last_output]
+    for layer_module in model.encoder.layer[:max(output_layers)]:
+        last_output = layer_module(last_output, extended_mask_t, None)[0]
+        all_outputs.append(last_output)
+    return BK.concat([all_outputs[i] for i in output_layers], -1)  # [bs, slen, DIM*layer]
+
+# List[sent] -> List[arr(1(whole)+slen, 1(R)+slen, D)]
+def encode_model_batch(engine: PerturbEngine, model: G1Parser, sents: List[List[str]], g1p_replace_unk):
     word_vocab = model.vpack.get_voc("word")
     REPL = word_vocab.unk if g1p_replace_unk else 0
     ROOT = word_vocab[ParseInstance.ROOT_SYMBOL]  # must be there
-    sent_idxes = [ROOT] + [word_vocab.get_else_unk(z) for z in sent]  # 1(R)+slen
-    # prepare inputs
-    all_sentences = [sent_idxes]
-    for i in range(len(sent)):
-        new_one = sent_idxes.copy()
-        new_one[i+1] = REPL  # here 1 as offset for ROOT
-        all_sentences.append(new_one)
+    variants = []
+    for sent_idx, sent in enumerate(sents):
+        sent_idxes = [ROOT] + [word_vocab.get_else_unk(z) for z in sent]  # 1(R)+slen
+        all_pos = list(range(len(sent_idxes)))
+        variants.append((sent_idxes, all_pos, sent_idx, 0, all_pos))
+        for i in range(len(sent)):
+            new_one = sent_idxes.copy()
+            new_one[i+1] = REPL  # here 1 as offset for ROOT
+            variants.append((new_one, all_pos, sent_idx, i+1, all_pos))
     # get embeddings and encodings
-    word_arr = np.asarray(all_sentences)  # [1+slen, 1+slen], no need to pad
-    emb_repr = model.bter.emb(word_arr=word_arr)  # no other features, [1+slen, 1+slen, D0]
-    enc_repr = model.bter.enc(emb_repr)  # no needfor mask, [1+slen, 1+slen, D1]
-    return enc_repr  # [1(whole)+slen, 1(R)+slen, D]
+    def _forward_f(ids_arr, mask_arr):
+        emb_repr = model.bter.emb(word_arr=ids_arr)  # no other features, [bs, len, D0]
+        return model.bter.enc(emb_repr, mask_arr)  # [bs, len, D1]
+    with BK.no_grad_env():
+        dim = BK.get_shape(_forward_f(np.asarray([[ROOT]]), np.ones([1, 1], dtype=np.float32)), -1)
+        rets = [np.zeros([1+len(z), 1+len(z), dim], dtype=np.float32) for z in sents]
+        engine.run(variants, rets, _forward_f)
+    return rets
 
 # b tasks/zdpar/stat2/helper_feature:99
@@ -24,7 +24,8 @@ class DConf(Conf):
         # for multi-source training (the list has to be hard_coded!!)
         # currently three should be enough
         self.ms_train = []  # replacing "train"
-        self.ms_stop_idx = 0  # with which to consider the end of an epoch
+        self.ms_stop_idx = 0  # with which to consider the end of an epoch (-1 means till all exhausted)
+        # budgets: relative sampling weights of the sources (re-read at each epoch)
         self.ms_train_budget0 = SVConf().init_from_kwargs(val=1., which_idx="eidx", mode="none", min_val=0.)
         self.ms_train_budget1 = SVConf().init_from_kwargs(val=1., which_idx="eidx", mode="none", min_val=0.)
         self.ms_train_budget2 = SVConf().init_from_kwargs(val=1., which_idx="eidx", mode="none", min_val=0.)
@@ -33,6 +34,7 @@ class DConf(Conf):
         self.aux_repr_train = ""
         self.aux_repr_dev = ""
         self.aux_repr_test = ""
+        self.aux_repr_fstore_dtype = ""  # if not empty, bfeat writes mem-mapped feat-store (msp.zext.feat_store) instead of pickle
         # save name for trainer not here!!
         self.model_load_name = "zmodel.best"  # load name
         self.output_file = "zout.json"
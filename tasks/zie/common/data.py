@@ -11,6 +11,7 @@ import math
 from msp.utils import zfatal, zopen, zwarn, Random, Helper, MathHelper, zcheck, zlog, PickleRW, JsonRW
 from msp.data import Instance, FileOrFdStreamer, VocabHelper, AdapterStreamer, FAdapterStreamer
 from msp.zext.seq_data import InstanceHelper, SeqFactor, InputCharFactor
+from msp.zext.feat_store import FeatStore
 
 from .data_helper import get_label_normer, ExternalEntityVocab
 
@@ -526,12 +527,16 @@ def get_data_reader(file_or_fd, input_format, use_la0, noef_link0, aux_repr_file
     return r
 
 # pre-computed auxiliary data
+# -> either the sequential pickle file or the random-access feat-store (detected by the existence of its index)
+# todo(note): one entry per sentence in both formats
 class AuxDataReader(AdapterStreamer):
     def __init__(self, base_streamer, aux_repr_file, aux_name):
         super().__init__(base_streamer)
         self.file = aux_repr_file
         self.fd = None
         self.aux_name = aux_name
+        self.store = FeatStore(aux_repr_file) if FeatStore.is_store(aux_repr_file) else None
+        self.store_sidx = 0  # sentence idx for the store
 
     def __del__(self):
         if self.fd is not None:
@@ -539,7 +544,9 @@ class AuxDataReader(AdapterStreamer):
 
     def _restart(self):
         self.base_streamer_.restart()
-        if isinstance(self.file, str):
+        if self.store is not None:
+            self.store_sidx = 0
+        elif isinstance(self.file, str):
             if self.fd is not None:
                 self.fd.close()
             self.fd = zopen(self.file, mode='rb', encoding=None)
@@ -550,7 +557,11 @@ class AuxDataReader(AdapterStreamer):
         one = self.base_streamer_.next()
         if self.base_streamer_.is_eos(one):
             return None
-        res = PickleRW.load_list(self.fd, len(one.sents))
+        if self.store is not None:
+            res = self.store.get_range(self.store_sidx, self.store_sidx+len(one.sents))
+            self.store_sidx += len(one.sents)
+        else:
+            res = PickleRW.load_list(self.fd, len(one.sents))
         assert len(res) == len(one.sents), "Unmatched length"
         for one_res, one_sent in zip(res, one.sents):
             assert len(one_res) == one_sent.length, "Unmatched length for the aux_repr arr"
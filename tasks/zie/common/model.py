@@ -360,6 +360,7 @@ class BaseTrainingConf(RConf):
         # batch arranger
         self.batch_size = 100  # number of sent in doc (but at doc granarity)
         self.maxibatch_size = 5  # number of batches to collect for the batcher
+        self.batch_cost = ""  # ""(sent count) or token-budget with padded cost: tok(max_len*n), tok2(max_len^2*n)
         # special mode
         self.train_msent_based = False  # use multi-sent based streaming in training rather than doc
         self.train_sent_based = False  # use sent based streaming in training rather than document based
@@ -94,6 +94,7 @@ def batch_stream(in_stream, ticonf, training):
         in_stream = FListAdapterStream(in_stream, lambda d: ([] if d.dataset.startswith("LDC2015E78") else [d]))
     if training:
         MBS = ticonf.maxibatch_size
+        padding_cost = BatchArranger.get_padding_cost(ticonf.batch_cost)
         if ticonf.train_sent_based:
             assert False, "this mode (sent-based) should be deprecated"
             # todo(note): this will not be cached since caching is before this at index_stream
@@ -102,19 +103,26 @@ def batch_stream(in_stream, ticonf, training):
                 sent_stream = ShuffleStreamer(sent_stream)
             b_stream = BatchArranger(sent_stream, batch_size=ticonf.batch_size, maxibatch_size=MBS, batch_size_f=None,
                                      dump_detectors=None, single_detectors=None, sorting_keyer=lambda x: x.length,
-                                     shuffling=ticonf.shuffle_train)
+                                     shuffling=ticonf.shuffle_train, padding_cost=padding_cost, len_f=lambda x: x.length)
         elif ticonf.train_msent_based:
             msent_stream = FListAdapterStream(in_stream, lambda d: [x.preps["ms"] for x in d.sents if x.length<ticonf.train_skip_length and x.length>=ticonf.train_min_length and (len(x.events)>0 or next(_BS_sample_stream)>ticonf.train_skip_noevt_rate)])
             assert not ticonf.train_sent_shuffle
             # use subword size to sort, which should be similar to word size
             b_stream = BatchArranger(msent_stream, batch_size=ticonf.batch_size, maxibatch_size=MBS, batch_size_f=None,
                                      dump_detectors=None, single_detectors=None, sorting_keyer=lambda x: x.subword_size,
-                                     shuffling=ticonf.shuffle_train)
+                                     shuffling=ticonf.shuffle_train, padding_cost=padding_cost, len_f=lambda x: x.subword_size)
         else:
             _sent_counter = _count_train_sents
-            b_stream = BatchArranger(in_stream, batch_size=ticonf.batch_size, maxibatch_size=MBS, batch_size_f=_sent_counter,
-                                     dump_detectors=None, single_detectors=lambda x: _sent_counter(x)>=ticonf.batch_size,
-                                     sorting_keyer=_sent_counter, shuffling=ticonf.shuffle_train)
+            if padding_cost is None:
+                b_stream = BatchArranger(in_stream, batch_size=ticonf.batch_size, maxibatch_size=MBS, batch_size_f=_sent_counter,
+                                         dump_detectors=None, single_detectors=lambda x: _sent_counter(x)>=ticonf.batch_size,
+                                         sorting_keyer=_sent_counter, shuffling=ticonf.shuffle_train)
+            else:
+                # todo(note): doc-level, padded to the max sent length in the doc (the size is still the sent count)
+                _doc_len = lambda d: max([x.length for x in d.sents], default=0)
+                b_stream = BatchArranger(in_stream, batch_size=ticonf.batch_size, maxibatch_size=MBS, batch_size_f=_sent_counter,
+                                         dump_detectors=None, single_detectors=lambda x: padding_cost(_doc_len(x), _sent_counter(x))>=ticonf.batch_size,
+                                         sorting_keyer=_doc_len, shuffling=ticonf.shuffle_train, padding_cost=padding_cost, len_f=_doc_len)
     else:
         _sent_counter = lambda d: len(d.sents)
         b_stream = BatchArranger(in_stream, batch_size=ticonf.batch_size, maxibatch_size=1, batch_size_f=_sent_counter,
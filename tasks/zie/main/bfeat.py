@@ -4,6 +4,7 @@
 
 from msp import utils
 from msp.utils import zlog, zopen, PickleRW
+from msp.zext.feat_store import FeatStoreWriter
 
 from ..common.confs import OverallConf, init_everything, build_model, get_berter
 from ..common.data import get_data_reader, BerterDataAuger
@@ -21,12 +22,23 @@ def main(args):
         if one_input and one_output:
             one_streamer = get_data_reader(one_input, dconf.input_format, dconf.use_label0, dconf.noef_link0, None)
             bertaug_streamer = BerterDataAuger(one_streamer, bmodel, "aux_repr")
-            with zopen(one_output, 'wb') as fd:
-                for one_doc in bertaug_streamer:
-                    PickleRW.save_list([s.extra_features["aux_repr"] for s in one_doc.sents], fd)
-                    num_doc += 1
-                    num_sent += len(one_doc.sents)
+            if dconf.aux_repr_fstore_dtype:
+                with FeatStoreWriter(one_output, dconf.aux_repr_fstore_dtype) as writer:
+                    for one_doc in bertaug_streamer:
+                        writer.add_list([s.extra_features["aux_repr"] for s in one_doc.sents])
+                        num_doc += 1
+                        num_sent += len(one_doc.sents)
+            else:
+                with zopen(one_output, 'wb') as fd:
+                    for one_doc in bertaug_streamer:
+                        PickleRW.save_list([s.extra_features["aux_repr"] for s in one_doc.sents], fd)
+                        num_doc += 1
+                        num_sent += len(one_doc.sents)
             zlog(f"Finish with doc={num_doc}, sent={num_sent}")
+            if dconf.bconf.bert_batch_tokens > 0:
+                zlog(bmodel.speed_info())
+            if bmodel.feat_cache is not None:
+                zlog(bmodel.feat_cache)
         else:
             zlog("Skip empty files")
     zlog("Finish all.")
@@ -38,4 +50,6 @@ DATA_SET=en.ere
 for ws in train dev test; do
 CUDA_VISIBLE_DEVICES=2 PYTHONPATH=${SRC_DIR} python3 ${SRC_DIR}/tasks/cmd.py zie.main.bfeat device:0 train:${DATA_DIR}/${DATA_SET}.${ws}.json aux_repr_train:_tmp.pkl
 done
+# or write the mem-mapped feat-store with "aux_repr_fstore_dtype:float16", existing pickles can be converted by:
+# PYTHONPATH=${SRC_DIR} python3 -m msp.zext.feat_store _tmp.pkl _tmp.fstore --dtype float16
 """
@@ -2,12 +2,11 @@
 
 #
 from msp import utils
-from msp.data import MultiCatStreamer, InstCacher
+from msp.data import MultiCatStreamer, InstCacher, MultiMixStreamer
 from msp.zext.process_train import ScheduledValue
 
 from ..common.confs import OverallConf, init_everything, build_model, get_berter
 from ..common.data import get_data_reader, BerterDataAuger
-from ..common.data_multi import MultiSpecialJoinStream
 from ..common.vocab import IEVocabPackage
 from ..common.run import index_stream, batch_stream, MyIETrainingRunner
 
@@ -64,7 +63,7 @@ def main(args):
         train_iter = batch_stream(index_stream(train_streamer, vpack, to_cache, to_cache_shuffle, train_inst_preparer), tconf, True)
     else:
         indexes_streamers = [index_stream(s, vpack, to_cache, to_cache_shuffle, train_inst_preparer) for s in train_streamers]
-        multi_streamer = MultiSpecialJoinStream(indexes_streamers, ms_budgets, dconf.ms_stop_idx)
+        multi_streamer = MultiMixStreamer(indexes_streamers, weights=ms_budgets, stop_sidx=dconf.ms_stop_idx, report_stat=True)
         train_iter = batch_stream(multi_streamer, tconf, True)
     # -----
     dt_iters = [batch_stream(index_stream(z, vpack, to_cache, to_cache_shuffle, test_inst_preparer), iconf, False)
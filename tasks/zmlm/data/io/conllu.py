@@ -4,7 +4,7 @@
 
 from msp.utils import Conf, FileHelper
 from msp.data import FileOrFdStreamer
-from msp.zext.dpar import ConlluReader
+from msp.zext.dpar import ConlluReader, ConlluFastReader
 from ..insts import GeneralSentence, SeqField, DepTreeField
 
 # read from column styled file and return Dict
@@ -52,12 +52,15 @@ class ColumnReader(FileOrFdStreamer):
         return self._get(self.fd)
 
 #
+# fast: only read the needed columns with ConlluFastReader
 class ConlluParseReader(FileOrFdStreamer):
-    def __init__(self, file_or_fd, aug_code="", use_xpos=False, use_la0=True, cut=-1):
+    def __init__(self, file_or_fd, aug_code="", use_xpos=False, use_la0=True, cut=-1, fast=False):
         super().__init__(file_or_fd)
         self.aug_code = aug_code
         self.reader = ConlluReader()
         self.cut = cut
+        self.fast_reader = ConlluFastReader(("word", "xpos" if use_xpos else "upos", "head", "label")) if fast else None
+        self.use_la0 = use_la0
         #
         if use_xpos:
             self.pos_f = lambda t: t.xpos
@@ -71,6 +74,8 @@ class ConlluParseReader(FileOrFdStreamer):
     def _next(self):
         if self.count_ == self.cut:
             return None
+        if self.fast_reader is not None:
+            return self._next_fast()
         parse = self.reader.read_one(self.fd)
         if parse is None:
             return None
@@ -86,6 +91,20 @@ class ConlluParseReader(FileOrFdStreamer):
             one.add_info("aug_code", self.aug_code)
             return one
 
+    def _next_fast(self):
+        cols = self.fast_reader.read_one(self.fd)
+        if cols is None:
+            return None
+        words, poses, heads, labels = [cols[z] for z in self.fast_reader.columns]
+        if self.use_la0:
+            labels = [z.split(":")[0] for z in labels]
+        one = GeneralSentence.create(words)
+        one.add_item("pos_seq", SeqField(poses))
+        one.add_item("dep_tree", DepTreeField([0]+heads, ['']+labels))
+        one.add_info("sid", self.count())
+        one.add_info("aug_code", self.aug_code)
+        return one
+
 # BIO NER tags reader
 class ConllNerReader(FileOrFdStreamer):
     def __init__(self, file_or_fd, aug_code="", cut=-1):
@@ -80,8 +80,9 @@ def prepare_test(args, ConfType=None):
     # No Cache!!
     test_inst_preparer = model.get_inst_preper(False)
     backoff_pos_idx = dconf.backoff_pos_idx
-    test_iter = batch_stream(index_stream(test_streamer, vpack, False, False, test_inst_preparer, backoff_pos_idx),
-                             mconf.test_batch_size, mconf, False)
+    test_iter = batch_stream(index_stream(test_streamer, vpack, False, False, test_inst_preparer, backoff_pos_idx,
+                                          dconf.data_workers, dconf.data_worker_mode),
+                             mconf.test_batch_size, mconf, False, dconf.data_prefetch)
     return conf, model, vpack, test_iter
 
 #
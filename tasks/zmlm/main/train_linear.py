@@ -6,7 +6,7 @@ from msp import utils
 from msp.data import MultiCatStreamer, InstCacher
 
 from ..run.confs import OverallConf, init_everything, build_model
-from ..run.run import get_data_reader, PreprocessStreamer, index_stream, batch_stream, MltTrainingRunner
+from ..run.run import get_data_reader, get_multi_data_reader, PreprocessStreamer, index_stream, batch_stream, MltTrainingRunner
 from ..run.vocab import MLMVocabPackage
 
 from typing import List
@@ -78,7 +78,7 @@ def main(args):
     if len(dt_golds) == 0:
         utils.zwarn("No dev set, then please specify static lrate schedule!!")
     # data
-    train_streamer = PreprocessStreamer(get_data_reader(dconf.train, dconf.input_format, cut=dconf.cut_train),
+    train_streamer = PreprocessStreamer(get_multi_data_reader(dconf.train, dconf.input_format, dconf.train_shard_shuffle, cut=dconf.cut_train),
                                         lower_case=dconf.lower_case, norm_digit=dconf.norm_digit)
     dt_streamers = [PreprocessStreamer(get_data_reader(f, dconf.dev_input_format, cut=one_cut),
                                        lower_case=dconf.lower_case, norm_digit=dconf.norm_digit)
@@ -99,8 +99,9 @@ def main(args):
     to_cache_shuffle = dconf.to_cache_shuffle
     # todo(note): make sure to cache both train and dev to save time for cached computation
     backoff_pos_idx = dconf.backoff_pos_idx
-    train_iter = batch_stream(index_stream(train_streamer, vpack, to_cache, to_cache_shuffle, train_inst_preparer, backoff_pos_idx), mconf.train_batch_size, mconf, True)
-    dt_iters = [batch_stream(index_stream(z, vpack, to_cache, to_cache_shuffle, test_inst_preparer, backoff_pos_idx), mconf.test_batch_size, mconf, False) for z in dt_streamers]
+    dw, dwm, dp = dconf.data_workers, dconf.data_worker_mode, dconf.data_prefetch
+    train_iter = batch_stream(index_stream(train_streamer, vpack, to_cache, to_cache_shuffle, train_inst_preparer, backoff_pos_idx, dw, dwm, dconf.train_shuffle_buffer), mconf.train_batch_size, mconf, True, dp)
+    dt_iters = [batch_stream(index_stream(z, vpack, to_cache, to_cache_shuffle, test_inst_preparer, backoff_pos_idx, dw, dwm), mconf.test_batch_size, mconf, False, dp) for z in dt_streamers]
     # training runner
     tr = MltTrainingRunner(mconf.rconf, model, vpack, dev_outfs=dconf.output_file, dev_goldfs=dt_golds, dev_out_format=dconf.output_format)
     if mconf.train_preload_model:
@@ -111,7 +112,10 @@ def main(args):
     tr.model = linear_model
     # =====
     # go
-    tr.run(train_iter, dt_iters)
+    epoch_len_key = tr.get_epoch_len_key(dconf.train, cut=dconf.cut_train, batch_size=mconf.train_batch_size,
+                                         batch_cost=mconf.train_batch_cost, batch_on_len=mconf.train_batch_on_len,
+                                         min_len=mconf.train_min_length, max_len=mconf.train_max_length)
+    tr.run(train_iter, dt_iters, epoch_len_key)
     utils.zlog("The end of Training.")
 
 def lookat_weights():
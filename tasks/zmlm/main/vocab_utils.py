@@ -8,7 +8,7 @@ from msp import utils
 from msp.data import MultiCatStreamer, InstCacher
 
 from ..run.confs import OverallConf, init_everything, build_model
-from ..run.run import get_data_reader, PreprocessStreamer, index_stream, batch_stream, MltTrainingRunner
+from ..run.run import get_data_reader, get_multi_data_reader, PreprocessStreamer, index_stream, batch_stream, MltTrainingRunner
 from ..run.vocab import MLMVocabPackage
 
 #
@@ -53,7 +53,7 @@ def main(args):
     dconf, mconf = conf.dconf, conf.mconf
     # =====
     if dconf.train:  # build
-        train_streamer = PreprocessStreamer(get_data_reader(dconf.train, dconf.input_format),
+        train_streamer = PreprocessStreamer(get_multi_data_reader(dconf.train, dconf.input_format),
                                             lower_case=dconf.lower_case, norm_digit=dconf.norm_digit)
         vpack = MLMVocabPackage.build_from_stream(dconf.vconf, train_streamer, [])
         vpack.save(dconf.dict_dir)
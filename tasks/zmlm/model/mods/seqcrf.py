@@ -6,9 +6,10 @@
 from typing import List, Dict, Tuple
 import numpy as np
 
-from msp.utils import Conf, Random, zlog, JsonRW, zfatal, zwarn
+from msp.utils import Conf, Random, zlog, JsonRW, zfatal, zwarn, Constants
 from msp.nn import BK
 from msp.nn.layers import Affine, NoDropRop
+from msp.zext.seq_data import ChunksSeq
 
 from ..base import BaseModuleConf, BaseModule, LossHelper
 from .embedder import Inputter
@@ -34,6 +35,77 @@ def log_sum_exp(vec, m_size):
     max_score = torch.gather(vec, 1, idx.view(-1, 1, m_size)).view(-1, 1, m_size)  # B * M
     return max_score.view(-1, m_size) + torch.log(torch.sum(torch.exp(vec - max_score.expand_as(vec)), 1)).view(-1, m_size)  # B * M
 
+# =====
+# vectorized CRF engine: log-space ops over the full [T(from), T(to)] transitions (START/STOP are the last two tags)
+# emit_t: [bs, L, T], trans_t: [T, T], mask_t: [bs, L] (bool, valid prefixes with at least one valid token)
+
+# -> [bs] logZ
+def crf_logz(emit_t, trans_t, mask_t):
+    slen = BK.get_shape(emit_t, 1)
+    # only keep one running alpha: [bs, T]
+    alpha = emit_t[:, 0] + trans_t[START_TAG]
+    for i in range(1, slen):
+        # [bs, T, 1] + [T, T] -> [bs, T]
+        new_alpha = BK.logsumexp(alpha.unsqueeze(-1) + trans_t, dim=-2) + emit_t[:, i]
+        alpha = BK.where(mask_t[:, i].unsqueeze(-1), new_alpha, alpha)
+    return BK.logsumexp(alpha + trans_t[:, STOP_TAG], dim=-1)
+
+# -> [bs] best scores, [bs, L] best tags (0 for the paddings)
+def crf_viterbi(emit_t, trans_t, mask_t):
+    bsize, slen, tsize = BK.get_shape(emit_t)
+    # preallocated back-pointers (time-major), paddings point to themselves to pass through
+    bps = BK.constants_idx([slen, bsize, tsize], 0)
+    self_bp = BK.arange_idx(tsize).unsqueeze(0)  # [1, T]
+    score = emit_t[:, 0] + trans_t[START_TAG]
+    for i in range(1, slen):
+        new_score, cur_bp = BK.max(score.unsqueeze(-1) + trans_t, dim=-2)
+        cur_mask = mask_t[:, i].unsqueeze(-1)
+        score = BK.where(cur_mask, new_score + emit_t[:, i], score)
+        bps[i] = BK.where(cur_mask, cur_bp, self_bp)
+    best_score, cur_tag = BK.max(score + trans_t[:, STOP_TAG], dim=-1)
+    # trace back (on device)
+    tags = BK.constants_idx([slen, bsize], 0)
+    tags[-1] = cur_tag
+    for i in range(slen-1, 0, -1):
+        cur_tag = BK.gather_one_lastdim(bps[i], cur_tag).squeeze(-1)
+        tags[i-1] = cur_tag
+    return best_score, tags.t() * mask_t.long()
+
+# [bs, L] gold tags -> [bs] gold scores
+def crf_gold_score(emit_t, trans_t, mask_t, tags_t):
+    bsize, slen, tsize = BK.get_shape(emit_t)
+    mask_f = mask_t.float()
+    emit_scores = BK.gather_one_lastdim(emit_t, tags_t).squeeze(-1)  # [bs, L]
+    # START->t0, t(i-1)->t(i)
+    prev_tags = BK.concat([BK.constants_idx([bsize, 1], tsize+START_TAG), tags_t[:, :-1]], -1)
+    trans_scores = trans_t[prev_tags, tags_t]  # [bs, L]
+    last_tags = BK.gather_one_lastdim(tags_t, mask_t.long().sum(-1)-1).squeeze(-1)  # [bs]
+    return ((emit_scores + trans_scores) * mask_f).sum(-1) + trans_t[last_tags, STOP_TAG]
+
+# length-bucketing: run f(emit_t, mask_t, *args) -> tuple([bs, ...]) for each bucket up to its max length
+def crf_bucketing(f, bucket_width, emit_t, mask_t, *args):
+    if bucket_width <= 0:
+        return f(emit_t, mask_t, *args)
+    bsize, maxlen = BK.get_shape(mask_t)
+    lengths_arr = np.maximum(BK.get_value(mask_t.long().sum(-1)), 1)
+    bucket_ids = (lengths_arr-1) // bucket_width
+    all_idxes, all_rets = [], []
+    for one_bid in np.unique(bucket_ids):
+        one_idxes = (bucket_ids == one_bid).nonzero()[0]
+        one_len = min(maxlen, int(np.max(lengths_arr[one_idxes])))
+        one_idxes_t = BK.input_idx(one_idxes)
+        all_idxes.append(one_idxes_t)
+        all_rets.append(f(emit_t[one_idxes_t, :one_len], mask_t[one_idxes_t, :one_len], *[z[one_idxes_t, :one_len] for z in args]))
+    # put them back, padding the length-dim if there are
+    idxes_t = BK.concat(all_idxes, 0)
+    rets = []
+    for one_rets in zip(*all_rets):
+        if len(BK.get_shape(one_rets[0])) > 1:
+            one_rets = [BK.pad(z, [0, maxlen-BK.get_shape(z, 1)]) for z in one_rets]
+        one_ret = BK.concat(one_rets, 0)
+        rets.append(one_ret.new_zeros([bsize]+BK.get_shape(one_ret)[1:]).index_copy(0, idxes_t, one_ret))
+    return tuple(rets)
+
 # --
 class SeqCrfNodeConf(BaseModuleConf):
     def __init__(self):
@@ -45,6 +117,10 @@ class SeqCrfNodeConf(BaseModuleConf):
         self.hid_act = "elu"
         # for loss function
         self.div_by_tok = True
+        # crf engine
+        self.crf_vec = True  # use the vectorized engine (otherwise the original NCRF++ routines)
+        self.crf_bucket_width = 0  # >0: length-bucketing the batch (by this width) in the engine
+        self.crf_constrain = ""  # BIO/BIOES: constrained decoding with the valid tag bigrams of the scheme
 
 class SeqCrfNode(BaseModule):
     def __init__(self, pc: BK.ParamCollection, pname: str, input_dim: int, conf: SeqCrfNodeConf, inputter: Inputter):
@@ -76,6 +152,29 @@ class SeqCrfNode(BaseModule):
         init_transitions[:, 0] = -10000.0
         init_transitions[0, :] = -10000.0
         self.transitions = self.add_param("T", (self.tagset_size+2, self.tagset_size+2), init=init_transitions)
+        # constraints for decoding (added to the transitions)
+        if conf.crf_constrain:
+            self.trans_constraint = BK.input_real(self._get_constraint(conf.crf_constrain))
+        else:
+            self.trans_constraint = None
+
+    # [T+2, T+2] of 0./PRAC_MIN by the valid bigrams of the tagging scheme
+    def _get_constraint(self, scheme):
+        tag_size = self.tagset_size + 2
+        tag_forms = [self.vocab.idx2word(i) for i in range(1, self.tagset_size)]
+        valid_bigrams = ChunksSeq.valid_bigrams(scheme, tag_forms, START_TAG)
+        allowed = np.zeros([tag_size, tag_size], dtype=np.bool_)
+        form2idx = {z: i for i, z in enumerate(tag_forms, 1)}
+        form2idx[START_TAG] = tag_size + START_TAG
+        for a, b in valid_bigrams:
+            if a in form2idx and b in form2idx:
+                allowed[form2idx[a], form2idx[b]] = True
+        # can end where "O" can follow
+        for z, i in form2idx.items():
+            if (z, "O") in valid_bigrams:
+                allowed[i, STOP_TAG] = True
+        zlog(f"CRF constraint of {scheme}: {allowed.sum()}/{allowed.size} valid transitions.")
+        return np.where(allowed, 0., Constants.REAL_PRAC_MIN).astype(np.float32)
 
     # score
     def _score(self, repr_t):
@@ -117,7 +216,11 @@ class SeqCrfNode(BaseModule):
         # score
         scores_t = self._score(repr_t)  # [bs, rlen, D]
         # decode
-        _, decode_idx = self._viterbi_decode(scores_t, mask_t.bool())
+        if conf.crf_vec:
+            trans_t = self.transitions if self.trans_constraint is None else (self.transitions + self.trans_constraint)
+            _, decode_idx = crf_bucketing(lambda e, m: crf_viterbi(e, trans_t, m), conf.crf_bucket_width, scores_t, mask_t.bool())
+        else:
+            _, decode_idx = self._viterbi_decode(scores_t, mask_t.bool())
         decode_idx_arr = BK.get_value(decode_idx)  # [bs, rlen]
         for one_bidx, one_inst in enumerate(insts):
             one_pidxes = decode_idx_arr[one_bidx].tolist()[:len(one_inst)]
@@ -331,6 +434,10 @@ class SeqCrfNode(BaseModule):
         return gold_score
 
     def neg_log_likelihood_loss(self, feats, mask, tags):
+        if self.conf.crf_vec:
+            logz_t, = crf_bucketing(lambda e, m: (crf_logz(e, self.transitions, m), ), self.conf.crf_bucket_width, feats, mask)
+            gold_t = crf_gold_score(feats, self.transitions, mask, tags)
+            return (logz_t - gold_t).sum()
         # nonegative log likelihood
         batch_size = feats.size(0)
         forward_score, scores = self._calculate_PZ(feats, mask)
@@ -74,6 +74,8 @@ class MtlMlmModelConf(BaseModelConf):
         # -- batch_size_f
         self.train_batch_on_len = False  # whether use sent length as budgets rather then sent count
         self.test_batch_on_len = False
+        # -- token-budget with padded cost (overriding batch_on_len): ""(no), tok(max_len*n), tok2(max_len^2*n)
+        self.train_batch_cost = ""
         # -----
         self.train_preload_model = False
         self.train_preload_process = False
@@ -20,6 +20,13 @@ class DConf(Conf):
         self.test = ""
         self.cache_data = True          # turn off if large data
         self.to_cache_shuffle = False
+        # for large data (not cached): train can be multiple shards (separated by ","), shuffled at the two levels
+        self.train_shard_shuffle = False  # shuffle the order of shards at each epoch
+        self.train_shuffle_buffer = 0  # shuffle insts within a bounded buffer, 0 means no shuffling
+        # data pipeline: indexing with a worker pool, prefetching batches in a background thread
+        self.data_workers = 0  # 0 means indexing in the main thread
+        self.data_worker_mode = "thread"  # thread/process (inst_preparer always runs in the main process)
+        self.data_prefetch = 0  # queue size of prefetched batches, 0 means no prefetching
         self.dict_dir = "./"
         # cuttings for training (simply for convenience without especially preparing data...)
         self.cut_train = -1  # <0 means no cut!
@@ -27,7 +34,7 @@ class DConf(Conf):
         # save name for trainer not here!!
         self.model_load_name = "zmodel.best"         # load name
         self.output_file = "zout"
-        # format (conllu, plain, json)
+        # format (conllu, conllu_fast, plain, json)
         self.input_format = "conllu"
         self.dev_input_format = ""  # special mixing case
         self.output_format = "json"
@@ -7,7 +7,7 @@ from collections import OrderedDict
 from copy import deepcopy
 
 from msp.utils import zlog, zwarn, zopen, GLOBAL_RECORDER, Helper, zcheck
-from msp.data import FAdapterStreamer, BatchArranger, InstCacher
+from msp.data import FAdapterStreamer, BatchArranger, InstCacher, PrefetchStreamer, ParallelMapStreamer, ShuffleStreamer, MultiCatStreamer
 from msp.zext.process_train import TrainingRunner, RecordResult
 from msp.zext.process_test import TestingRunner, ResultManager
 from msp.zext.dpar import ParserEvaler
@@ -31,21 +31,18 @@ class PreprocessStreamer(FAdapterStreamer):
     def _go_prep(self, inst: GeneralSentence):
         inst.word_seq.reset(self.normer.norm_stream(inst.word_seq.vals))
 
-# for indexing instances
-class IndexerStreamer(FAdapterStreamer):
-    def __init__(self, in_stream, vpack: MLMVocabPackage, inst_preparer, backoff_pos_idx: int):
-        super().__init__(in_stream, self._go_index, False)
-        # -----
+# indexing function (picklable, only depending on the vocabs)
+class GeneralSentIndexer:
+    def __init__(self, vpack: MLMVocabPackage, backoff_pos_idx: int):
         self.w_vocab = vpack.get_voc("word")
         self.w2_vocab = vpack.get_voc("word2")  # extra set
         self.c_vocab = vpack.get_voc("char")
         self.p_vocab = vpack.get_voc("pos")
         self.l_vocab = vpack.get_voc("deplabel")
         self.n_vocab = vpack.get_voc("ner")
-        self.inst_preparer = inst_preparer
         self.backoff_pos_idx = backoff_pos_idx
 
-    def _go_index(self, inst: GeneralSentence):
+    def __call__(self, inst: GeneralSentence):
         # word
         # todo(warn): remember to norm word; replace singleton at model's input, not here
         if inst.word_seq.has_vals():
@@ -74,40 +71,66 @@ class IndexerStreamer(FAdapterStreamer):
             dep_tree.build_label_idxes(self.l_vocab)
         if ner_seq is not None and ner_seq.has_vals():
             ner_seq.build_idxes(self.n_vocab)
+        # in fact, inplaced
+        return inst
+
+# for indexing instances
+class IndexerStreamer(FAdapterStreamer):
+    def __init__(self, in_stream, vpack: MLMVocabPackage, inst_preparer, backoff_pos_idx: int):
+        super().__init__(in_stream, self._go_index, False)
+        # -----
+        self.indexer = GeneralSentIndexer(vpack, backoff_pos_idx)
+        self.inst_preparer = inst_preparer
+
+    def _go_index(self, inst: GeneralSentence):
+        inst = self.indexer(inst)
         if self.inst_preparer is not None:
             inst = self.inst_preparer(inst)
         # in fact, inplaced if not wrapping model specific preparer
         return inst
 
 #
-def index_stream(in_stream, vpack, cached, cache_shuffle, inst_preparer, backoff_pos_idx):
-    i_stream = IndexerStreamer(in_stream, vpack, inst_preparer, backoff_pos_idx)
+# num_workers>0: indexing in a worker pool (in order)
+# shuffle_buffer>0: (if not cached) shuffle within a bounded buffer instead of reading all
+def index_stream(in_stream, vpack, cached, cache_shuffle, inst_preparer, backoff_pos_idx, num_workers=0, worker_mode="thread", shuffle_buffer=0):
+    if num_workers > 0:
+        # todo(note): only the (picklable) indexing runs in the workers, the model-specific preparer still runs here
+        i_stream = ParallelMapStreamer(in_stream, GeneralSentIndexer(vpack, backoff_pos_idx), False, num_workers, worker_mode)
+        if inst_preparer is not None:
+            i_stream = FAdapterStreamer(i_stream, inst_preparer, False)
+    else:
+        i_stream = IndexerStreamer(in_stream, vpack, inst_preparer, backoff_pos_idx)
     if cached:
         return InstCacher(i_stream, shuffle=cache_shuffle)
+    elif shuffle_buffer > 0:
+        return ShuffleStreamer(i_stream, buffer_size=shuffle_buffer)
     else:
         return i_stream
 
-# for arrange batches
-def batch_stream(in_stream, batch_size, ticonf, training):
+# for arrange batches, prefetch>0: prepare batches ahead in a background thread
+def batch_stream(in_stream, batch_size, ticonf, training, prefetch=0):
     MIN_SENT_LEN_FOR_BSIZE = 10
     if training:
-        batch_size_f = (lambda x: max(len(x), MIN_SENT_LEN_FOR_BSIZE)) if ticonf.train_batch_on_len else None
+        padding_cost = BatchArranger.get_padding_cost(ticonf.train_batch_cost)
+        batch_size_f = (lambda x: max(len(x), MIN_SENT_LEN_FOR_BSIZE)) if (ticonf.train_batch_on_len and padding_cost is None) else None
         b_stream = BatchArranger(in_stream, batch_size=batch_size, maxibatch_size=ticonf.train_maxibatch_size, batch_size_f=batch_size_f,
                                  dump_detectors=lambda one: len(one)>=ticonf.train_max_length or len(one)<ticonf.train_min_length,
-                                 single_detectors=None, sorting_keyer=len, shuffling=ticonf.train_shuffle)
+                                 single_detectors=None, sorting_keyer=len, shuffling=ticonf.train_shuffle, padding_cost=padding_cost)
     else:
         batch_size_f = (lambda x: max(len(x), MIN_SENT_LEN_FOR_BSIZE)) if ticonf.test_batch_on_len else None
         b_stream = BatchArranger(in_stream, batch_size=batch_size, maxibatch_size=ticonf.test_maxibatch_size, batch_size_f=batch_size_f,
                                  dump_detectors=None, single_detectors=lambda one: len(one)>=ticonf.test_single_length,
                                  sorting_keyer=len, shuffling=False)
+    if prefetch > 0:
+        b_stream = PrefetchStreamer(b_stream, prefetch)
     return b_stream
 
 # =====
 # data io
 
 def get_data_reader(file_or_fd, input_format, **kwargs):
-    if input_format == "conllu":
-        r = ConlluParseReader(file_or_fd, **kwargs)
+    if input_format in ["conllu", "conllu_fast"]:
+        r = ConlluParseReader(file_or_fd, fast=(input_format=="conllu_fast"), **kwargs)
     elif input_format == "ner":
         r = ConllNerReader(file_or_fd, **kwargs)
     elif input_format == "json":
@@ -118,6 +141,13 @@ def get_data_reader(file_or_fd, input_format, **kwargs):
         raise NotImplementedError(f"Unknown input_format {input_format}")
     return r
 
+# multiple files (shards) separated by ",", shard_shuffle: shuffle the order of shards at each epoch
+def get_multi_data_reader(files: str, input_format, shard_shuffle=False, **kwargs):
+    file_list = [z for z in files.split(",") if len(z)>0]
+    if len(file_list) <= 1 and not shard_shuffle:
+        return get_data_reader(files, input_format, **kwargs)
+    return MultiCatStreamer([get_data_reader(z, input_format, **kwargs) for z in file_list], shuffle=shard_shuffle)
+
 def get_data_writer(file_or_fd, output_format, **kwargs):
     if output_format == "json":
         return BaseDataWriter(file_or_fd, **kwargs)
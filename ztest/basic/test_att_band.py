@@ -0,0 +1,55 @@
+#
+
+# banded (sparse) attention vs. the dense one
+
+import numpy as np
+
+from msp.utils import zlog
+from msp.nn import layers, BK
+from msp.nn.layers import AttentionNode, AttConf, Transformer2Encoder
+
+def main():
+    np.random.seed(1234)
+    BSIZE, SLEN, DIM = 3, 50, 32
+    input_expr = BK.input_real(np.random.randn(BSIZE, SLEN, DIM).astype(np.float32))
+    mask_arr = np.ones([BSIZE, SLEN], dtype=np.float32)
+    mask_arr[1, 33:] = 0.
+    mask_arr[2, 7:] = 0.
+    mask_expr = BK.input_real(mask_arr)
+    valid_t = BK.input_real(mask_arr).unsqueeze(-1)
+    for kwargs in [{"_fixed_range_val": 3}, {"_fixed_range_val": 0}, {}, {"_fixed_range_val": 8, "range_dilation": 3},
+                   {"_fixed_range_val": 4, "clip_dist": 3, "use_neg_dist": True}, {"range_dilation": 2, "clip_dist": 2}]:
+        fixed_range_val = kwargs.pop("_fixed_range_val", -1)
+        aconf = AttConf().init_from_kwargs(type="mh", d_kqv=8, head_count=4, att_dropout=0., use_ranges=True,
+                                           band_min_len=0, **kwargs)
+        aconf._fixed_range_val = fixed_range_val
+        pc = BK.ParamCollection()
+        node = AttentionNode.get_att_node("mh", pc, DIM, DIM, DIM, aconf)
+        node.refresh(layers.RefreshOptions(training=False))
+        outputs = []
+        for band_att in [False, True]:
+            node.band_att = band_att
+            outputs.append(node(input_expr, input_expr, input_expr, mask_expr) * valid_t)
+        zmiss = float(BK.get_value(BK.abs(outputs[0]-outputs[1])).max())
+        assert zmiss < 1e-5, f"Unmatched: {kwargs}: {zmiss}"
+        BK.avg(outputs[1]).backward()
+    # the banded mode should not build any [len_q, len_k] distances
+    aconf = AttConf().init_from_kwargs(type="mh", d_kqv=8, head_count=4, att_dropout=0., use_ranges=True, band_att=True,
+                                       band_min_len=0, clip_dist=3, rel_efficient=False)
+    aconf._fixed_range_val = 4
+    node = AttentionNode.get_att_node("mh", BK.ParamCollection(), DIM, DIM, DIM, aconf)
+    node.refresh(layers.RefreshOptions(training=False))
+    def _no_full(*args, **kwargs):
+        raise RuntimeError("Should not build full distances in the banded mode!")
+    node.dist_helper.get_distance = _no_full
+    node(input_expr, input_expr, input_expr, mask_expr)
+    # encoder with dilated long-range att
+    aconf = AttConf().init_from_kwargs(d_kqv=8, head_count=4, use_ranges=True, band_att=True, band_min_len=16, range_dilation=4)
+    pc = BK.ParamCollection()
+    enc = Transformer2Encoder(pc, 2, DIM, aconf, 2, [16, 32])
+    enc.refresh(layers.RefreshOptions(training=True))
+    assert BK.get_shape(enc(input_expr, mask_arr)) == [BSIZE, SLEN, DIM]
+    zlog("OK")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+#
+
+# memory-efficient relative-distance attention vs. the full one
+
+import numpy as np
+
+from msp.utils import zlog
+from msp.nn import layers, BK
+from msp.nn.layers import AttentionNode, AttConf
+
+def main():
+    np.random.seed(1234)
+    BSIZE, SLEN, DIM = 3, 17, 32
+    input_expr = BK.input_real(np.random.randn(BSIZE, SLEN, DIM).astype(np.float32))
+    mask_arr = np.ones([BSIZE, SLEN], dtype=np.float32)
+    mask_arr[1, 10:] = 0.
+    mask_expr = BK.input_real(mask_arr)
+    for att_type, kwargs in [("mh", {"clip_dist": 4}), ("mh", {"clip_dist": 4, "use_neg_dist": True}),
+                             ("mh", {"clip_dist": 30, "use_neg_dist": True}), ("mh", {"clip_dist": 4, "use_fix_dist": True}),
+                             ("mh", {"clip_dist": 4, "use_ranges": True}), ("mhrs", {"clip_dist": 4})]:
+        aconf = AttConf().init_from_kwargs(type=att_type, d_kqv=8, head_count=4, att_dropout=0., **kwargs)
+        pc = BK.ParamCollection()
+        node = AttentionNode.get_att_node(att_type, pc, DIM, DIM, DIM, aconf)
+        node.refresh(layers.RefreshOptions(training=False))
+        rel_nodes = [node] if att_type=="mh" else [node.rel_att]
+        outputs = []
+        for rel_efficient in [False, True]:
+            for z in rel_nodes:
+                z.rel_efficient = rel_efficient
+            outputs.append(node(input_expr, input_expr, input_expr, mask_expr))
+        zmiss = float(BK.get_value(BK.abs(outputs[0]-outputs[1])).max())
+        assert zmiss < 1e-5, f"Unmatched: {att_type} {kwargs}: {zmiss}"
+        BK.avg(outputs[1]).backward()
+    zlog("OK")
+
+if __name__ == '__main__':
+    main()
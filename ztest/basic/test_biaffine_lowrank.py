@@ -0,0 +1,57 @@
+#
+
+# low-rank biaffine and the lazy (selected) scoring of BiAffineScorer
+
+import numpy as np
+
+from msp.utils import zlog
+from msp.nn import layers, BK
+from msp.nn.layers import BiAffineScorer
+
+def _check(a, b, info):
+    zmiss = float(BK.get_value(BK.abs(a-b)).max())
+    assert zmiss < 1e-4, f"Unmatched: {info}: {zmiss}"
+
+def main():
+    np.random.seed(1234)
+    BSIZE, SLEN, D0, D1, NL, K = 3, 20, 16, 12, 7, 4
+    input0 = BK.input_real(np.random.randn(BSIZE, SLEN, D0).astype(np.float32))
+    input1 = BK.input_real(np.random.randn(BSIZE, SLEN, D1).astype(np.float32))
+    mask_arr = np.ones([BSIZE, SLEN], dtype=np.float32)
+    mask_arr[1, 13:] = 0.
+    mask_expr = BK.input_real(mask_arr)
+    sel_idxes = BK.input_idx(np.random.randint(0, SLEN, size=[BSIZE, SLEN, K]))
+    for rank in [0, 5]:
+        pc = BK.ParamCollection()
+        node = BiAffineScorer(pc, D0, D1, NL, biaffine_rank=rank)
+        node.refresh(layers.RefreshOptions(training=False))
+        # [bs, len0, len1, L]
+        full_scores = node.paired_score(input0, input1, mask_expr, mask_expr)
+        # gather the selected ones
+        gold_scores = BK.gather(full_scores, sel_idxes.unsqueeze(-1).expand(-1, -1, -1, NL), dim=-2)
+        pack0, pack1 = node.precompute_input0(input0), node.precompute_input1(input1)
+        sel_scores = node.postcompute_selected(pack0, pack1, sel_idxes, mask_expr, mask_expr)
+        assert BK.get_shape(sel_scores) == [BSIZE, SLEN, K, NL]
+        _check(gold_scores, sel_scores, f"selected(rank={rank})")
+        # plain on the selected ones
+        sel_input1 = BK.gather(input1, sel_idxes[:, :, 0].unsqueeze(-1).expand(-1, -1, D1), dim=-2)
+        plain_scores = node.plain_score(input0, sel_input1, mask_expr)
+        _check(plain_scores, node.postcompute_input1(pack0, sel_input1, mask_expr), f"post(rank={rank})")
+        BK.avg(sel_scores).backward()
+        # low-rank is a special full W
+        if rank > 0:
+            pc2 = BK.ParamCollection()
+            node2 = BiAffineScorer(pc2, D0, D1, NL)
+            node2.refresh(layers.RefreshOptions(training=False))
+            with BK.no_grad_env():
+                for name in ["A0", "A1"]:
+                    for p_to, p_from in zip(getattr(node2, name).get_parameters(), getattr(node, name).get_parameters()):
+                        p_to.copy_(p_from)
+                node2.B.copy_(node.B)
+                # [in0, k] * [k, out] * [in1, k] -> [in0, in1, out]
+                node2.W.copy_((node.U0.unsqueeze(1).unsqueeze(-1) * node.U1.unsqueeze(0).unsqueeze(-1) * node.WL).sum(-2).view(D0, -1))
+            _check(full_scores, node2.paired_score(input0, input1, mask_expr, mask_expr), "full-W")
+    zlog("OK")
+
+if __name__ == '__main__':
+    main()
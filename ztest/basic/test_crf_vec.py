@@ -0,0 +1,68 @@
+#
+
+# the vectorized CRF engine vs. the original NCRF++ routines of SeqCrfNode
+
+import numpy as np
+
+from msp.utils import zlog
+from msp.nn import BK
+from msp.zext.seq_data import ChunksSeq
+from tasks.zmlm.model.mods.seqcrf import SeqCrfNode, crf_logz, crf_viterbi, crf_gold_score, crf_bucketing, START_TAG
+
+class _FakeVocab:
+    def __init__(self, words):
+        self.words = words
+    def idx2word(self, idx):
+        return self.words[idx]
+
+class _FakeCrf:
+    def __init__(self, tag_forms):
+        self.tagset_size = len(tag_forms) + 1  # 0 is NON
+        self.vocab = _FakeVocab(["<non>"] + tag_forms)
+        trans = np.random.randn(self.tagset_size+2, self.tagset_size+2).astype(np.float32)
+        trans[:, START_TAG] = -10000.
+        trans[-1, :] = -10000.
+        trans[:, 0] = -10000.
+        trans[0, :] = -10000.
+        self.transitions = BK.input_real(trans).requires_grad_(True)
+
+def _check(a, b, info):
+    zmiss = float(BK.get_value(BK.abs(a-b)).max())
+    assert zmiss < 1e-3, f"Unmatched: {info}: {zmiss}"
+
+def main():
+    np.random.seed(1234)
+    tag_forms = ChunksSeq.full_tag_forms("BIOES", ["B-PER", "B-LOC", "B-ORG"])
+    crf = _FakeCrf(tag_forms)
+    BSIZE, SLEN, TSIZE = 6, 15, crf.tagset_size+2
+    lengths = np.asarray([15, 1, 7, 3, 12, 8])
+    mask_t = BK.input_real((np.arange(SLEN)[None, :] < lengths[:, None]).astype(np.float32)).bool()
+    emit_t = BK.input_real(np.random.randn(BSIZE, SLEN, TSIZE).astype(np.float32)*3).requires_grad_(True)
+    tags_t = BK.input_idx(np.random.randint(1, crf.tagset_size, size=[BSIZE, SLEN])) * mask_t.long()
+    # logz and gold
+    logz0, scores = SeqCrfNode._calculate_PZ(crf, emit_t, mask_t)
+    gold0 = SeqCrfNode._score_sentence(crf, scores, mask_t, tags_t)
+    for bucket_width in [0, 1, 5]:
+        logz1, = crf_bucketing(lambda e, m: (crf_logz(e, crf.transitions, m), ), bucket_width, emit_t, mask_t)
+        _check(logz0, logz1.sum(), f"logz-{bucket_width}")
+    gold1 = crf_gold_score(emit_t, crf.transitions, mask_t, tags_t)
+    _check(gold0, gold1.sum(), "gold")
+    (logz1.sum() - gold1.sum()).backward()
+    # viterbi
+    _, decode0 = SeqCrfNode._viterbi_decode(crf, emit_t, mask_t)
+    for bucket_width in [0, 4]:
+        best1, decode1 = crf_bucketing(lambda e, m: crf_viterbi(e, crf.transitions, m), bucket_width, emit_t, mask_t)
+        assert BK.get_value(decode0*mask_t.long()).tolist() == BK.get_value(decode1).tolist()
+        _check(best1, crf_gold_score(emit_t, crf.transitions, mask_t, decode1), "viterbi-score")
+    # constrained
+    trans_constraint = BK.input_real(SeqCrfNode._get_constraint(crf, "BIOES"))
+    _, decode2 = crf_viterbi(emit_t, crf.transitions+trans_constraint, mask_t)
+    valid_bigrams = ChunksSeq.valid_bigrams("BIOES", tag_forms, None)
+    for one_len, one_tags in zip(lengths, BK.get_value(decode2).tolist()):
+        one_forms = [None] + [crf.vocab.idx2word(z) for z in one_tags[:one_len]]
+        assert all(z in valid_bigrams for z in zip(one_forms, one_forms[1:]))
+        assert (one_forms[-1], "O") in valid_bigrams
+    zlog("OK")
+
+if __name__ == '__main__':
+    main()
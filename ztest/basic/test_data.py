@@ -1,6 +1,8 @@
 #
 
-from msp.data import VocabBuilder
+import os
+import tempfile
+from msp.data import VocabBuilder, Vocab
 from msp.data import TextReader
 from msp.utils import Helper
 
@@ -12,5 +14,21 @@ def main():
     v = vb.finish()
     pass
 
+# batched lookup and binary format
+def main_vocab():
+    with open("./test_utils.py") as fd:
+        all_tokens = [line.split() + ["<never-seen>"] for line in fd]
+    v = VocabBuilder.build_from_stream(Helper.join_list(all_tokens), sort_by_count=True, name="w")
+    flat, offsets = v.lookup_batch(all_tokens)
+    for i, one in enumerate(all_tokens):
+        assert flat[offsets[i]:offsets[i+1]].tolist() == [v.get_else_unk(z) for z in one] == v.lookup(one)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fname = os.path.join(tmp_dir, "v"+Vocab.BIN_SUFFIX)
+        v.write_bin(fname)
+        v.write(fname+".txt")
+        v2, v3 = Vocab.read(fname), Vocab.read(fname+".txt")
+        assert v2.__dict__ == v3.__dict__ and v2.final_words == v.final_words and v2.unk == v.unk
+
 if __name__ == '__main__':
+    main_vocab()
     main()
@@ -0,0 +1,34 @@
+#
+
+import os
+import tempfile
+import numpy as np
+from msp.data import VocabBuilder, WordVectors
+from msp.zext.embed_mm import main as embed_mm_main
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        f0, f1 = os.path.join(tmp_dir, "e0.vec"), os.path.join(tmp_dir, "e1.vec")
+        with open(f0, 'w') as fd:
+            fd.write("4 3\nthe 0.1 0.2 0.3\ncat 1 2 3\nthe 9 9 9\ndog 4 5 6\n")
+        with open(f1, 'w') as fd:
+            fd.write("mat 7 8 9\ncat 0 0 0\n")
+        # txt
+        w0 = WordVectors.load(f0)
+        w0.merge_others([WordVectors.load(f1)])
+        # mmap
+        embed_mm_main([f0, f1])
+        w1 = WordVectors.load(f0)
+        assert isinstance(w1.vecs.segs[0][0], np.memmap)
+        w1.merge_others([WordVectors.load(f1)])
+        assert w0.words == w1.words == ["the", "cat", "dog", "mat"]
+        assert np.allclose(np.stack(list(w0.vecs)), np.stack(list(w1.vecs)))
+        # filter
+        v = VocabBuilder.build_from_stream(["the", "Dog", "mat", "zzz"])
+        for wv in [w0, w1]:
+            arr = v.filter_embed(wv, init_nohit=0.)
+            assert np.allclose(arr[v["Dog"]], [4, 5, 6]) and np.allclose(arr[v["mat"]], [7, 8, 9])
+            assert np.allclose(arr[v["zzz"]], 0.)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+#
+
+# the key of the persisted epoch length (TrainingRunner.get_epoch_len_key)
+
+import os
+import tempfile
+
+from msp.utils import zlog
+from msp.zext.process_train import TrainingRunner
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = [os.path.join(tmp_dir, f"shard{i}.txt") for i in range(3)]
+        for one_path in paths:
+            with open(one_path, 'w') as fd:
+                fd.write("a b c\n")
+        multi_str = ",".join(paths)
+        _get_key = lambda p, **kwargs: TrainingRunner.get_epoch_len_key(p, batch_size=32, **kwargs)
+        key0 = _get_key(multi_str)
+        # the same files in any forms
+        assert key0 == _get_key(paths) == _get_key(os.path.join(tmp_dir, "shard*.txt"))
+        assert key0 == _get_key(tmp_dir)  # a dir (such as the compiled one)
+        # settings
+        assert key0 != _get_key(multi_str, cut=10)
+        assert key0 != TrainingRunner.get_epoch_len_key(multi_str, batch_size=16)
+        # modify one of the files
+        with open(paths[1], 'a') as fd:
+            fd.write("d e\n")
+        key1 = _get_key(multi_str)
+        assert key1 != key0
+        assert key1 == _get_key(os.path.join(tmp_dir, "shard*.txt"))
+        # only touching it (the same size)
+        os.utime(paths[2], ns=(0, 0))
+        assert _get_key(multi_str) != key1
+    zlog("OK")
+
+if __name__ == '__main__':
+    main()
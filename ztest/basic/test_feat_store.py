@@ -0,0 +1,45 @@
+#
+
+import os
+import tempfile
+import pickle
+import numpy as np
+
+from msp.zext.feat_store import FeatStoreWriter, FeatStore, main as convert_main
+
+def main():
+    entries = []
+    for i in range(50):
+        slen = np.random.randint(1, 20)
+        if i % 3 == 0:
+            entries.append((np.random.randn(slen, slen).astype(np.float32), np.random.randn(slen, slen, 5).astype(np.float32)))
+        else:
+            entries.append(np.random.randn(slen, 8).astype(np.float32))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # pickle -> store
+        pkl_file, store_file = os.path.join(tmp_dir, "a.pkl"), os.path.join(tmp_dir, "a.fstore")
+        with open(pkl_file, 'wb') as fd:
+            for one in entries:
+                pickle.dump(one, fd)
+        convert_main([pkl_file, store_file, "--dtype", "float32"])
+        # direct write
+        store_file16 = os.path.join(tmp_dir, "b.fstore")
+        with FeatStoreWriter(store_file16) as writer:
+            writer.add_list(entries)
+        #
+        assert FeatStore.is_store(store_file) and not FeatStore.is_store(pkl_file)
+        store, store16 = FeatStore(store_file), FeatStore(store_file16)
+        assert len(store) == len(entries) and len(store16) == len(entries)
+        for idx in reversed(range(len(entries))):
+            one = entries[idx]
+            for z, rtol in zip([store[idx], store16[idx]], [0., 1e-2]):
+                if isinstance(one, tuple):
+                    assert len(z) == 2
+                    for a, b in zip(one, z):
+                        assert a.shape == b.shape and np.allclose(a, b, rtol=rtol, atol=rtol)
+                else:
+                    assert one.shape == z.shape and np.allclose(one, z, rtol=rtol, atol=rtol)
+        del store, store16
+
+if __name__ == '__main__':
+    main()
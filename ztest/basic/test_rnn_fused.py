@@ -0,0 +1,57 @@
+#
+
+# fused rnn backend vs. the step-by-step one (same params, fixed dropout masks)
+
+import numpy as np
+
+from msp.utils import zlog
+from msp.nn import layers, BK
+from msp.nn.layers import RnnLayer, RnnLayerBatchFirstWrapper
+
+def main():
+    np.random.seed(1234)
+    BSIZE, SLEN, DIN, DHID = 5, 12, 20, 16
+    lengths = [12, 3, 7, 1, 12]
+    mask_arr = np.asarray([[1.]*n + [0.]*(SLEN-n) for n in lengths], dtype=np.float32)
+    input_arr = np.random.randn(BSIZE, SLEN, DIN).astype(np.float32)
+    for node_type in ["lstm", "lstm2", "gru2"]:
+        for bidirection, sep_bidirection in [(False, False), (True, False), (True, True)]:
+            pc = BK.ParamCollection()
+            rnn = RnnLayerBatchFirstWrapper(pc, RnnLayer(pc, DIN, DHID, 3, node_type=node_type, bidirection=bidirection,
+                                                         sep_bidirection=sep_bidirection, no_output_dropout=False))
+            # fixed masks (gru2 does not fuse with gdrop)
+            gdrop = 0. if node_type == "gru2" else 0.3
+            rop = layers.RefreshOptions(hdrop=0.2, idrop=0.2, gdrop=gdrop, fix_drop=True)
+            for one_mask_arr in [mask_arr, None]:
+                rnn.refresh(rop)
+                input_expr = BK.input_real(input_arr)
+                rnn.rnn_node.fused = False
+                out0 = rnn(input_expr, one_mask_arr)
+                rnn.rnn_node.fused = True
+                assert rnn.rnn_node.get_fused_lengths(BSIZE, SLEN, one_mask_arr) is not None
+                out1 = rnn(input_expr, one_mask_arr)
+                zmiss = float(BK.get_value(BK.abs(out0-out1)).max())
+                assert zmiss < 1e-4, f"Unmatched: {node_type} {bidirection} {sep_bidirection}: {zmiss}"
+                # bp
+                BK.get_value(BK.avg(out1))
+                BK.avg(out1).backward()
+    # packed or not (auto: packing only on gpu)
+    input_expr = BK.input_real(input_arr)
+    lengths_arr = np.asarray(lengths)
+    for rnn_type, n_gate in [("lstm", 4), ("gru", 3)]:
+        weights = [[BK.input_real(np.random.randn(*z).astype(np.float32)) for z in
+                    [(n_gate*DHID, DIN), (n_gate*DHID, DHID), (n_gate*DHID, ), (n_gate*DHID, )]] for _ in range(2)]
+        for one_weights, reverse in [(weights, False), (weights[:1], False), (weights[1:], True)]:
+            out0 = BK.rnn_packed(rnn_type, input_expr, lengths_arr, one_weights, reverse=reverse, packed=True)
+            out1 = BK.rnn_packed(rnn_type, input_expr, lengths_arr, one_weights, reverse=reverse, packed=False)
+            assert float(BK.get_value(BK.abs(out0-out1)).max()) < 1e-4
+    # not fusable: non-prefix masks
+    pc = BK.ParamCollection()
+    rnn = RnnLayer(pc, DIN, DHID, 1, node_type="lstm", fused=True)
+    mask_arr2 = mask_arr.copy()
+    mask_arr2[0, 2] = 0.
+    assert rnn.get_fused_lengths(BSIZE, SLEN, mask_arr2) is None
+    zlog("OK")
+
+if __name__ == '__main__':
+    main()
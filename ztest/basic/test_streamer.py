@@ -1,7 +1,12 @@
 #
 
-from msp.data import FAdapterStreamer, FileOrFdStreamer, IterStreamer, MultiCatStreamer, InstCacher, BatchArranger
-from msp.utils import Helper
+from msp.data import FAdapterStreamer, FileOrFdStreamer, IterStreamer, MultiCatStreamer, InstCacher, BatchArranger, \
+    PrefetchStreamer, ParallelMapStreamer, ShuffleStreamer, MultiJoinStreamer, MultiMixStreamer
+from msp.utils import Helper, Random
+
+# picklable for the process mode
+def _double(x):
+    return x*2
 
 def main():
     s0 = IterStreamer(range(200))
@@ -15,6 +20,60 @@ def main():
         assert nums == set(list(s2))
         zz = list(s3)
         assert nums == set(Helper.join_list(zz) + [48])
+    # parallel ones should keep the order
+    s4 = PrefetchStreamer(ParallelMapStreamer(InstCacher(IterStreamer(range(200))), lambda x: x*2, False, 3), 5)
+    for R in range(3):
+        s4.restart()
+        for _ in range(R*10):  # restart in the middle
+            s4.next()
+        assert list(s4) == [x*2 for x in range(200)]
+    s4b = ParallelMapStreamer(InstCacher(IterStreamer(range(200))), _double, False, 2, "process")
+    for R in range(2):
+        assert list(s4b) == [x*2 for x in range(200)]
+    s4b.shutdown()
+    # prefetched shuffling is deterministic even if the main thread also uses Random("data")
+    def _run_prefetch():
+        Random._seeds["data"] = Random.create_sep_generator(1234)
+        one = PrefetchStreamer(BatchArranger(InstCacher(range(200), shuffle=True), 8, 4, None, None, None, None, True), 3)
+        rets = []
+        for R in range(3):
+            for b in one:
+                Random.random_sample(1, task="data")
+                rets.append(b)
+        return rets
+    assert _run_prefetch() == _run_prefetch()
+    # bounded-buffer and shard-level shuffling
+    s5 = ShuffleStreamer(MultiCatStreamer([InstCacher(range(z, z+50)) for z in range(0, 200, 50)], shuffle=True), buffer_size=16)
+    for R in range(3):
+        zz = list(s5)
+        assert len(zz) == 200 and nums == set(zz)
+    # token-budget batching with padded cost
+    sents = ["a"*(1+i%37) for i in range(200)]
+    s6 = BatchArranger(InstCacher(sents), 100, 5, None, None, None, None, True, padding_cost=BatchArranger.get_padding_cost("tok"))
+    for R in range(3):
+        zz = list(s6)
+        assert sorted(Helper.join_list(zz)) == sorted(sents)
+        assert all(len(b)==1 or max(len(z) for z in b)*len(b)<=100 for b in zz)
+    assert s6.pad_stat_[0] <= s6.pad_stat_[1]
+    # cheap length estimation (without a dry pass)
+    s7 = BatchArranger(InstCacher(IterStreamer(range(200))), 8, 3, None, lambda x: x%50==0, lambda x: x%77==0, lambda x: -x, False)
+    s8 = BatchArranger(InstCacher(sents), 100, 5, None, None, None, None, False, padding_cost=BatchArranger.get_padding_cost("tok2"))
+    for one in [s7, s8]:
+        n = one.estimate_len()
+        assert n == len(list(one)) == one.estimate_len()
+    # multi-source mixing
+    s9 = MultiJoinStreamer([InstCacher(range(z, z+10*(i+1))) for i,z in enumerate(range(0, 400, 100))])
+    assert list(s9)[:12] == [0, 100, 200, 300, 1, 101, 201, 301, 2, 102, 202, 302]
+    s10 = MultiMixStreamer([InstCacher(range(z, z+10*(i+1))) for i,z in enumerate(range(0, 400, 100))], weights=[1,0,2,4])
+    for R in range(3):
+        zz = list(s10)
+        assert sorted(zz) == list(range(10)) + list(range(200, 230)) + list(range(300, 340))
+    s11 = MultiMixStreamer([InstCacher(range(z, z+10)) for z in range(0, 400, 100)] + [InstCacher([])],
+                           weights=[1,1,1,100,1], stop_sidx=0)
+    for R in range(20):
+        zz = list(s11)
+        assert len([z for z in zz if z<10]) == 10
+    assert s11.epochs_[0] == 20 and s11.epochs_[3] > 20*10
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,60 @@
+#
+
+# benchmark conllu reading: ConlluReader vs ConlluFastReader (column lists and light-weighted tokens)
+# python3 bench_conllu.py [UD-files...] (use a synthetic file if no files given)
+
+import sys
+import os
+import tempfile
+from msp.utils import Timer, Random, zlog, FileHelper
+from msp.zext.dpar import ConlluReader, ConlluFastReader, ConlluParse, write_conllu
+
+def _make_data(path, num_sent):
+    with open(path, 'w') as fd:
+        for _ in range(num_sent):
+            length = int(Random.randint(5, 50, task="data"))
+            words = [f"w{int(z)}" for z in Random.randint(0, 10000, size=length, task="data")]
+            fd.write("# sent_id = x\n")
+            miscs = ["SpaceAfter=No" if z%3==0 else "_" for z in range(length)]
+            write_conllu(fd, words, ["NOUN"]*length, list(range(length)), ["nmod:poss"]*length, miscs)
+
+# sentences of tokens with ConlluFastReader.parse_tokens
+def _read_fast_tokens(fd):
+    reader = ConlluFastReader()
+    return [reader.parse_tokens(z) for z in iter(lambda: FileHelper.read_multiline(fd, ConlluParse.SKIP_F), None)]
+
+_TOKEN_FIELDS = ["idx", "word", "upos", "xpos", "head", "label", "label0", "misc", "enh_heads", "enh_labels"]
+
+def _bench(name, f):
+    with Timer(tag="bench", info=name, print_date=False, quiet=True) as et:
+        rets = f()
+    zlog(f"{name}: {len(rets)} sents, {et.get_time():.3f}s, {len(rets)/max(et.get_time(),1e-8):.1f} sents/s")
+    return rets
+
+def main(args):
+    tmp_dir = None
+    if len(args) == 0:
+        tmp_dir = tempfile.TemporaryDirectory()
+        args = [os.path.join(tmp_dir.name, "syn.conllu")]
+        _make_data(args[0], 20000)
+    columns = ["word", "upos", "head", "label"]
+    for path in args:
+        zlog(f"Bench on {path}")
+        with open(path) as fd:
+            r0 = _bench("ConlluReader", lambda: list(ConlluReader().yield_ones(fd)))
+        with open(path) as fd:
+            r1 = _bench("ConlluFastReader(fd)", lambda: list(ConlluFastReader(columns).yield_ones(fd)))
+        r2 = _bench("ConlluFastReader(mmap)", lambda: ConlluFastReader(columns).read_file(path))
+        with open(path) as fd:
+            r3 = _bench("ConlluFastReader(tokens)", lambda: _read_fast_tokens(fd))
+        # check
+        gold = [{"word": p.get_props("word"), "upos": p.get_props("upos"), "head": p.get_props("head"),
+                 "label": p.get_props("label")} for p in r0]
+        assert gold == r1 and gold == r2
+        _get_fields = lambda toks: [[getattr(t, n) for n in _TOKEN_FIELDS] for t in toks]
+        assert [_get_fields(p.get_tokens()) for p in r0] == [_get_fields(z) for z in r3]
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
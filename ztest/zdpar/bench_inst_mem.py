@@ -0,0 +1,54 @@
+#
+
+# memory of the cached corpus: ParseInstance vs CompactParseInstance
+# python3 bench_inst_mem.py [file.conllu] (use a synthetic file if no files given)
+
+import sys
+import os
+import tempfile
+import tracemalloc
+from msp.utils import Random, zlog
+from msp.zext.dpar import write_conllu
+from tasks.zdpar.common.confs import DConf
+from tasks.zdpar.common.data import get_data_reader, CompactParseInstance
+from tasks.zdpar.common.vocab import ParserVocabPackage
+from tasks.zdpar.common.run import index_stream
+
+def _make_data(path, num_sent):
+    with open(path, 'w') as fd:
+        for _ in range(num_sent):
+            length = int(Random.randint(5, 50, task="data"))
+            words = [f"w{int(z)}" for z in Random.randint(0, 10000, size=length, task="data")]
+            write_conllu(fd, words, ["NOUN"]*length, list(range(length)), ["nmod:poss"]*length)
+
+def _measure(f):
+    tracemalloc.start()
+    rets = f()
+    cur, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return rets, cur
+
+def main(args):
+    tmp_dir = None
+    if len(args) == 0:
+        tmp_dir = tempfile.TemporaryDirectory()
+        args = [os.path.join(tmp_dir.name, "syn.conllu")]
+        _make_data(args[0], 5000)
+    path = args[0]
+    vpack = ParserVocabPackage.build_from_stream(DConf(), get_data_reader(path, "conllu", "", False), [])
+    insts0, mem0 = _measure(lambda: list(index_stream(get_data_reader(path, "conllu", "", False), vpack, False, False, None)))
+    insts1, mem1 = _measure(lambda: [CompactParseInstance.from_inst(z) for z in index_stream(get_data_reader(path, "conllu", "", False), vpack, False, False, None)])
+    # check
+    for a, b in zip(insts0, insts1):
+        assert a.words.idxes == b.words.idxes.tolist() and a.heads.vals == b.heads.vals.tolist()
+        assert a.chars.idxes == [z.tolist() for z in b.chars.idxes] and a.labels.vals == b.labels.vals
+        assert a.get_real_values_all() == b.get_real_values_all()
+    num_sent, num_tok = len(insts0), sum(len(z) for z in insts0)
+    zlog(f"{num_sent} sents, {num_tok} toks")
+    zlog(f"ParseInstance: {mem0/(1<<20):.2f}MB, {mem0/num_sent:.1f}B/sent")
+    zlog(f"CompactParseInstance: {mem1/(1<<20):.2f}MB, {mem1/num_sent:.1f}B/sent")
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
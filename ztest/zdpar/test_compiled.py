@@ -0,0 +1,65 @@
+#
+
+# compiled corpus: the same indexed instances as reading the text, and re-indexing with different vocabs
+
+import os
+import tempfile
+import numpy as np
+
+from msp.utils import zlog
+from msp.zext.dpar import write_conllu
+from tasks.zdpar.common.confs import DConf
+from tasks.zdpar.common.data import get_data_reader
+from tasks.zdpar.common.vocab import ParserVocabPackage
+from tasks.zdpar.common.run import IndexerStreamer
+from tasks.zdpar.common.compiled import compile_corpus, CompiledParseReader
+
+def _make_data(path, num_sent):
+    with open(path, 'w') as fd:
+        for _ in range(num_sent):
+            length = np.random.randint(1, 15)
+            words = [np.random.choice(["Word", "word", "w"]) + str(z) for z in np.random.randint(0, 50, size=length)]
+            poses = [np.random.choice(["NOUN", "VERB", "ADP"]) for _ in range(length)]
+            heads = [int(np.random.randint(0, i+1)) for i in range(length)]  # always to a previous one
+            labels = [np.random.choice(["nsubj", "obj", "nmod:poss"]) for _ in range(length)]
+            write_conllu(fd, words, poses, heads, labels)
+
+def _check_same(insts0, insts1):
+    assert len(insts0) == len(insts1)
+    for a, b in zip(insts0, insts1):
+        assert a.words.vals == b.words.vals and a.words.idxes == b.words.idxes
+        assert a.poses.vals == b.poses.vals and a.poses.idxes == b.poses.idxes
+        assert list(a.heads.vals) == list(b.heads.vals)
+        assert a.labels.vals == b.labels.vals and a.labels.idxes == b.labels.idxes
+        assert a.chars.idxes == b.chars.idxes
+
+def main():
+    np.random.seed(1234)
+    aug_code = "en"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "syn.conllu")
+        _make_data(path, 100)
+        _get_text_reader = lambda: get_data_reader(path, "conllu", aug_code, False)
+        vpack = ParserVocabPackage.build_from_stream(DConf(), _get_text_reader(), [])
+        compiled_dir = path + ".compiled"
+        num_sent = compile_corpus(_get_text_reader(), vpack, compiled_dir, aug_code)
+        assert num_sent == 100
+        # the same vocabs: directly use the compiled idxes
+        gold_insts = list(IndexerStreamer(_get_text_reader(), vpack, None))
+        compiled_insts = list(IndexerStreamer(get_data_reader(compiled_dir, "compiled", "", False), vpack, None))
+        assert all(z.compiled_vocab_sig == vpack.get_sig() for z in compiled_insts)
+        _check_same(gold_insts, compiled_insts)
+        # different vocabs (another word-normer and a partial corpus): re-indexed when reading
+        dconf2 = DConf()
+        dconf2.lower_case = not dconf2.lower_case
+        dconf2.norm_digit = not dconf2.norm_digit
+        vpack2 = ParserVocabPackage.build_from_stream(dconf2, get_data_reader(path, "conllu", aug_code, False, cut="20"), [])
+        assert vpack2.get_sig() != vpack.get_sig()
+        gold_insts2 = list(IndexerStreamer(_get_text_reader(), vpack2, None))
+        compiled_insts2 = list(IndexerStreamer(CompiledParseReader(compiled_dir), vpack2, None))
+        _check_same(gold_insts2, compiled_insts2)
+        assert any(a.words.idxes != b.words.idxes for a, b in zip(gold_insts, gold_insts2))
+    zlog("OK")
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,11 @@
 #
 
 from msp.utils import Timer
-from tasks.zdpar.algo.mst import mst_unproj
+from tasks.zdpar.algo.mst import mst_unproj, mst_unproj_batched, mst_proj, marginal_proj, marginal_unproj
 from tasks.zdpar.algo.cmst import cmst_unproj, cmst_proj, cmarginal_proj
+from tasks.zdpar.algo.pool import DecPoolConf, DecPool
+from tasks.zdpar.algo.nmst import tmst_proj, tmarginal_proj, nmarginal_unproj, nmarginal_unproj_logz
+from msp.nn import BK
 import numpy as np
 
 # ===============
@@ -258,7 +261,7 @@ def main():
         else:
             scores = rand_sample([BS, one_maxlen, one_maxlen])
             orig_scores = np.array(np.transpose(scores, [0, 2, 1]), copy=True, dtype=np.float32)
-        lengths = np.random.randint(4, one_maxlen, BS)
+        lengths = np.random.randint(4, one_maxlen, BS).astype(np.int32)  # ITYPE of cmst
         all_scores.append(scores)
         all_orig_scores.append(orig_scores)
         all_lengths.append(lengths)
@@ -266,6 +269,7 @@ def main():
     #
     all_orig_mst_results = []
     all_mst_results = []
+    all_bmst_results = []
     all_cmst_results = []
     all_cmst_results_proj = []
     # =====
@@ -300,14 +304,21 @@ def main():
         for scores, lengths, one_labeled in zip(all_scores, all_lengths, all_one_labeled):
             mst_results = mst_unproj(scores, lengths, labeled=one_labeled)
             all_mst_results.append(mst_results)
+    with Timer("", "BMST"):
+        for scores, lengths, one_labeled in zip(all_scores, all_lengths, all_one_labeled):
+            bmst_results = mst_unproj_batched(scores, lengths, labeled=one_labeled)
+            all_bmst_results.append(bmst_results)
     # check
     for idx in range(R):
         orig_mst_results, mst_results, cmst_results, one_labeled, one_maxlen = \
             all_orig_mst_results[idx], all_mst_results[idx], all_cmst_results[idx], all_one_labeled[idx], all_lengths[idx]
+        bmst_results = all_bmst_results[idx]
         cmst_results_proj = all_cmst_results_proj[idx]
         for i in range(2 if one_labeled else 1):
             assert np.all(orig_mst_results[i]==mst_results[i])
             assert np.all(cmst_results[i]==mst_results[i])
+            assert np.all(bmst_results[i]==mst_results[i])
+        assert np.allclose(bmst_results[2], mst_results[2])
         # only check arcs for proj vs. unproj
         equal_rate = np.average(cmst_results_proj[0] == cmst_results[0])
         print("Equal rate at this time is %s." % equal_rate)
@@ -316,13 +327,156 @@ def main():
 def main2():
     L = 5
     x = np.zeros([1,L,L], dtype=np.float32)
-    cur_marginals = cmarginal_proj(x, np.asarray([L]), labeled=False)
+    cur_marginals = cmarginal_proj(x, np.asarray([L], dtype=np.int32), labeled=False)
     pass
 
+# benchmark the batched unproj decoder on larger batches of long sentences
+def main3():
+    np.random.seed(12345)
+    R = 10
+    BS = 64
+    MAXL = 100
+    all_scores = []
+    all_lengths = []
+    for _ in range(R):
+        scores = rand_sample([BS, MAXL, MAXL])
+        lengths = np.random.randint(MAXL//2, MAXL, BS).astype(np.int32)
+        all_scores.append(scores)
+        all_lengths.append(lengths)
+    #
+    all_results = {}
+    for name, f in [("MST", mst_unproj), ("CMST", cmst_unproj), ("BMST", mst_unproj_batched)]:
+        with Timer("", name):
+            all_results[name] = [f(scores, lengths, labeled=False) for scores, lengths in zip(all_scores, all_lengths)]
+    for mst_results, cmst_results, bmst_results in zip(all_results["MST"], all_results["CMST"], all_results["BMST"]):
+        assert np.all(mst_results[0]==bmst_results[0])
+        assert np.all(cmst_results[0]==bmst_results[0])
+    # labeled ones: heads and labels (excluding the instances with ties)
+    NL = 20
+    num_checked = 0
+    for scores, lengths in zip(all_scores[:3], all_lengths[:3]):
+        labeled_scores = scores[:, :, :, np.newaxis] + rand_sample([BS, MAXL, MAXL, NL]) / 10
+        no_ties = ~_has_ties(labeled_scores, lengths)
+        rets = [f(labeled_scores, lengths, labeled=True) for f in [mst_unproj, cmst_unproj, mst_unproj_batched]]
+        for one_rets in rets[:2]:
+            for i in range(2):
+                assert np.all(one_rets[i][no_ties] == rets[2][i][no_ties])
+            assert np.allclose(one_rets[2][no_ties], rets[2][2][no_ties])
+        num_checked += no_ties.sum()
+    assert num_checked > 0
+    # pooled decoding should be the same as the serial one
+    for mode in ["thread", "process"]:
+        pool_conf = DecPoolConf()
+        pool_conf.mode = mode
+        pool = DecPool(pool_conf)
+        with Timer("", "CMST-"+mode):
+            pool_results = [pool.run_batched(cmst_unproj, scores, lengths) for scores, lengths in zip(all_scores, all_lengths)]
+        for cmst_results, one_pool_results in zip(all_results["CMST"], pool_results):
+            assert np.all(cmst_results[0]==one_pool_results[0]) and np.all(cmst_results[2]==one_pool_results[2])
+        pool.shutdown()
+
+# whether there are exactly tied scores in the valid part of each instance (the decoders may break ties differently)
+# scores: [bs, len-m, len-h, (L)] -> [bs]
+def _has_ties(scores, lengths):
+    rets = []
+    for one_scores, one_len in zip(scores, lengths):
+        one_scores = one_scores[:one_len, :one_len]
+        if one_scores.ndim == 3:
+            sorted_labels = np.sort(one_scores, axis=-1)
+            one_ties = np.any(sorted_labels[:, :, -1] == sorted_labels[:, :, -2])
+            one_scores = sorted_labels[:, :, -1]
+        else:
+            one_ties = False
+        rets.append(one_ties or len(np.unique(one_scores)) < one_scores.size)
+    return np.asarray(rets)
+
+# check the tensorized Eisner against the cython ones
+def main4():
+    np.random.seed(12345)
+    R = 20
+    BS = 32
+    MAXL = 50
+    for _ in range(R):
+        # smaller scores than rand_sample, otherwise float32 is not enough for the marginals
+        scores = (3*np.random.randn(BS, MAXL, MAXL)).astype(np.float32)
+        lengths = np.random.randint(2, MAXL, BS).astype(np.int32)
+        scores_expr = BK.input_real(scores)
+        with Timer("", "CMST-proj"):
+            cmst_results = cmst_proj(scores, lengths, labeled=False)
+            cmarginals = cmarginal_proj(scores, lengths, labeled=False)
+        with Timer("", "TMST-proj"):
+            theads, _ = tmst_proj(scores_expr, lengths)
+            tmarginals = tmarginal_proj(scores_expr, lengths)
+        assert np.all(cmst_results[0]==BK.get_value(theads))
+        valid = (np.arange(MAXL)[np.newaxis, :] < lengths[:, np.newaxis]).astype(np.float32)
+        valid2 = valid[:, :, np.newaxis] * valid[:, np.newaxis, :]
+        assert np.allclose(cmarginals*valid2, BK.get_value(tmarginals)*valid2, atol=1e-3)
+
+# check the LU-based logZ marginals against the inverse-based ones
+def main5():
+    np.random.seed(12345)
+    R = 10
+    BS = 32
+    MAXL = 60
+    NL = 10
+    for _ in range(R):
+        scores = (3*np.random.randn(BS, MAXL, MAXL, NL)).astype(np.float32)
+        lengths = np.random.randint(2, MAXL, BS).astype(np.int32)
+        masks = (np.arange(MAXL)[np.newaxis, :] < lengths[:, np.newaxis]).astype(np.float32)
+        scores_expr, mask_expr = BK.input_real(scores), BK.input_real(masks)
+        with BK.no_grad_env():
+            with Timer("", "MARG-inv"):
+                marginals = nmarginal_unproj(scores_expr.clone(), mask_expr, lengths)
+            with Timer("", "MARG-logz"):
+                marginals2, _ = nmarginal_unproj_logz(scores_expr, mask_expr, lengths)
+        assert np.allclose(BK.get_value(marginals), BK.get_value(marginals2), atol=1e-3)
+    # peaky scores (a cycle) make the slogdet fail, those fall back to the inverse-based ones
+    scores = np.random.randn(2, 6, 6, 3).astype(np.float32)
+    scores[1, 1, 2] = scores[1, 2, 1] = 3000.
+    lengths = np.asarray([6, 4], dtype=np.int32)
+    scores_expr = BK.input_real(scores)
+    mask_expr = BK.input_real((np.arange(6)[np.newaxis, :] < lengths[:, np.newaxis]).astype(np.float32))
+    marginals2, logz = nmarginal_unproj_logz(scores_expr, mask_expr, lengths)
+    assert not np.isfinite(BK.get_value(logz)[1])
+    marginals = nmarginal_unproj(scores_expr, mask_expr, lengths)
+    assert np.allclose(BK.get_value(marginals), BK.get_value(marginals2), atol=1e-3)
+
+# micro-benchmark for the numpy fallbacks (against cython if compiled)
+def main6():
+    try:
+        from tasks.zdpar.algo import cmst
+    except ImportError:
+        cmst = None
+    np.random.seed(12345)
+    R = 10
+    BS = 64
+    MAXL = 60
+    all_scores = [(3*np.random.randn(BS, MAXL, MAXL)).astype(np.float32) for _ in range(R)]
+    all_lengths = [np.random.randint(2, MAXL, BS).astype(np.int32) for _ in range(R)]
+    for name, py_f, c_f in [("proj", mst_proj, "cmst_proj"), ("marginal_proj", marginal_proj, "cmarginal_proj")]:
+        with Timer("", "PY-"+name):
+            py_results = [py_f(scores, lengths, labeled=False) for scores, lengths in zip(all_scores, all_lengths)]
+        if cmst is None:
+            continue
+        with Timer("", "C-"+name):
+            c_results = [getattr(cmst, c_f)(scores, lengths, labeled=False) for scores, lengths in zip(all_scores, all_lengths)]
+        for py_one, c_one in zip(py_results, c_results):
+            if name == "proj":
+                assert np.all(py_one[0] == c_one[0])
+            else:
+                assert np.allclose(py_one, c_one, atol=1e-3)  # cmst is float32
+    with Timer("", "PY-marginal_unproj"):
+        for scores, lengths in zip(all_scores, all_lengths):
+            marginal_unproj(scores, lengths, labeled=False)
+
 #
 if __name__ == '__main__':
     main2()
     main()
+    main3()
+    main4()
+    main5()
+    main6()
 
 """
 Results of testing: about 5x speedup
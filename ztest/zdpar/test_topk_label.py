@@ -0,0 +1,84 @@
+#
+
+# label scoring of only the top-k heads (iconf.dec_label_topk) in GraphParser.inference_on_batch
+
+import numpy as np
+
+from msp.utils import zlog
+from msp.nn import layers, BK
+from tasks.zdpar.graph.parser import GraphParser, GraphParserConf
+from tasks.zdpar.graph.scorer import GraphScorer
+
+# only the fields that inference_on_batch touches
+class _Field:
+    def __init__(self):
+        self.vals = None
+
+    def set_vals(self, vals):
+        self.vals = vals
+
+    def build_vals(self, vals, vocab):
+        self.vals = vals
+
+class _Inst:
+    def __init__(self, length):
+        self.length = length
+        self.pred_heads, self.pred_labels, self.pred_par_scores = _Field(), _Field(), _Field()
+
+    def __len__(self):
+        return self.length
+
+# a parser with only the scorer, the inputs are directly the encoded reprs
+def _make_parser(enc_expr, mask_expr, D, NL):
+    conf = GraphParserConf()
+    conf.sc_conf._input_dim = D
+    conf.sc_conf._num_label = NL
+    conf.sc_conf.lab_biaffine_rank = 4
+    parser = object.__new__(GraphParser)
+    parser.conf = conf
+    parser.pc = BK.ParamCollection()
+    parser.scorer = GraphScorer(parser.pc, conf.sc_conf)
+    parser.scorer.refresh(layers.RefreshOptions(training=False))
+    parser.dec_pool = None
+    parser.norm_single, parser.norm_local, parser.norm_global, parser.norm_hlocal = False, True, False, False
+    parser.loss_prob = True
+    parser.alg_proj, parser.alg_unproj, parser.alg_greedy = False, True, False
+    parser.label_vocab = None
+    parser.refresh_batch = lambda training: None
+    parser.pred2real_labels = lambda x: x
+    parser._prepare_score = lambda insts, training: \
+        (parser.scorer.transform_space(enc_expr), mask_expr, (None, None, None))
+    return parser
+
+def _run(parser, lengths, k):
+    parser.conf.iconf.dec_label_topk = k
+    insts = [_Inst(z) for z in lengths]
+    parser.inference_on_batch(insts)
+    return [(np.asarray(z.pred_heads.vals), np.asarray(z.pred_labels.vals), np.asarray(z.pred_par_scores.vals))
+            for z in insts]
+
+def main():
+    np.random.seed(1234)
+    BSIZE, SLEN, D, NL = 3, 12, 16, 5
+    lengths = [SLEN-1, 6, 8]  # without root
+    mask_arr = (np.arange(SLEN)[np.newaxis, :] <= np.asarray(lengths)[:, np.newaxis]).astype(np.float32)
+    enc_expr = BK.input_real(np.random.randn(BSIZE, SLEN, D).astype(np.float32))
+    mask_expr = BK.input_real(mask_arr)
+    parser = _make_parser(enc_expr, mask_expr, D, NL)
+    full_res = _run(parser, lengths, 0)
+    # k >= length (but < max-len, thus still the pruned path) -> same as full
+    for one_full, one_topk in zip(full_res, _run(parser, lengths, SLEN-1)):
+        for a, b in zip(one_full, one_topk):
+            assert np.allclose(a, b, atol=1e-5), f"Unmatched: {a} vs {b}"
+    # k=1: the heads forced by the tree still get their own best labels
+    with BK.no_grad_env():
+        scoring_expr_pack = parser.scorer.transform_space(enc_expr)
+        full_label_arr = BK.get_value(parser._score_label_full(scoring_expr_pack, mask_expr, False, 0.))
+    for bidx, (heads, labels, scores) in enumerate(_run(parser, lengths, 1)):
+        for m in range(1, lengths[bidx]+1):
+            assert labels[m] == full_label_arr[bidx, m, heads[m]].argmax()
+            assert np.isfinite(scores[m]) and scores[m] > 0.
+    zlog("OK")
+
+if __name__ == '__main__':
+    main()